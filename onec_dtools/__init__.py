@@ -1,4 +1,10 @@
 from onec_dtools.database_reader import DatabaseReader
-from onec_dtools.container_reader import ContainerReader, extract
-from onec_dtools.container_writer import ContainerWriter, build
+from onec_dtools.container_reader import ContainerReader, extract, extract_to_archive, sync
+from onec_dtools.container_writer import ContainerWriter, build, build_from_tar
+from onec_dtools.container_updater import ContainerUpdater, update
+from onec_dtools.container_diff import diff_containers
+from onec_dtools.container_fs import ContainerFS
 from onec_dtools.supply_reader import SupplyReader
+from onec_dtools.supply_writer import SupplyWriter, build_supply
+from onec_dtools.database_export import DatabaseExporter, export
+from onec_dtools import stats
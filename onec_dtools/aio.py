@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Асинхронный интерфейс (asyncio) для чтения контейнеров, файлов поставок и файлов БД.
+
+Чтение файлов и разархивирование выполняются в пуле (executor), поэтому цикл событий не блокируется.
+Модуль требует Python 3.5+ и не импортируется пакетом onec_dtools автоматически.
+"""
+import asyncio
+import collections
+import threading
+import zlib
+from onec_dtools.container_reader import ContainerReader
+from onec_dtools.supply_reader import SupplyReader
+from onec_dtools.database_reader import DatabaseReader
+
+# Количество элементов, считанных с опережением потребителя
+QUEUE_SIZE = 16
+# Размер блока данных при потоковом чтении файлов контейнера, байт
+STREAM_CHUNK_SIZE = 64 * 1024
+# Количество блоков BLOB, считываемых за одно обращение к файлу БД
+BLOB_READ_CHUNKS = 256
+
+_ITEM, _END, _ERROR = range(3)
+
+
+class _Channel(object):
+    """
+    Очередь элементов от потока пула к циклу событий. Количество непрочитанных элементов ограничено:
+    поток пула ожидает, пока потребитель не заберет элементы.
+    """
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.slots = threading.Semaphore(queue_size)
+        self.closed = threading.Event()
+
+    def put(self, kind, value):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (kind, value))
+        except RuntimeError:
+            # Цикл событий закрыт - элементы больше никому не нужны
+            self.closed.set()
+
+    def produce(self, iterable_factory):
+        """
+        Перебирает итератор в потоке пула, передавая элементы в очередь
+        """
+        try:
+            for item in iterable_factory():
+                self.slots.acquire()
+                if self.closed.is_set():
+                    return
+                self.put(_ITEM, item)
+        except Exception as exc:
+            self.put(_ERROR, exc)
+            return
+        self.put(_END, None)
+
+    def close(self):
+        self.closed.set()
+        # Освобождаем поток пула, если он ожидает места в очереди
+        self.slots.release()
+
+
+class ExecutorIterator(object):
+    """
+    Асинхронный итератор поверх блокирующего итератора, перебираемого в пуле.
+    Элементы считываются с опережением не более чем на queue_size.
+
+    Пока итератор не исчерпан или не закрыт, он занимает поток пула. Прерванный перебор следует закрывать
+    явно (close или async with), иначе поток освобождается только при удалении итератора.
+
+    :param iterable_factory: функция без параметров, возвращающая блокирующий итератор.
+        Вызывается в потоке пула
+    :type iterable_factory: callable
+    :param executor: пул. None - пул цикла событий по умолчанию
+    :type executor: concurrent.futures.Executor
+    :param queue_size: количество элементов, считываемых с опережением
+    :type queue_size: int
+    """
+    def __init__(self, iterable_factory, executor=None, queue_size=QUEUE_SIZE):
+        self._factory = iterable_factory
+        self._executor = executor
+        self._queue_size = queue_size
+        self._channel = None
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        if self._channel is None:
+            loop = asyncio.get_event_loop()
+            self._channel = _Channel(loop, self._queue_size)
+            loop.run_in_executor(self._executor, self._channel.produce, self._factory)
+
+        kind, value = await self._channel.queue.get()
+        self._channel.slots.release()
+        if kind == _ITEM:
+            return value
+        self._done = True
+        if kind == _ERROR:
+            raise value
+        raise StopAsyncIteration
+
+    def close(self):
+        """
+        Прекращает перебор и освобождает поток пула
+        """
+        self._done = True
+        if self._channel is not None:
+            self._channel.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def locked(iterator, lock):
+    """
+    Создает генератор, получающий каждый элемент итератора под блокировкой.
+    Позволяет чередовать обращения нескольких итераторов к одному файлу.
+
+    :param iterator: итератор
+    :param lock: блокировка
+    :type lock: threading.Lock
+    :return: генератор элементов
+    """
+    while True:
+        with lock:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class _AsyncReader(object):
+    """
+    Общая часть асинхронных классов чтения: файл, открываемый при первом обращении, и блокировка,
+    под которой выполняются все обращения к нему.
+
+    :param filename: имя файла
+    :type filename: string
+    :param reader_factory: класс (функция) синхронного чтения, создающий объект чтения по объекту файла
+    :type reader_factory: callable
+    :param executor: пул. None - пул цикла событий по умолчанию
+    :type executor: concurrent.futures.Executor
+    :param queue_size: количество блоков данных, считываемых с опережением
+    :type queue_size: int
+    """
+    def __init__(self, filename, reader_factory, executor=None, queue_size=QUEUE_SIZE):
+        self.filename = filename
+        self._reader_factory = reader_factory
+        self.executor = executor
+        self.queue_size = queue_size
+        self._file = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _get_reader(self):
+        """
+        Возвращает объект чтения. Вызывается в потоке пула под блокировкой.
+        """
+        if self._reader is None:
+            self._file = open(self.filename, 'rb')
+            try:
+                self._reader = self._reader_factory(self._file)
+            except Exception:
+                self._file.close()
+                self._file = None
+                raise
+        return self._reader
+
+    def _call_locked(self, func, *args):
+        with self._lock:
+            return func(self._get_reader(), *args)
+
+    async def _run(self, func, *args):
+        """
+        Выполняет функцию в пуле
+        """
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def _run_locked(self, func, *args):
+        """
+        Выполняет функцию от объекта чтения в пуле под блокировкой
+        """
+        return await self._run(self._call_locked, func, *args)
+
+    def _iterate(self, iterable_factory):
+        return ExecutorIterator(iterable_factory, self.executor, self.queue_size)
+
+    def close(self):
+        """
+        Закрывает файл
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._reader = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _extract_container(filename, path, deflate, recursive):
+    with open(filename, 'rb') as f:
+        ContainerReader(f).extract(path, deflate, recursive)
+
+
+class AsyncContainerReader(_AsyncReader):
+    """
+    Асинхронный класс для чтения контейнеров.
+
+    Запросы к одному объекту могут выполняться одновременно: потоковое чтение файлов контейнера использует общий
+    файл, обращения к которому чередуются поблочно, а разархивирование выполняется вне блокировки.
+    Распаковка открывает файл контейнера заново и не блокирует остальные запросы.
+
+    :param filename: имя файла контейнера
+    :type filename: string
+    :param executor: пул. None - пул цикла событий по умолчанию
+    :type executor: concurrent.futures.Executor
+    :param queue_size: количество блоков данных, считываемых с опережением
+    :type queue_size: int
+    """
+    def __init__(self, filename, executor=None, queue_size=QUEUE_SIZE):
+        super(AsyncContainerReader, self).__init__(filename, ContainerReader, executor, queue_size)
+
+    async def entries(self):
+        """
+        Считывает описания файлов контейнера
+
+        :return: словарь {имя файла: файл контейнера}. Данные файлов (data) не заполняются
+        :rtype: OrderedDict
+        """
+        def read_entries(reader):
+            return collections.OrderedDict((name, reader.entries[name]._replace(data=None))
+                                           for name in reader.entries)
+        return await self._run_locked(read_entries)
+
+    def read(self, name, inflate=False, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Создает асинхронный итератор данных файла контейнера
+
+        :param name: имя файла. Файлы вложенных контейнеров указываются через "/"
+        :type name: string
+        :param inflate: разархивировать содержимое файла
+        :type inflate: bool
+        :param chunk_size: размер блока данных (байт)
+        :type chunk_size: int
+        :return: асинхронный итератор блоков данных
+        :rtype: ExecutorIterator
+        """
+        # Файлы верхнего уровня разархивируются вне блокировки,
+        # вложенный контейнер разархивируется при открытии файла
+        inflate_unlocked = inflate and '/' not in name
+
+        def chunks():
+            f = self._call_locked(lambda reader: reader.open(name, inflate and not inflate_unlocked))
+            raw = locked(iter(lambda: f.read(chunk_size), b''), self._lock)
+            if not inflate_unlocked:
+                yield from raw
+                return
+            # wbits = -15 т.к. у архивированных файлов нет заголовоков
+            decompressor = zlib.decompressobj(-15)
+            for chunk in raw:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            data = decompressor.flush()
+            if data:
+                yield data
+
+        return self._iterate(chunks)
+
+    async def extract(self, path, deflate=False, recursive=False):
+        """
+        Распаковывает содержимое контейнера в каталог
+
+        :param path: каталог распаковки
+        :type path: string
+        :param deflate: разархивировать содержимое файлов
+        :type deflate: bool
+        :param recursive: выполнять рекурсивно
+        :type recursive: bool
+        """
+        await self._run(_extract_container, self.filename, path, deflate, recursive)
+
+
+def _call_supply(filename, method, *args):
+    with open(filename, 'rb') as f:
+        return getattr(SupplyReader(f), method)(*args)
+
+
+class AsyncSupplyReader(object):
+    """
+    Асинхронный класс для чтения файлов поставок.
+    Файл поставки - единый сжатый поток, поэтому каждый запрос открывает файл заново.
+
+    :param filename: имя файла поставки
+    :type filename: string
+    :param executor: пул. None - пул цикла событий по умолчанию
+    :type executor: concurrent.futures.Executor
+    """
+    def __init__(self, filename, executor=None):
+        self.filename = filename
+        self.executor = executor
+
+    async def _run(self, method, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, _call_supply, self.filename, method,
+                                                              *args)
+
+    async def list(self):
+        """
+        Считывает список вложенных файлов. См. SupplyReader.list
+
+        :return: список описаний вложенных файлов: (имя файла, время создания, размер файла (байт))
+        :rtype: list
+        """
+        return await self._run('list')
+
+    async def extract(self, patterns, output_dir):
+        """
+        Распаковка вложенных файлов, имена которых соответствуют шаблонам. См. SupplyReader.extract
+
+        :param patterns: шаблоны имен файлов. None - все файлы
+        :type patterns: list
+        :param output_dir: Каталог распаковки
+        :type output_dir: string
+        :return: список имен распакованных файлов
+        :rtype: list
+        """
+        return await self._run('extract', patterns, output_dir)
+
+    async def unpack(self, output_dir):
+        """
+        Распаковка файла поставки
+
+        :param output_dir: Каталог распаковки
+        :type output_dir: string
+        """
+        await self._run('unpack', output_dir)
+
+
+class AsyncDatabaseReader(_AsyncReader):
+    """
+    Асинхронный класс для чтения файлов БД.
+
+    Запросы к одному объекту могут выполняться одновременно: обращения к файлу БД чередуются построчно
+    (для полей неограниченной длины - по BLOB_READ_CHUNKS блоков).
+
+    :param filename: имя файла БД
+    :type filename: string
+    :param executor: пул. None - пул цикла событий по умолчанию
+    :type executor: concurrent.futures.Executor
+    :param queue_size: количество строк (блоков данных), считываемых с опережением
+    :type queue_size: int
+    """
+    def __init__(self, filename, executor=None, queue_size=QUEUE_SIZE):
+        super(AsyncDatabaseReader, self).__init__(filename, DatabaseReader, executor, queue_size)
+
+    async def table_names(self):
+        """
+        :return: список имен таблиц БД
+        :rtype: list
+        """
+        return await self._run_locked(lambda reader: list(reader.tables))
+
+    def table(self, name):
+        """
+        Возвращает асинхронную таблицу. Файл БД при этом не считывается.
+
+        :param name: имя таблицы
+        :type name: string
+        :return: таблица
+        :rtype: AsyncTable
+        """
+        return AsyncTable(self, name)
+
+    def blob(self, blob):
+        """
+        Создает асинхронный итератор данных поля неограниченной длины.
+        Данные возвращаются без преобразования (поля типа NT - в кодировке UTF-16).
+
+        :param blob: поле неограниченной длины из строки таблицы этой БД
+        :type blob: Blob
+        :return: асинхронный итератор блоков данных
+        :rtype: ExecutorIterator
+        """
+        def chunks():
+            chunk_iterator = iter(blob)
+            while True:
+                with self._lock:
+                    data = b''.join(x for _, x in zip(range(BLOB_READ_CHUNKS), chunk_iterator))
+                if not data:
+                    return
+                yield data
+
+        return self._iterate(chunks)
+
+    async def read_blob(self, blob):
+        """
+        Считывает значение поля неограниченной длины
+
+        :param blob: поле неограниченной длины из строки таблицы этой БД
+        :type blob: Blob
+        :return: значение поля
+        :rtype: bytes или string
+        """
+        return await self._run_locked(lambda reader: blob.value)
+
+
+def _load_row(row):
+    """
+    Преобразует значения всех полей строки. Создание объектов полей неограниченной длины обращается к файлу БД,
+    поэтому выполняется в потоке пула под блокировкой, а не при обращении к полю из цикла событий.
+    """
+    row.as_list()
+    return row
+
+
+class AsyncTable(object):
+    """
+    Асинхронная таблица файловой БД. Поддерживает перебор строк: async for row in table.
+
+    Строки возвращаются объектами Row. Поля неограниченной длины следует считывать через
+    AsyncDatabaseReader.blob или AsyncDatabaseReader.read_blob.
+
+    :param database: асинхронный объект чтения БД
+    :type database: AsyncDatabaseReader
+    :param name: имя таблицы
+    :type name: string
+    """
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    async def len(self):
+        """
+        :return: Общее количество строк в таблице (включая пустые)
+        :rtype: int
+        """
+        return await self.database._run_locked(lambda reader: len(reader.tables[self.name]))
+
+    async def get(self, index):
+        """
+        :param index: индекс строки
+        :type index: int
+        :return: строка таблицы
+        :rtype: Row
+        """
+        return await self.database._run_locked(lambda reader: _load_row(reader.tables[self.name][index]))
+
+    def iter_rows(self, start=0):
+        """
+        Создает асинхронный итератор строк таблицы, начиная с указанной
+
+        :param start: индекс первой строки
+        :type start: int
+        :return: асинхронный итератор строк
+        :rtype: ExecutorIterator
+        """
+        def rows():
+            index = start
+            while True:
+                # Каждая строка считывается отдельно: другие итераторы могут сместить позицию в таблице
+                with self.database._lock:
+                    row = next(self.database._get_reader().tables[self.name].iter_rows(index), None)
+                    if row is None:
+                        return
+                    _load_row(row)
+                yield row
+                index += 1
+
+        return self.database._iterate(rows)
+
+    def __aiter__(self):
+        return self.iter_rows()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import collections
+import difflib
+import hashlib
+import tempfile
+from onec_dtools.container_reader import read_table_of_contents, read_entry, read_document, read_entry_data, \
+    detect_format, is_container, CONTAINER_SIGNATURE_64, SPOOL_MAX_SIZE
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+Change = collections.namedtuple('Change', 'name, status, diff')
+
+
+def read_entry_offsets(file):
+    """
+    Считывает описания файлов контейнера вместе со смещениями документов данных
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :return: формат контейнера, словарь {имя файла: (файл контейнера, смещение документа данных)}
+    :rtype: tuple
+    """
+    fmt = detect_format(file)
+    entries = collections.OrderedDict()
+    for file_description_offset, file_data_offset in read_table_of_contents(file, fmt):
+        inner_file = read_entry(file, file_description_offset, file_data_offset, fmt)
+        entries[inner_file.name] = (inner_file, file_data_offset)
+    return fmt, entries
+
+
+def document_hash(file, offset, fmt):
+    """
+    Вычисляет SHA1 данных документа, считывая их по цепочке блоков без разархивирования
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :param offset: смещение документа (байт)
+    :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :return: хэш данных
+    :rtype: bytes
+    """
+    data_hash = hashlib.sha1()
+    for chunk in read_document(file, offset, fmt).data:
+        data_hash.update(chunk)
+    return data_hash.digest()
+
+
+def spool_entry(file, offset, fmt, deflate):
+    """
+    Считывает данные файла контейнера (при необходимости разархивируя их) во временный файл
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :param offset: смещение документа данных (байт)
+    :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param deflate: разархивировать данные
+    :type deflate: bool
+    :return: временный файл, позиционированный на начало данных
+    :rtype: SpooledTemporaryFile
+    """
+    document = read_document(file, offset, fmt)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in read_entry_data(document, deflate):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def text_diff(name, data_a, data_b):
+    """
+    Формирует построчную разницу данных файлов
+
+    :param name: имя файла
+    :type name: string
+    :param data_a: данные файла первого контейнера
+    :type data_a: bytes
+    :param data_b: данные файла второго контейнера
+    :type data_b: bytes
+    :return: строки разницы в формате unified diff
+    :rtype: list
+    """
+    lines_a = data_a.decode('utf-8-sig', errors='replace').splitlines(True)
+    lines_b = data_b.decode('utf-8-sig', errors='replace').splitlines(True)
+    return list(difflib.unified_diff(lines_a, lines_b, 'a/' + name, 'b/' + name))
+
+
+def diff_entries(file_a, file_b, deflate=True, recursive=True, content=False, prefix=''):
+    """
+    Создает генератор различий между файлами двух контейнеров.
+
+    Файлы сравниваются по имени, размеру и хэшу данных, считанных по цепочкам блоков без разархивирования.
+    Вложенные контейнеры разбираются только если их данные различаются.
+
+    :param file_a: объект файла первого контейнера
+    :type file_a: BufferedReader
+    :param file_b: объект файла второго контейнера
+    :type file_b: BufferedReader
+    :param deflate: данные файлов контейнеров сжаты
+    :type deflate: bool
+    :param recursive: сравнивать содержимое вложенных контейнеров
+    :type recursive: bool
+    :param content: формировать построчную разницу разархивированных данных измененных файлов
+    :type content: bool
+    :param prefix: префикс имен файлов (путь вложенного контейнера)
+    :type prefix: string
+    :return: генератор изменений
+    """
+    fmt_a, entries_a = read_entry_offsets(file_a)
+    fmt_b, entries_b = read_entry_offsets(file_b)
+
+    for name in entries_a:
+        if name not in entries_b:
+            yield Change(prefix + name, REMOVED, None)
+
+    for name, (entry_b, offset_b) in entries_b.items():
+        if name not in entries_a:
+            yield Change(prefix + name, ADDED, None)
+            continue
+
+        entry_a, offset_a = entries_a[name]
+        if entry_a.size == entry_b.size and \
+                document_hash(file_a, offset_a, fmt_a) == document_hash(file_b, offset_b, fmt_b):
+            continue
+
+        if not recursive and not content:
+            yield Change(prefix + name, MODIFIED, None)
+            continue
+
+        with spool_entry(file_a, offset_a, fmt_a, deflate) as data_a, \
+                spool_entry(file_b, offset_b, fmt_b, deflate) as data_b:
+            head_a = data_a.read(len(CONTAINER_SIGNATURE_64))
+            head_b = data_b.read(len(CONTAINER_SIGNATURE_64))
+            data_a.seek(0)
+            data_b.seek(0)
+            if recursive and is_container(head_a) and is_container(head_b):
+                # Файлы вложенных контейнеров не сжимаются
+                nested = list(diff_entries(data_a, data_b, False, recursive, content, prefix + name + '/'))
+                # Данные контейнера могут различаться только расположением блоков
+                if nested:
+                    yield Change(prefix + name, MODIFIED, None)
+                for change in nested:
+                    yield change
+            else:
+                yield Change(prefix + name, MODIFIED, text_diff(prefix + name, data_a.read(), data_b.read())
+                             if content else None)
+
+
+def diff_containers(filename_a, filename_b, recursive=True, content=False):
+    """
+    Сравнивает два контейнера без распаковки.
+    Сахар для diff_entries.
+
+    :param filename_a: имя файла первого контейнера
+    :type filename_a: string
+    :param filename_b: имя файла второго контейнера
+    :type filename_b: string
+    :param recursive: сравнивать содержимое вложенных контейнеров
+    :type recursive: bool
+    :param content: формировать построчную разницу разархивированных данных измененных файлов
+    :type content: bool
+    :return: список изменений. Имена файлов вложенных контейнеров указываются через "/"
+    :rtype: list
+    """
+    with open(filename_a, 'rb') as file_a, open(filename_b, 'rb') as file_b:
+        return list(diff_entries(file_a, file_b, recursive=recursive, content=content))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import collections
+import io
+import tempfile
+from onec_dtools.container_reader import ContainerReader, is_container, CONTAINER_SIGNATURE_64, SPOOL_MAX_SIZE
+
+# Количество разархивированных вложенных контейнеров, хранимых в кэше
+NESTED_CACHE_SIZE = 16
+EntryStat = collections.namedtuple('EntryStat', 'name, is_dir, size, created, modified')
+
+
+class ContainerFS(object):
+    """
+    Файловая система только для чтения поверх контейнера.
+    Вложенные контейнеры представлены каталогами и разархивируются только при обращении к их содержимому.
+    Разархивированные вложенные контейнеры хранятся в кэше с вытеснением давно не использованных.
+
+    Пути указываются через "/" относительно корня контейнера: "вложенный контейнер/файл".
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :param deflate: файлы контейнера сжаты
+    :type deflate: bool
+    :param cache_size: количество вложенных контейнеров в кэше
+    :type cache_size: int
+    """
+    def __init__(self, file, deflate=True, cache_size=NESTED_CACHE_SIZE):
+        self.reader = ContainerReader(file)
+        self.deflate = deflate
+        self.cache_size = cache_size
+        # Разархивированные вложенные контейнеры: {путь: (объект контейнера, временный файл)}
+        self._nested = collections.OrderedDict()
+        # Признаки вложенного контейнера: {путь: является контейнером}
+        self._is_dir = {}
+
+    @staticmethod
+    def _split(path):
+        return tuple(x for x in path.split('/') if x)
+
+    def _container(self, parts):
+        """
+        Возвращает объект вложенного контейнера по пути каталога
+        """
+        if not parts:
+            return self.reader
+        if parts in self._nested:
+            self._nested.move_to_end(parts)
+            return self._nested[parts][0]
+
+        if not self._check_dir(parts):
+            raise NotADirectoryError('/'.join(parts))
+        parent = self._container(parts[:-1])
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        with parent.open(parts[-1], inflate=self._inflate(parts)) as f:
+            while True:
+                chunk = f.read(io.DEFAULT_BUFFER_SIZE * 16)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        container = ContainerReader(spool)
+
+        self._nested[parts] = (container, spool)
+        while len(self._nested) > self.cache_size:
+            # Временный файл не закрывается явно: он может использоваться открытыми файлами
+            # и будет закрыт после удаления последней ссылки на него
+            self._nested.popitem(last=False)
+        return container
+
+    def _inflate(self, parts):
+        """
+        Файлы сжаты только в контейнере верхнего уровня
+        """
+        return self.deflate and len(parts) == 1
+
+    def _entry(self, parts):
+        """
+        Возвращает описание файла контейнера по пути
+        """
+        container = self._container(parts[:-1])
+        try:
+            return container.entries[parts[-1]]
+        except KeyError:
+            raise KeyError('/'.join(parts))
+
+    def _check_dir(self, parts):
+        """
+        Проверяет, является ли файл вложенным контейнером (по первым байтам разархивированных данных)
+        """
+        if not parts:
+            return True
+        if parts not in self._is_dir:
+            container = self._container(parts[:-1])
+            if parts[-1] not in container.entries:
+                raise KeyError('/'.join(parts))
+            with container.open(parts[-1], inflate=self._inflate(parts)) as f:
+                self._is_dir[parts] = is_container(f.read(len(CONTAINER_SIGNATURE_64)))
+        return self._is_dir[parts]
+
+    def isdir(self, path):
+        """
+        :param path: путь
+        :type path: string
+        :return: путь указывает на вложенный контейнер
+        :rtype: bool
+        """
+        return self._check_dir(self._split(path))
+
+    def listdir(self, path=''):
+        """
+        Возвращает имена файлов каталога
+
+        :param path: путь каталога
+        :type path: string
+        :return: список имен
+        :rtype: list
+        """
+        return list(self._container(self._split(path)).entries)
+
+    def stat(self, path):
+        """
+        Возвращает описание файла или каталога
+
+        :param path: путь
+        :type path: string
+        :return: описание. Размер - размер данных в контейнере (для файлов верхнего уровня - сжатых)
+        :rtype: EntryStat
+        """
+        parts = self._split(path)
+        if not parts:
+            return EntryStat('', True, None, None, None)
+        entry = self._entry(parts)
+        return EntryStat(entry.name, self._check_dir(parts), entry.size, entry.created, entry.modified)
+
+    def open(self, path):
+        """
+        Открывает файл для чтения. Разархивируется только сам файл (и содержащие его вложенные контейнеры).
+
+        :param path: путь файла
+        :type path: string
+        :return: файловый объект
+        :rtype: BufferedReader
+        """
+        parts = self._split(path)
+        if self._check_dir(parts):
+            raise IsADirectoryError(path)
+        return self._container(parts[:-1]).open(parts[-1], inflate=self._inflate(parts))
+
+    def walk(self, top=''):
+        """
+        Создает генератор обхода дерева каталогов сверху вниз, аналогично os.walk
+
+        :param top: путь начального каталога
+        :type top: string
+        :return: генератор кортежей (путь каталога, имена каталогов, имена файлов)
+        """
+        parts = self._split(top)
+        dirnames, filenames = [], []
+        for name in self._container(parts).entries:
+            (dirnames if self._check_dir(parts + (name,)) else filenames).append(name)
+        yield '/'.join(parts), dirnames, filenames
+        for name in dirnames:
+            for result in self.walk('/'.join(parts + (name,))):
+                yield result
+
+    def close(self):
+        """
+        Освобождает разархивированные вложенные контейнеры
+        """
+        for _, spool in self._nested.values():
+            spool.close()
+        self._nested.clear()
+        self.reader.close()
+
+    def __enter__(self):
+        """
+        Вход в блок. Позволяет применять оператор with.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Выход из блока. Позволяет применять оператор with.
+        """
+        self.close()
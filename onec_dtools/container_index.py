@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+INDEX_VERSION = 1
+# Размер начала файла контейнера, по которому вычисляется хэш (байт)
+KEY_HASH_SIZE = 64 * 1024
+
+
+def container_key(file):
+    """
+    Вычисляет ключ файла контейнера: размер, время изменения и SHA1 начала файла (заголовок и оглавление)
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :return: ключ контейнера
+    :rtype: dict
+    """
+    file_stat = os.fstat(file.fileno())
+    position = file.tell()
+    file.seek(0)
+    header_hash = hashlib.sha1(file.read(KEY_HASH_SIZE)).hexdigest()
+    file.seek(position)
+    return {'size': file_stat.st_size, 'mtime': file_stat.st_mtime, 'hash': header_hash}
+
+
+def load_index(path, file):
+    """
+    Загружает индекс контейнера, если он существует и соответствует файлу контейнера
+
+    :param path: имя файла индекса
+    :type path: string
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :return: список описаний файлов контейнера или None
+    :rtype: list
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != INDEX_VERSION or index.get('key') != container_key(file):
+        return None
+    return index['entries']
+
+
+def save_index(path, file, entries):
+    """
+    Сохраняет индекс контейнера.
+
+    Описание файла - словарь с ключами name, created, modified (внутреннее представление даты), size,
+    blocks (список пар [смещение данных блока, длина данных блока]) и nested (список описаний файлов вложенного
+    контейнера со смещениями относительно начала разархивированных данных или None).
+
+    :param path: имя файла индекса
+    :type path: string
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :param entries: список описаний файлов контейнера
+    :type entries: list
+    """
+    temp_name = path + '.tmp'
+    with open(temp_name, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'key': container_key(file), 'entries': entries}, f)
+    os.replace(temp_name, path)
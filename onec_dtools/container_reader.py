@@ -1,123 +1,439 @@
 # -*- coding: utf-8 -*-
-from struct import pack, unpack, calcsize
+from struct import pack, unpack, unpack_from, calcsize, Struct
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import bisect
 import collections
+import collections.abc
 import datetime
+import hashlib
+import io
+import json
+import mmap
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
 import zlib
 import os
+from onec_dtools import stats
+from onec_dtools.container_index import load_index, save_index
 
 # INT32_MAX
 END_MARKER = 2147483647
+# UINT64_MAX
+END_MARKER_64 = 18446744073709551615
+# Признаки конца цепочки блоков (в 64-разрядном формате встречается и INT64_MAX)
+END_MARKERS = frozenset([END_MARKER, END_MARKER_64, 9223372036854775807])
+BLOCK_HEADER_FORMAT = '2s8s1s8s1s8s1s2s'
+BLOCK_HEADER_SIZE = calcsize(BLOCK_HEADER_FORMAT)
+# Первые байты контейнера
+CONTAINER_SIGNATURE = b'\xFF\xFF\xFF\x7F'
+# Первые байты контейнера 64-разрядного формата
+CONTAINER_SIGNATURE_64 = b'\xFF' * 8
+# Размер блока чтения данных документа при параллельной распаковке (байт)
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+# Размер вложенного контейнера, до которого он распаковывается в памяти, а не во временном файле (байт)
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+# Допустимое расхождение времени изменения файла и файла контейнера при синхронизации (секунд)
+MTIME_TOLERANCE = 0.0001
+# Имена, которые не удаляются из каталога при синхронизации
+SYNC_KEEP = ('.git',)
+# Имя файла состояния синхронизации в каталоге распаковки
+SYNC_STATE = '.onec_sync'
+SYNC_STATE_VERSION = 1
+# Размер окна чтения при обходе цепочек блоков (байт). Смежные блоки, попавшие в окно, считываются одним чтением
+CHAIN_READ_WINDOW = 64 * 1024
+# Количество документов, цепочки блоков которых хранятся в кэше
+CHAIN_CACHE_SIZE = 1024
 Header = collections.namedtuple('Header', 'first_empty_block_offset, default_block_size')
+# Формат контейнера: формат заголовка контейнера, формат заголовка блока, формат смещения в оглавлении,
+# признак конца цепочки блоков, количество шестнадцатиричных цифр в заголовке блока
+ContainerFormat = collections.namedtuple('ContainerFormat', 'header_format, header_size, block_header_format, '
+                                                            'block_header_size, offset_format, end_marker, digits')
+#: Формат контейнера со смещениями до 2 ГБ
+FORMAT_32 = ContainerFormat('4i', calcsize('4i'), BLOCK_HEADER_FORMAT, BLOCK_HEADER_SIZE, 'i', END_MARKER, 8)
+#: Формат контейнера с 64-разрядными смещениями (новые версии платформы)
+FORMAT_64 = ContainerFormat('<QIII', calcsize('<QIII'), '2s16s1s16s1s16s1s2s', calcsize('2s16s1s16s1s16s1s2s'),
+                            'Q', END_MARKER_64, 16)
+# Скомпилированные разборщики заголовка блока (только поля размеров и смещения) по количеству цифр в заголовке.
+# Хранятся отдельно от формата, чтобы формат можно было передавать в другие процессы
+BLOCK_HEADER_PARSERS = {
+    8: Struct('2x8sx8sx8s3x'),
+    16: Struct('2x16sx16sx16s3x'),
+}
 Block = collections.namedtuple('Block', 'doc_size, current_block_size, next_block_offset, data')
 Document = collections.namedtuple('Document', 'size, data')
 File = collections.namedtuple('File', 'name, size, created, modified, data')
 
 
-def read_header(file):
+def is_container(data):
+    """
+    Проверяет, являются ли данные контейнером (по первым байтам)
+
+    :param data: начало данных (не менее 8 байт)
+    :type data: bytes
+    :return: данные являются контейнером
+    :rtype: bool
+    """
+    return data[:len(CONTAINER_SIGNATURE)] == CONTAINER_SIGNATURE or \
+        data[:len(CONTAINER_SIGNATURE_64)] == CONTAINER_SIGNATURE_64
+
+
+def detect_format(file):
+    """
+    Определяет формат контейнера по расположению разделителей в заголовке первого блока (оглавления)
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :return: формат контейнера
+    :rtype: ContainerFormat
+    """
+    length = FORMAT_64.header_size + FORMAT_64.block_header_size
+    if isinstance(file, memoryview):
+        data = bytes(file[:length])
+    else:
+        file.seek(0)
+        data = file.read(length)
+
+    block = data[FORMAT_64.header_size:]
+    digits = FORMAT_64.digits
+    if len(block) == FORMAT_64.block_header_size and block[:2] == b'\r\n' and \
+            block[2 + digits:3 + digits] == b' ' and block[3 + 2 * digits:4 + 2 * digits] == b' ':
+        return FORMAT_64
+    return FORMAT_32
+
+
+def read_header(file, fmt=FORMAT_32):
     """
     Считывыет заголовок контейнера.
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
     :return: Заголовок контейнера
     :rtype: Header
     """
-    file.seek(0)
-    fmt = '4i'
-    buff = file.read(calcsize(fmt))
-    header = unpack(fmt, buff)
-    return Header(header[0] if header[0] != END_MARKER else None, header[1])
+    if isinstance(file, memoryview):
+        header = unpack_from(fmt.header_format, file, 0)
+    else:
+        file.seek(0)
+        buff = file.read(fmt.header_size)
+        header = unpack(fmt.header_format, buff)
+    return Header(header[0] if header[0] not in END_MARKERS else None, header[1])
+
 
+def read_block_header(file, offset, fmt=FORMAT_32):
+    """
+    Считывает заголовок блока данных контейнера.
 
-def read_block(file, offset, max_data_length=None):
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param offset: смещение блока в файле контейнера (байт)
+    :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :return: размер документа, размер блока, смещение следующего блока
+    :rtype: tuple
+    """
+    if isinstance(file, memoryview):
+        header = BLOCK_HEADER_PARSERS[fmt.digits].unpack_from(file, offset)
+    else:
+        file.seek(offset)
+        header = BLOCK_HEADER_PARSERS[fmt.digits].unpack(file.read(fmt.block_header_size))
+    return int(header[0], 16), int(header[1], 16), int(header[2], 16)
+
+
+def check_block_header(data, offset, fmt=FORMAT_32):
+    """
+    Проверяет разделители заголовка блока
+
+    :param data: данные заголовка блока
+    :type data: bytes
+    :param offset: смещение блока в файле контейнера (байт)
+    :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    """
+    digits = fmt.digits
+    if len(data) < fmt.block_header_size:
+        raise BufferError('Truncated block header at offset {}'.format(offset))
+    if data[:2] != b'\r\n' or data[2 + digits:3 + digits] != b' ' or data[3 + 2 * digits:4 + 2 * digits] != b' ' \
+            or data[4 + 3 * digits:] != b' \r\n':
+        raise BufferError('Invalid block header at offset {}'.format(offset))
+
+
+def read_block(file, offset, max_data_length=None, fmt=FORMAT_32):
     """
     Считывает блок данных из контейнера.
+    Если контейнер отображен в память, заголовок блока разбирается на месте, а данные возвращаются срезом memoryview
+    без копирования.
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
     :param offset: смещение блока в файле контейнера (байт)
     :type offset: int
     :param max_data_length: максимальный размер считываемых данных из блока (байт)
     :type max_data_length: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
     :return: объект блока данных
     :rtype: Block
     """
-    file.seek(offset)
-    fmt = '2s8s1s8s1s8s1s2s'
-    buff = file.read(calcsize(fmt))
-    header = unpack(fmt, buff)
-
-    doc_size = int(header[1], 16)
-    current_block_size = int(header[3], 16)
-    next_block_offset = int(header[5], 16)
+    doc_size, current_block_size, next_block_offset = read_block_header(file, offset, fmt)
 
     if max_data_length is None:
         max_data_length = min(current_block_size, doc_size)
 
-    data = file.read(min(current_block_size, max_data_length))
+    data_length = min(current_block_size, max_data_length)
+    if isinstance(file, memoryview):
+        data_offset = offset + fmt.block_header_size
+        data = file[data_offset:data_offset + data_length]
+    else:
+        data = file.read(data_length)
+
+    if stats.collector is not None:
+        if isinstance(file, memoryview):
+            stats.collector.add('block', calls=1, bytes=fmt.block_header_size + len(data))
+        else:
+            stats.collector.add('block', calls=1, seeks=1, reads=2, bytes=fmt.block_header_size + len(data))
 
     return Block(doc_size, current_block_size, next_block_offset, data)
 
 
-def read_document_gen(file, offset):
+def read_document_gen(file, offset, fmt=FORMAT_32, chains=None):
     """
     Создает генератор чтения данных документа в контейнере.
     Первое значение генератора - размер документа (байт).
     Остальные значения - данные блоков, составляющих документ
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
     :param offset: смещение документа в контейнере (байт)
     :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков. None - создается для одного документа
+    :type chains: ChainResolver
     :return: генератор чтения данных документа
     """
-    file.seek(offset)
-    header_block = read_block(file, offset)
+    if chains is None:
+        chains = ChainResolver(file, fmt)
+    return chains.document_gen(offset)
 
-    yield header_block.doc_size
-    yield header_block.data
 
-    left_bytes = header_block.doc_size - len(header_block.data)
-    next_block_offset = header_block.next_block_offset
-
-    while left_bytes > 0 and next_block_offset != END_MARKER:
-        block = read_block(file, next_block_offset, left_bytes)
-        left_bytes -= len(block.data)
-        yield block.data
-        next_block_offset = block.next_block_offset
-
-
-def read_document(file, offset):
+def read_document(file, offset, fmt=FORMAT_32, chains=None):
     """
     Считывает документ из контейнера. В качестве данных документа возвращается генератор.
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
     :param offset: смещение документа в контейнере
     :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков
+    :type chains: ChainResolver
     :return: объект документа
     :rtype: Document
     """
-    gen = read_document_gen(file, offset)
+    gen = read_document_gen(file, offset, fmt, chains)
     size = next(gen)
     return Document(size, gen)
 
 
-def read_full_document(file, offset):
+def read_full_document(file, offset, fmt=FORMAT_32, chains=None):
     """
     Считывает документ из контейнера. Данные документа считываются целиком.
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
     :param offset: смещение документа в контейнере (байт)
     :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков
+    :type chains: ChainResolver
     :return: объект документа
     :rtype: Document
     """
-    document = read_document(file, offset)
+    document = read_document(file, offset, fmt, chains)
     return Document(document.size, b''.join([chunk for chunk in document.data]))
 
 
+def read_document_blocks(file, offset, fmt=FORMAT_32):
+    """
+    Считывает цепочку блоков документа контейнера (только заголовки блоков, без данных)
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param offset: смещение документа в контейнере (байт)
+    :type offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :return: размер документа и список пар (смещение данных блока в файле контейнера, длина данных блока)
+    :rtype: tuple
+    """
+    return ChainResolver(file, fmt).blocks(offset)
+
+
+class ChainResolver(object):
+    """
+    Обход цепочек блоков документов контейнера.
+
+    Заголовки блоков разбираются скомпилированным разборщиком. Файл читается окнами CHAIN_READ_WINDOW байт,
+    поэтому физически смежные блоки считываются одним чтением. Цепочки блоков прочитанных документов
+    хранятся в кэше, и при повторном чтении заголовки блоков не разбираются.
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param validate: проверять цепочки блоков. Неверные заголовки блоков, циклы и обрывы цепочек
+        вызывают BufferError
+    :type validate: bool
+    :param cache_size: количество документов в кэше цепочек блоков
+    :type cache_size: int
+    """
+    def __init__(self, file, fmt=FORMAT_32, validate=False, cache_size=CHAIN_CACHE_SIZE):
+        self.file = file
+        self.format = fmt
+        self.validate = validate
+        self.cache_size = cache_size
+        self._chains = collections.OrderedDict()
+        self._window_offset = 0
+        self._window = b''
+
+    def _view(self, offset, length):
+        """
+        Возвращает данные файла контейнера. Если файл не отображен в память, данные берутся из окна чтения.
+        """
+        if isinstance(self.file, memoryview):
+            return self.file[offset:offset + length]
+
+        start = offset - self._window_offset
+        if start < 0 or start + length > len(self._window):
+            self.file.seek(offset)
+            self._window = self.file.read(max(length, CHAIN_READ_WINDOW))
+            self._window_offset = offset
+            start = 0
+            if stats.collector is not None:
+                stats.collector.add('window', reads=1, seeks=1, bytes=len(self._window))
+        return self._window[start:start + length]
+
+    def _header(self, offset):
+        """
+        Считывает заголовок блока
+
+        :return: размер документа, размер блока, смещение следующего блока
+        :rtype: tuple
+        """
+        data = self._view(offset, self.format.block_header_size)
+        if self.validate:
+            check_block_header(data, offset, self.format)
+        header = BLOCK_HEADER_PARSERS[self.format.digits].unpack(data)
+        return int(header[0], 16), int(header[1], 16), int(header[2], 16)
+
+    def _walk(self, offset):
+        """
+        Создает генератор обхода цепочки блоков документа. Первое значение генератора - размер документа,
+        остальные - пары (смещение данных блока в файле контейнера, длина данных блока)
+        """
+        doc_size, block_size, next_block_offset = self._header(offset)
+        yield doc_size
+
+        visited = {offset}
+        position = 0
+        block_offset = offset
+        while True:
+            length = min(block_size, doc_size - position)
+            yield block_offset + self.format.block_header_size, length
+            position += length
+            if position >= doc_size or next_block_offset in END_MARKERS:
+                break
+            if self.validate and next_block_offset in visited:
+                raise BufferError('Block chain cycle at offset {}'.format(next_block_offset))
+            visited.add(next_block_offset)
+            block_offset = next_block_offset
+            _, block_size, next_block_offset = self._header(block_offset)
+
+        if self.validate and position < doc_size:
+            raise BufferError('Truncated block chain at offset {}: {} of {} bytes'.format(offset, position, doc_size))
+
+    def _remember(self, offset, chain):
+        self._chains[offset] = chain
+        while len(self._chains) > self.cache_size:
+            self._chains.popitem(last=False)
+
+    def blocks(self, offset):
+        """
+        Возвращает цепочку блоков документа
+
+        :param offset: смещение документа в контейнере (байт)
+        :type offset: int
+        :return: размер документа и список пар (смещение данных блока в файле контейнера, длина данных блока)
+        :rtype: tuple
+        """
+        if offset not in self._chains:
+            walk = self._walk(offset)
+            doc_size = next(walk)
+            self._remember(offset, (doc_size, list(walk)))
+        return self._chains[offset]
+
+    def document_gen(self, offset):
+        """
+        Создает генератор чтения данных документа. Первое значение генератора - размер документа (байт),
+        остальные - данные блоков. Цепочка блоков обходится по мере чтения данных.
+
+        :param offset: смещение документа в контейнере (байт)
+        :type offset: int
+        :return: генератор чтения данных документа
+        """
+        cached = offset in self._chains
+        if cached:
+            doc_size, blocks = self._chains[offset]
+            walk = iter(blocks)
+        else:
+            walk = self._walk(offset)
+            doc_size = next(walk)
+            blocks = []
+        yield doc_size
+
+        read_bytes = 0
+        for data_offset, length in walk:
+            if not cached:
+                blocks.append((data_offset, length))
+            data = self._view(data_offset, length)
+            if self.validate and len(data) < length:
+                raise BufferError('Truncated block data at offset {}'.format(data_offset))
+            read_bytes += len(data)
+            yield data
+
+        if not cached:
+            self._remember(offset, (doc_size, blocks))
+        if stats.collector is not None:
+            stats.collector.add('document', calls=1, blocks=len(blocks), bytes=read_bytes)
+
+
+def read_blocks_gen(file, blocks):
+    """
+    Создает генератор чтения данных по известной цепочке блоков
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param blocks: список пар (смещение данных блока в файле контейнера, длина данных блока)
+    :type blocks: list
+    :return: генератор данных блоков
+    """
+    for data_offset, length in blocks:
+        if isinstance(file, memoryview):
+            yield file[data_offset:data_offset + length]
+        else:
+            file.seek(data_offset)
+            yield file.read(length)
+
+
 def parse_datetime(time):
     """
     Преобразует внутренний формат хранения дат файлов в контейнере в обычную дату
@@ -131,55 +447,836 @@ def parse_datetime(time):
     return datetime.datetime(1, 1, 1) + datetime.timedelta(microseconds=time * 100)
 
 
-def read_entries(file):
+def read_table_of_contents(file, fmt=FORMAT_32, chains=None):
     """
     Считывает оглавление контейнера
 
-    :param file: объект файла контейнера
-    :type file: BufferedReader
-    :return: словарь файлов в контейнере
-    :rtype: OrderedDict
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков
+    :type chains: ChainResolver
+    :return: список пар (смещение документа описания файла, смещение документа данных файла)
+    :rtype: list
     """
     # Первый документ после заголовка содержит оглавление
-    doc = read_full_document(file, calcsize('4i'))
-    table_of_contents = [unpack('2i', x) for x in doc.data.split(pack('i', END_MARKER))[:-1]]
+    doc = read_full_document(file, fmt.header_size, fmt, chains)
+    if fmt is FORMAT_32:
+        return [unpack('2i', x) for x in doc.data.split(pack('i', END_MARKER))[:-1]]
+    # Записи оглавления: смещение описания, смещение данных, признак конца записи
+    record_format = '<3' + fmt.offset_format
+    record_size = calcsize(record_format)
+    return [unpack_from(record_format, doc.data, i)[:2] for i in range(0, len(doc.data) - record_size + 1, record_size)]
 
-    files = collections.OrderedDict()
-    for file_description_offset, file_data_offset in table_of_contents:
-        file_description_document = read_full_document(file, file_description_offset)
-        file_data = read_document(file, file_data_offset)
 
-        fmt = ''.join(['QQi', str(file_description_document.size - calcsize('QQi')), 's'])
-        file_description = unpack(fmt, file_description_document.data)
+def datetime_to_int(value):
+    """
+    Преобразует дату во внутренний формат хранения дат файлов в контейнере
+
+    :param value: дата/время
+    :type value: datetime
+    :return: внутреннее представление даты
+    :rtype: int
+    """
+    return (value - datetime.datetime(1, 1, 1)) // datetime.timedelta(microseconds=100)
+
+
+def datetime_to_epoch(value):
+    """
+    Преобразует дату в количество секунд с начала эпохи (локальное время, как в epoch2int)
+
+    :param value: дата/время
+    :type value: datetime
+    :return: время в формате Python
+    :rtype: float
+    """
+    return time.mktime(value.timetuple()) + value.microsecond / 1000000
+
+
+def file_hash(path):
+    """
+    Вычисляет SHA1 содержимого файла
+
+    :param path: имя файла
+    :type path: string
+    :return: хэш
+    :rtype: bytes
+    """
+    data_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(io.DEFAULT_BUFFER_SIZE * 16)
+            if not chunk:
+                break
+            data_hash.update(chunk)
+    return data_hash.digest()
+
+
+def remove_path(path):
+    """
+    Удаляет файл или каталог со всем содержимым
+
+    :param path: имя файла или каталога
+    :type path: string
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def load_sync_state(path):
+    """
+    Загружает состояние синхронизации каталога
+
+    :param path: имя файла состояния
+    :type path: string
+    :return: словарь {путь файла: [размер данных в контейнере, размер файла на диске]}
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except ValueError:
+        return {}
+    if not isinstance(state, dict) or state.get('version') != SYNC_STATE_VERSION:
+        return {}
+    return state['entries']
+
+
+def save_sync_state(path, entries):
+    """
+    Сохраняет состояние синхронизации каталога
+
+    :param path: имя файла состояния
+    :type path: string
+    :param entries: словарь {путь файла: [размер данных в контейнере, размер файла на диске]}
+    :type entries: dict
+    """
+    temp_name = path + '.tmp'
+    with open(temp_name, 'w', encoding='utf-8') as f:
+        json.dump({'version': SYNC_STATE_VERSION, 'entries': entries}, f)
+    os.replace(temp_name, path)
+
+
+def add_archive_directory(archive, name, modified):
+    """
+    Добавляет каталог в архив
+
+    :param archive: архив
+    :type archive: TarFile или ZipFile
+    :param name: имя каталога в архиве
+    :type name: string
+    :param modified: время изменения
+    :type modified: datetime
+    """
+    if isinstance(archive, tarfile.TarFile):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = datetime_to_epoch(modified)
+        archive.addfile(info)
+    else:
+        info = zipfile.ZipInfo(name + '/', max(modified, datetime.datetime(1980, 1, 1)).timetuple()[:6])
+        info.external_attr = (0o40755 << 16) | 0x10
+        archive.writestr(info, b'')
+
+
+def add_archive_file(archive, name, file, size, modified):
+    """
+    Добавляет файл в архив
+
+    :param archive: архив
+    :type archive: TarFile или ZipFile
+    :param name: имя файла в архиве
+    :type name: string
+    :param file: file-like объект данных файла
+    :param size: размер данных (байт)
+    :type size: int
+    :param modified: время изменения
+    :type modified: datetime
+    """
+    if isinstance(archive, tarfile.TarFile):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = datetime_to_epoch(modified)
+        archive.addfile(info, file)
+    else:
+        info = zipfile.ZipInfo(name, max(modified, datetime.datetime(1980, 1, 1)).timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        # Размер нужен заранее, чтобы при необходимости был выбран формат ZIP64
+        info.file_size = size
+        with archive.open(info, 'w') as target:
+            shutil.copyfileobj(file, target)
+
+
+def read_entry(file, file_description_offset, file_data_offset, fmt=FORMAT_32, chains=None):
+    """
+    Считывает описание файла контейнера
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param file_description_offset: смещение документа описания файла (байт)
+    :type file_description_offset: int
+    :param file_data_offset: смещение документа данных файла (байт)
+    :type file_data_offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков
+    :type chains: ChainResolver
+    :return: файл контейнера
+    :rtype: File
+    """
+    file_description_document = read_full_document(file, file_description_offset, fmt, chains)
+    file_data = read_document(file, file_data_offset, fmt, chains)
+
+    fmt = ''.join(['QQi', str(file_description_document.size - calcsize('QQi')), 's'])
+    file_description = unpack(fmt, file_description_document.data)
+
+    # Из описания формата длина имени файла определяется точно, поэтому, теоретически, мусора быть не должно
+    # По факту имя часто имеет в конце мусор, который чаще всего состоит из последовательности \x00 n-раз,
+    # но иногда бывают и другие символы после \x00. Поэтому применяем вот такой костыль:
+    name = file_description[3].decode('utf-16').partition('\x00')[0]
+    return File(name, file_data.size, parse_datetime(file_description[0]),
+                parse_datetime(file_description[1]), file_data.data)
 
-        # Из описания формата длина имени файла определяется точно, поэтому, теоретически, мусора быть не должно
-        # По факту имя часто имеет в конце мусор, который чаще всего состоит из последовательности \x00 n-раз,
-        # но иногда бывают и другие символы после \x00. Поэтому применяем вот такой костыль:
-        name = file_description[3].decode('utf-16').partition('\x00')[0]
-        inner_file = File(name, file_data.size, parse_datetime(file_description[0]),
-                          parse_datetime(file_description[1]), file_data.data)
 
+def read_entries(file, fmt=FORMAT_32):
+    """
+    Считывает оглавление контейнера
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :return: словарь файлов в контейнере
+    :rtype: OrderedDict
+    """
+    chains = ChainResolver(file, fmt)
+    files = collections.OrderedDict()
+    for file_description_offset, file_data_offset in read_table_of_contents(file, fmt, chains):
+        inner_file = read_entry(file, file_description_offset, file_data_offset, fmt, chains)
         files[inner_file.name] = inner_file
 
     return files
 
 
+class Entries(collections.abc.Mapping):
+    """
+    Словарь файлов контейнера с отложенным чтением.
+    При создании считывается только оглавление, описания файлов считываются по мере обращения к ним.
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param chains: объект обхода цепочек блоков
+    :type chains: ChainResolver
+    """
+    def __init__(self, file, fmt=FORMAT_32, chains=None):
+        self._file = file
+        self._format = fmt
+        self._chains = ChainResolver(file, fmt) if chains is None else chains
+        self._table_of_contents = read_table_of_contents(file, fmt, self._chains)
+        # Считанные описания файлов по индексу в оглавлении
+        self._entries = {}
+        self._files = {}
+        self._data_offsets = {}
+
+    def _read(self, index):
+        """
+        Возвращает описание файла по индексу в оглавлении, считывая его при первом обращении
+
+        :param index: индекс записи оглавления
+        :type index: int
+        :return: файл контейнера
+        :rtype: File
+        """
+        if index in self._entries:
+            return self._entries[index]
+        file_description_offset, file_data_offset = self._table_of_contents[index]
+        inner_file = read_entry(self._file, file_description_offset, file_data_offset, self._format, self._chains)
+        self._entries[index] = inner_file
+        self._files[inner_file.name] = inner_file
+        self._data_offsets[inner_file.name] = file_data_offset
+        return inner_file
+
+    def __getitem__(self, name):
+        """
+        Возвращает файл по имени. Описания файлов считываются до тех пор, пока нужный файл не будет найден.
+
+        :param name: имя файла
+        :type name: string
+        :return: файл контейнера
+        :rtype: File
+        """
+        if name in self._files:
+            return self._files[name]
+        for index in range(len(self._table_of_contents)):
+            if index not in self._entries:
+                inner_file = self._read(index)
+                if inner_file.name == name:
+                    return inner_file
+        raise KeyError(name)
+
+    def __iter__(self):
+        """
+        Перебирает имена файлов в порядке оглавления. Обращения к словарю во время перебора допустимы.
+        """
+        for index in range(len(self._table_of_contents)):
+            yield self._read(index).name
+
+    def __len__(self):
+        """
+        :return: Количество файлов в контейнере
+        :rtype: int
+        """
+        return len(self._table_of_contents)
+
+    def data_offset(self, name):
+        """
+        Возвращает смещение документа данных файла
+
+        :param name: имя файла
+        :type name: string
+        :return: смещение (байт)
+        :rtype: int
+        """
+        self[name]
+        return self._data_offsets[name]
+
+
+class IndexedEntries(collections.abc.Mapping):
+    """
+    Словарь файлов контейнера, построенный по сохраненному индексу. Цепочки блоков не считываются.
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param index: список описаний файлов контейнера из индекса
+    :type index: list
+    """
+    def __init__(self, file, index):
+        self._file = file
+        self._index = collections.OrderedDict((description['name'], description) for description in index)
+
+    def __getitem__(self, name):
+        """
+        Возвращает файл по имени. Данные файла считываются по сохраненной цепочке блоков.
+
+        :param name: имя файла
+        :type name: string
+        :return: файл контейнера
+        :rtype: File
+        """
+        description = self._index[name]
+        return File(name, description['size'], parse_datetime(description['created']),
+                    parse_datetime(description['modified']), read_blocks_gen(self._file, description['blocks']))
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def description(self, name):
+        """
+        Возвращает описание файла из индекса
+
+        :param name: имя файла
+        :type name: string
+        :return: описание файла
+        :rtype: dict
+        """
+        return self._index[name]
+
+
+class DocumentReader(io.RawIOBase):
+    """
+    Файловый объект для чтения документа контейнера с произвольным позиционированием.
+    Если цепочка блоков документа не задана, то она считывается при первом обращении (только заголовки блоков).
+
+    :param file: объект файла контейнера или отображение файла в память
+    :type file: BufferedReader или memoryview
+    :param offset: смещение документа в контейнере (байт)
+    :type offset: int
+    :param size: размер документа (байт)
+    :type size: int
+    :param blocks: цепочка блоков документа: список пар (смещение данных блока в файле контейнера, длина данных)
+    :type blocks: list
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :param validate: проверять полноту данных. Документ, данные которого заканчиваются раньше его размера,
+        вызывает BufferError
+    :type validate: bool
+    """
+    def __init__(self, file, offset=None, size=None, blocks=None, fmt=FORMAT_32, validate=False):
+        super(DocumentReader, self).__init__()
+        self._file = file
+        self._offset = offset
+        self._format = fmt
+        self._validate = validate
+        self._position = 0
+        self._size = None
+        # Смещения начала блоков относительно начала документа
+        self._starts = []
+        # Пары (смещение данных блока в файле контейнера, длина данных блока)
+        self._blocks = []
+        if blocks is not None:
+            self._set_blocks(size, blocks)
+
+    def _set_blocks(self, size, blocks):
+        self._size = size
+        self._blocks = [tuple(block) for block in blocks]
+        position = 0
+        for _, length in self._blocks:
+            self._starts.append(position)
+            position += length
+
+    def _build_index(self):
+        """
+        Строит индекс цепочки блоков документа
+        """
+        self._set_blocks(*read_document_blocks(self._file, self._offset, self._format))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def size(self):
+        """
+        :return: Размер документа (байт)
+        :rtype: int
+        """
+        if self._size is None:
+            self._build_index()
+        return self._size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size() + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position {}'.format(position))
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        if self._size is None:
+            self._build_index()
+        if self._position >= self._size or not self._blocks:
+            return 0
+
+        # Буфер заполняется данными нескольких блоков подряд, чтобы не читать цепочки мелких блоков по одному
+        buffer = memoryview(buffer)
+        filled = 0
+        i = bisect.bisect_right(self._starts, self._position) - 1
+        while filled < len(buffer) and i < len(self._blocks):
+            block_offset, block_length = self._blocks[i]
+            delta = self._position - self._starts[i]
+            length = min(len(buffer) - filled, block_length - delta, self._size - self._position)
+            if length <= 0:
+                break
+
+            if isinstance(self._file, memoryview):
+                data = self._file[block_offset + delta:block_offset + delta + length]
+                read = len(data)
+                buffer[filled:filled + read] = data
+            else:
+                self._file.seek(block_offset + delta)
+                read = self._file.readinto(buffer[filled:filled + length])
+            filled += read
+            self._position += read
+            if read < length:
+                break
+            i += 1
+
+        if self._validate and filled < len(buffer) and self._position < self._size:
+            raise BufferError('Document is truncated: {} of {} bytes available'.format(self._position, self._size))
+        return filled
+
+
+class InflatingReader(io.RawIOBase):
+    """
+    Файловый объект для чтения разархивированных данных документа контейнера.
+    Позиционирование вперед выполняется разархивированием с отбрасыванием данных,
+    назад - повторным разархивированием с начала документа.
+
+    :param raw: файловый объект сжатых данных
+    :type raw: DocumentReader
+    :param validate: проверять полноту сжатых данных. Оборванный поток сжатых данных вызывает BufferError
+    :type validate: bool
+    """
+    # Размер блока чтения сжатых данных
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, raw, validate=False):
+        super(InflatingReader, self).__init__()
+        self._raw = raw
+        self._validate = validate
+        self._reset()
+
+    def _reset(self):
+        self._raw.seek(0)
+        # wbits = -15 т.к. у архивированных файлов нет заголовоков
+        self._decompressor = zlib.decompressobj(-15)
+        self._buffer = b''
+        # Позиция непрочитанных данных в буфере
+        self._buffer_offset = 0
+        self._position = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Разархивирует очередную порцию данных в буфер, если непрочитанных данных в нем не осталось
+
+        :return: количество непрочитанных байт в буфере. 0 - данные закончились
+        :rtype: int
+        """
+        while self._buffer_offset >= len(self._buffer) and not self._eof:
+            chunk = self._raw.read(self.CHUNK_SIZE)
+            if chunk:
+                self._buffer = self._decompressor.decompress(chunk)
+            else:
+                self._buffer = self._decompressor.flush()
+                self._eof = True
+                if self._validate and not self._decompressor.eof:
+                    raise BufferError('Compressed data is truncated')
+            self._buffer_offset = 0
+        return len(self._buffer) - self._buffer_offset
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            while True:
+                available = self._fill()
+                if not available:
+                    break
+                self._buffer_offset += available
+                self._position += available
+            position = self._position + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position {}'.format(position))
+
+        if position < self._position:
+            self._reset()
+        while self._position < position:
+            available = self._fill()
+            if not available:
+                break
+            skip = min(available, position - self._position)
+            self._buffer_offset += skip
+            self._position += skip
+        # Позиционирование за конец данных допустимо
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        available = self._fill()
+        if not available:
+            return 0
+        length = min(len(buffer), available)
+        buffer[:length] = self._buffer[self._buffer_offset:self._buffer_offset + length]
+        self._buffer_offset += length
+        self._position += length
+        return length
+
+
+def read_entry_data(file_obj, deflate=False):
+    """
+    Создает генератор чтения данных файла контейнера
+
+    :param file_obj: файл контейнера
+    :type file_obj: File
+    :param deflate: разархивировать данные
+    :type deflate: bool
+    :return: генератор данных файла
+    """
+    if not deflate:
+        for chunk in file_obj.data:
+            yield chunk
+        return
+
+    # wbits = -15 т.к. у архивированных файлов нет заголовоков
+    decompressor = zlib.decompressobj(-15)
+    for chunk in file_obj.data:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def extract_chunks(chunks, file_path, recursive=False):
+    """
+    Записывает данные файла контейнера по мере чтения. Вложенный контейнер определяется по первым байтам данных
+    и распаковывается из памяти (или временного файла, если он слишком велик) без записи промежуточного файла.
+
+    :param chunks: итератор блоков данных файла
+    :param file_path: путь распаковки файла
+    :type file_path: string
+    :param recursive: распаковывать вложенные контейнеры
+    :type recursive: bool
+    """
+    chunks = iter(chunks)
+
+    # Каждый файл внутри контейнера может быть контейнером
+    # Для проверки является ли файл контейнером проверим первые байты
+    # Способ проверки ненадежный - нужно придумать что-то другое
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(CONTAINER_SIGNATURE_64):
+            break
+
+    if recursive and is_container(head):
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+            f.write(head)
+            for chunk in chunks:
+                f.write(chunk)
+            ContainerReader(f).extract(file_path, recursive=True)
+    else:
+        with open(file_path, 'wb') as f:
+            f.write(head)
+            for chunk in chunks:
+                f.write(chunk)
+
+
+def extract_document(container_path, size, blocks, file_path, deflate=False, recursive=False):
+    """
+    Распаковывает файл контейнера, самостоятельно считывая его данные по цепочке блоков.
+    Используется при параллельной распаковке: в процесс пула передаются только смещения блоков,
+    данные считываются и разархивируются блоками ограниченного размера.
+
+    :param container_path: имя файла контейнера
+    :type container_path: string
+    :param size: размер документа данных (байт)
+    :type size: int
+    :param blocks: цепочка блоков документа: список пар (смещение данных блока в файле контейнера, длина данных)
+    :type blocks: list
+    :param file_path: путь распаковки файла
+    :type file_path: string
+    :param deflate: разархивировать содержимое файла
+    :type deflate: bool
+    :param recursive: распаковывать вложенные контейнеры
+    :type recursive: bool
+    """
+    with open(container_path, 'rb') as f:
+        raw = DocumentReader(f, size=size, blocks=blocks)
+        if deflate:
+            raw = InflatingReader(raw)
+        extract_chunks(iter(lambda: raw.read(EXTRACT_CHUNK_SIZE), b''), file_path, recursive)
+
+
 class ContainerReader(object):
     """
     Класс для чтения контейнеров
+
+    :param file: объект файла контейнера
+    :type file: BufferedReader
+    :param use_mmap: отобразить файл контейнера в память. Данные документов возвращаются срезами memoryview
+        без копирования и не должны использоваться после закрытия объекта
+    :type use_mmap: bool
+    :param index_path: имя файла индекса контейнера. Если индекс соответствует файлу контейнера, то оглавление
+        и цепочки блоков не считываются
+    :type index_path: string
+    :param validate: проверять цепочки блоков документов. Неверные заголовки блоков, циклы и обрывы цепочек
+        вызывают BufferError
+    :type validate: bool
     """
-    def __init__(self, file):
-        header = read_header(file)
+    def __init__(self, file, use_mmap=False, index_path=None, validate=False):
+        self._source = file
+        index = None
+        if index_path is not None:
+            index = load_index(index_path, file)
+
+        self._mmap = None
+        if use_mmap:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            file = memoryview(self._mmap)
+        self.file = file
+
+        #: Формат контейнера
+        self.format = detect_format(file)
+        header = read_header(file, self.format)
         if header.default_block_size == 0:
+            self.close()
             raise BufferError('Container is empty')
 
-        self.file = file
+        #: Проверка цепочек блоков и полноты данных документов
+        self.validate = validate
         self.first_empty_block_offset = header.first_empty_block_offset
         self.default_block_size = header.default_block_size
-        #: Список файлов в контейнере
-        self.entries = read_entries(self.file)
+        #: Обход цепочек блоков документов
+        self.chains = ChainResolver(self.file, self.format, validate)
+        #: Список файлов в контейнере. Описания файлов считываются при обращении к ним
+        #: или берутся из актуального индекса
+        self.entries = Entries(self.file, self.format, self.chains) if index is None \
+            else IndexedEntries(self.file, index)
+
+    def close(self):
+        """
+        Освобождает отображение файла контейнера в память
+        """
+        if self._mmap is None:
+            return
+        self.file.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Остались срезы данных документов - отображение будет закрыто после их удаления
+            pass
+        self._mmap = None
+
+    def __enter__(self):
+        """
+        Вход в блок. Позволяет применять оператор with.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Выход из блока. Позволяет применять оператор with.
+        """
+        self.close()
+
+    def _document_blocks(self, name):
+        """
+        Возвращает размер и цепочку блоков документа данных файла контейнера
+        """
+        if isinstance(self.entries, IndexedEntries):
+            description = self.entries.description(name)
+            return description['size'], description['blocks']
+        return self.chains.blocks(self.entries.data_offset(name))
+
+    def _document(self, name):
+        """
+        Возвращает файловый объект документа данных файла контейнера
+        """
+        size, blocks = self._document_blocks(name)
+        return DocumentReader(self.file, size=size, blocks=blocks, validate=self.validate)
+
+    def open(self, name, inflate=False):
+        """
+        Открывает файл контейнера для чтения с произвольным позиционированием.
+        Файлы вложенных контейнеров указываются через "/": "вложенный контейнер/файл".
+        Вложенный контейнер при этом разархивируется.
+
+        :param name: имя файла
+        :type name: string
+        :param inflate: разархивировать содержимое файла
+        :type inflate: bool
+        :return: файловый объект
+        :rtype: BufferedReader
+        """
+        if '/' in name:
+            outer_name, _, inner_name = name.partition('/')
+            nested_index = None
+            if isinstance(self.entries, IndexedEntries):
+                nested_index = self.entries.description(outer_name)['nested']
+
+            if nested_index is None or '/' in inner_name:
+                return ContainerReader(self.open(outer_name, inflate=True), validate=self.validate)._open_nested(
+                    inner_name, inflate)
+
+            description = [x for x in nested_index if x['name'] == inner_name]
+            if not description:
+                raise KeyError(name)
+            raw = DocumentReader(self.open(outer_name, inflate=True), size=description[0]['size'],
+                                 blocks=description[0]['blocks'], validate=self.validate)
+        else:
+            raw = self._document(name)
+
+        if inflate:
+            raw = InflatingReader(raw, self.validate)
+        return io.BufferedReader(raw)
+
+    def _open_nested(self, name, inflate):
+        """
+        Открывает файл вложенного контейнера. Файлы вложенных контейнеров не сжимаются,
+        поэтому контейнеры следующих уровней вложенности открываются без разархивирования.
+        """
+        parts = name.split('/')
+        reader = self
+        for part in parts[:-1]:
+            reader = ContainerReader(reader.open(part), validate=self.validate)
+        return reader.open(parts[-1], inflate)
+
+    def build_index(self, nested=True):
+        """
+        Строит индекс контейнера: описания и цепочки блоков файлов, в том числе файлов вложенных контейнеров
+
+        :param nested: индексировать вложенные контейнеры (требует их разархивирования)
+        :type nested: bool
+        :return: список описаний файлов контейнера
+        :rtype: list
+        """
+        index = []
+        for name, file_obj in self.entries.items():
+            if isinstance(self.entries, IndexedEntries):
+                description = dict(self.entries.description(name))
+            else:
+                size, blocks = self.chains.blocks(self.entries.data_offset(name))
+                description = {
+                    'name': name,
+                    'created': datetime_to_int(file_obj.created),
+                    'modified': datetime_to_int(file_obj.modified),
+                    'size': size,
+                    'blocks': blocks,
+                    'nested': None,
+                }
+
+            if nested and description['nested'] is None:
+                with self.open(name, inflate=True) as f:
+                    if is_container(f.read(len(CONTAINER_SIGNATURE_64))):
+                        f.seek(0)
+                        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as nested_file:
+                            while True:
+                                chunk = f.read(io.DEFAULT_BUFFER_SIZE * 16)
+                                if not chunk:
+                                    break
+                                nested_file.write(chunk)
+                            description['nested'] = ContainerReader(nested_file).build_index(nested=False)
+            index.append(description)
+        return index
+
+    def save_index(self, path, nested=True):
+        """
+        Строит и сохраняет индекс контейнера
 
-    def extract(self, path, deflate=False, recursive=False):
+        :param path: имя файла индекса
+        :type path: string
+        :param nested: индексировать вложенные контейнеры
+        :type nested: bool
+        """
+        save_index(path, self._source, self.build_index(nested))
+
+    def extract(self, path, deflate=False, recursive=False, workers=None):
         """
         Распаковывает содержимое контейнера в каталог
 
@@ -189,6 +1286,8 @@ class ContainerReader(object):
         :type deflate: bool
         :param recursive: выполнять рекурсивно
         :type recursive: bool
+        :param workers: количество процессов для параллельной распаковки. None - распаковка в текущем процессе
+        :type workers: int
         """
         if os.path.exists(path) and os.path.isdir(path):
             # если необходимая директория уже есть, то она должна быть пустой
@@ -196,38 +1295,198 @@ class ContainerReader(object):
 
         os.makedirs(path)
 
+        if workers is not None:
+            self._extract_parallel(path, deflate, recursive, workers)
+            return
+
+        for filename, file_obj in self.entries.items():
+            self._extract_entry(file_obj, os.path.join(path, filename), deflate, recursive)
+
+    def _extract_entry(self, file_obj, file_path, deflate, recursive):
+        """
+        Распаковывает файл контейнера
+        """
+        extract_chunks(read_entry_data(file_obj, deflate), file_path, recursive)
+
+    def sync(self, path, deflate=False, recursive=False, compare='mtime', keep=SYNC_KEEP):
+        """
+        Синхронизирует каталог с содержимым контейнера.
+        Записываются только изменившиеся файлы, файлы и каталоги, которых нет в контейнере, удаляются.
+        Записанным файлам и каталогам вложенных контейнеров устанавливается время изменения файла контейнера.
+
+        В режиме 'mtime' данные файла не считываются из контейнера, если совпадают время изменения и размер.
+        Размер разархивированных файлов сохраняется в файле состояния SYNC_STATE в каталоге распаковки.
+        Каталог вложенного контейнера с совпадающим временем изменения не просматривается, поэтому изменения
+        внутри него, сохранившие время изменения каталога, определяются только в режиме 'hash'.
+
+        :param path: каталог распаковки
+        :type path: string
+        :param deflate: разархивировать содержимое файлов
+        :type deflate: bool
+        :param recursive: выполнять рекурсивно
+        :type recursive: bool
+        :param compare: способ определения изменений: 'mtime' - по времени изменения и размеру,
+            'hash' - по хэшу содержимого
+        :type compare: string
+        :param keep: имена файлов и каталогов верхнего уровня, которые не удаляются
+        :type keep: tuple
+        :return: количество записанных (written), неизменившихся (unchanged) и удаленных (deleted) файлов.
+            Неизменившийся каталог вложенного контейнера считается одним файлом
+        :rtype: Counter
+        """
+        if compare not in ('mtime', 'hash'):
+            raise ValueError('Unsupported compare mode: {}'.format(compare))
+        counter = collections.Counter()
+        state_path = os.path.join(path, SYNC_STATE)
+        previous = load_sync_state(state_path)
+        current = {}
+        self._sync(path, '', deflate, recursive, compare, tuple(keep) + (SYNC_STATE,), counter, previous, current)
+        save_sync_state(state_path, current)
+        return counter
+
+    def _sync(self, path, prefix, deflate, recursive, compare, keep, counter, previous, current):
+        if os.path.isfile(path):
+            os.remove(path)
+        os.makedirs(path, exist_ok=True)
+
+        names = set()
         for filename, file_obj in self.entries.items():
-            file_path = os.path.join(path, filename)
-            with open(file_path, 'wb') as f:
+            names.add(filename)
+            self._sync_entry(file_obj, os.path.join(path, filename), prefix + filename, deflate, recursive, compare,
+                             counter, previous, current)
+
+        for filename in os.listdir(path):
+            if filename not in names and filename not in keep:
+                remove_path(os.path.join(path, filename))
+                counter['deleted'] += 1
+
+    def _sync_entry(self, file_obj, file_path, name, deflate, recursive, compare, counter, previous, current):
+        """
+        Синхронизирует файл контейнера с файлом (или каталогом вложенного контейнера) на диске.
+
+        :param name: путь файла относительно каталога распаковки (с разделителем /), ключ состояния синхронизации
+        :param previous: состояние предыдущей синхронизации
+        :param current: заполняемое состояние синхронизации
+        """
+        modified = datetime_to_epoch(file_obj.modified)
+        same_mtime = compare == 'mtime' and os.path.exists(file_path) and \
+            abs(os.stat(file_path).st_mtime - modified) < MTIME_TOLERANCE
+        if same_mtime and os.path.isdir(file_path):
+            if recursive:
+                # Вложенный контейнер не изменился. Состояние файлов каталога переносится без проверки
+                nested_prefix = name + '/'
+                current.update((key, value) for key, value in previous.items() if key.startswith(nested_prefix))
+                counter['unchanged'] += 1
+                return
+        elif same_mtime:
+            # Размер разархивированного файла известен только из состояния предыдущей синхронизации
+            size = os.path.getsize(file_path)
+            if (previous.get(name) == [file_obj.size, size]) if deflate else (size == file_obj.size):
                 if deflate:
-                    # wbits = -15 т.к. у архивированных файлов нет заголовоков
-                    decompressor = zlib.decompressobj(-15)
-                    for chunk in file_obj.data:
-                        decomressed_chunk = decompressor.decompress(chunk)
-                        f.write(decomressed_chunk)
+                    current[name] = [file_obj.size, size]
+                counter['unchanged'] += 1
+                return
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+            data_hash = hashlib.sha1()
+            size = 0
+            for chunk in read_entry_data(file_obj, deflate):
+                data_hash.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+            f.seek(0)
+
+            if recursive and is_container(f.read(len(CONTAINER_SIGNATURE_64))):
+                f.seek(0)
+                ContainerReader(f)._sync(file_path, name + '/', False, True, compare, (), counter, previous, current)
+            else:
+                if same_mtime and os.path.isfile(file_path) and os.path.getsize(file_path) == size or \
+                        compare == 'hash' and os.path.isfile(file_path) and file_hash(file_path) == data_hash.digest():
+                    counter['unchanged'] += 1
+                else:
+                    if os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                    f.seek(0)
+                    with open(file_path, 'wb') as target:
+                        shutil.copyfileobj(f, target)
+                    counter['written'] += 1
+                if deflate:
+                    current[name] = [file_obj.size, size]
+
+        os.utime(file_path, (modified, modified))
+
+    def extract_to_archive(self, fileobj, archive_format='tar', deflate=False, recursive=False):
+        """
+        Распаковывает содержимое контейнера в архив без записи файлов на диск.
+        Вложенные контейнеры при рекурсивной распаковке становятся каталогами архива.
+
+        :param fileobj: file-like объект архива. Для tar может не поддерживать позиционирование
+        :param archive_format: формат архива: 'tar' или 'zip' (требует Python 3.6+)
+        :type archive_format: string
+        :param deflate: разархивировать содержимое файлов
+        :type deflate: bool
+        :param recursive: выполнять рекурсивно
+        :type recursive: bool
+        """
+        if archive_format == 'tar':
+            archive = tarfile.open(fileobj=fileobj, mode='w|')
+        elif archive_format == 'zip':
+            archive = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            raise ValueError('Unsupported archive format: {}'.format(archive_format))
+
+        with archive:
+            self._archive_entries(archive, '', deflate, recursive)
+
+    def _archive_entries(self, archive, prefix, deflate, recursive):
+        for filename, file_obj in self.entries.items():
+            name = prefix + filename
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+                size = 0
+                for chunk in read_entry_data(file_obj, deflate):
+                    f.write(chunk)
+                    size += len(chunk)
+                f.seek(0)
+                if recursive and is_container(f.read(len(CONTAINER_SIGNATURE_64))):
+                    f.seek(0)
+                    add_archive_directory(archive, name, file_obj.modified)
+                    ContainerReader(f)._archive_entries(archive, name + '/', False, True)
                 else:
-                    for chunk in file_obj.data:
-                        f.write(chunk)
+                    f.seek(0)
+                    add_archive_file(archive, name, f, size, file_obj.modified)
 
-            if not recursive:
-                continue
+    def _extract_parallel(self, path, deflate, recursive, workers):
+        """
+        Распаковывает содержимое контейнера в пуле процессов.
+        Текущий процесс только определяет цепочки блоков файлов, процессы пула сами считывают данные
+        из файла контейнера, разархивируют их и записывают на диск (включая рекурсивную распаковку вложенных
+        контейнеров). Одновременно в обработке находится не более 2 * workers файлов.
+
+        Контейнер, не связанный с файлом на диске (например, вложенный), распаковывается в текущем процессе.
+        """
+        container_path = getattr(self._source, 'name', None)
+        if not isinstance(container_path, str) or not os.path.isfile(container_path):
+            for filename, file_obj in self.entries.items():
+                self._extract_entry(file_obj, os.path.join(path, filename), deflate, recursive)
+            return
 
-            # Каждый файл внутри контейнера может быть контейнером
-            # Для проверки является ли файл контейнером проверим первые 4 бита
-            # Способ проверки ненадежный - нужно придумать что-то другое
-            file_is_container = False
-            with open(file_path, 'rb') as f:
-                if f.read(4) == b'\xFF\xFF\xFF\x7F':
-                    file_is_container = True
-            if file_is_container:
-                temp_name = file_path + '.tmp'
-                os.rename(file_path, temp_name)
-                with open(temp_name, 'rb') as f:
-                    ContainerReader(f).extract(file_path, recursive=True)
-                os.remove(temp_name)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for filename in self.entries:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
 
+                size, blocks = self._document_blocks(filename)
+                pending.add(executor.submit(extract_document, container_path, size, blocks,
+                                            os.path.join(path, filename), deflate, recursive))
 
-def extract(filename, folder):
+            for future in pending:
+                future.result()
+
+
+def extract(filename, folder, workers=None, use_mmap=False):
     """
     Распаковка контейнера. Сахар для ContainerReader
 
@@ -235,6 +1494,47 @@ def extract(filename, folder):
     :type filename: string
     :param folder: каталог назначения
     :type folder: string
+    :param workers: количество процессов для параллельной распаковки. None - распаковка в текущем процессе
+    :type workers: int
+    :param use_mmap: отобразить файл контейнера в память
+    :type use_mmap: bool
+    """
+    with open(filename, 'rb') as f, ContainerReader(f, use_mmap) as reader:
+        reader.extract(folder, deflate=True, recursive=True, workers=workers)
+
+
+def extract_to_archive(filename, archive_filename, archive_format='tar', use_mmap=False):
+    """
+    Распаковка контейнера в архив. Сахар для ContainerReader
+
+    :param filename: полное имя файла-контейнера
+    :type filename: string
+    :param archive_filename: имя файла архива
+    :type archive_filename: string
+    :param archive_format: формат архива: 'tar' или 'zip' (требует Python 3.6+)
+    :type archive_format: string
+    :param use_mmap: отобразить файл контейнера в память
+    :type use_mmap: bool
+    """
+    with open(filename, 'rb') as f, ContainerReader(f, use_mmap) as reader, open(archive_filename, 'wb') as archive:
+        reader.extract_to_archive(archive, archive_format, deflate=True, recursive=True)
+
+
+def sync(filename, folder, compare='mtime', use_mmap=False):
+    """
+    Инкрементальная распаковка контейнера: записываются только изменившиеся файлы,
+    удаляются файлы, которых нет в контейнере. Сахар для ContainerReader
+
+    :param filename: полное имя файла-контейнера
+    :type filename: string
+    :param folder: каталог назначения
+    :type folder: string
+    :param compare: способ определения изменений: 'mtime' или 'hash'
+    :type compare: string
+    :param use_mmap: отобразить файл контейнера в память
+    :type use_mmap: bool
+    :return: количество записанных (written), неизменившихся (unchanged) и удаленных (deleted) файлов
+    :rtype: Counter
     """
-    with open(filename, 'rb') as f:
-        ContainerReader(f).extract(folder, deflate=True, recursive=True)
+    with open(filename, 'rb') as f, ContainerReader(f, use_mmap) as reader:
+        return reader.sync(folder, deflate=True, recursive=True, compare=compare)
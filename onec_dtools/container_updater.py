@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+import collections
+import io
+import os
+import tempfile
+from struct import pack, unpack, calcsize
+from onec_dtools.container_reader import read_block_header, read_full_document, read_table_of_contents, \
+    detect_format, END_MARKERS, SPOOL_MAX_SIZE
+from onec_dtools.container_writer import block_header, file_times, get_size, read_chunks, entry_chunks, entry_times, \
+    STREAM_CHUNK_SIZE
+
+
+def spool_chunks(chunks):
+    """
+    Записывает данные во временный файл (до SPOOL_MAX_SIZE байт - в памяти), чтобы узнать их размер
+    до записи в контейнер
+
+    :param chunks: итератор данных
+    :return: временный файл, позиционированный на начало, и размер данных (байт)
+    :rtype: tuple
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in chunks:
+        spooled.write(chunk)
+    size = spooled.tell()
+    spooled.seek(0)
+    return spooled, size
+
+
+class ContainerUpdater(object):
+    """
+    Класс для изменения существующего контейнера на месте.
+
+    Записываются только измененные документы, описания файлов и оглавление. Блоки удаленных документов
+    добавляются в список свободных блоков (цепочка блоков с нулевым размером документа, начинающаяся
+    со смещения first_empty_block_offset из заголовка контейнера) и используются повторно.
+    Свободный блок, размер которого существенно больше нужного, делится: остаток возвращается в список
+    свободных блоков. Новые блоки, которым не нашлось места среди свободных, дописываются в конец файла.
+
+    :param file: объект файла контейнера, открытый на чтение и запись
+    :type file: BufferedRandom
+    """
+    def __init__(self, file):
+        self.file = file
+        #: Формат контейнера
+        self.format = detect_format(file)
+        file.seek(0)
+        self._header = list(unpack(self.format.header_format, file.read(self.format.header_size)))
+        self.default_block_size = self._header[1]
+        if self.default_block_size == 0:
+            raise BufferError('Container is empty')
+
+        self._end = get_size(file)
+        #: Список свободных блоков: пары (смещение блока, размер блока)
+        self.free_blocks = self._read_free_blocks()
+        #: Оглавление: словарь {имя файла: (смещение документа описания, смещение документа данных)}
+        self.toc = collections.OrderedDict()
+        for attr_offset, data_offset in read_table_of_contents(file, self.format):
+            self.toc[self._read_name(attr_offset)] = (attr_offset, data_offset)
+        self._toc_changed = False
+
+    def _read_name(self, attr_offset):
+        """
+        Считывает имя файла из документа описания файла
+        """
+        document = read_full_document(self.file, attr_offset, self.format)
+        return bytes(document.data[calcsize('QQi'):]).decode('utf-16').partition('\x00')[0]
+
+    def _read_free_blocks(self):
+        """
+        Считывает список свободных блоков
+        """
+        blocks = []
+        visited = set()
+        offset = self._header[0]
+        while offset not in END_MARKERS and 0 < offset < self._end and offset not in visited:
+            visited.add(offset)
+            _, block_size, next_block_offset = read_block_header(self.file, offset, self.format)
+            blocks.append((offset, block_size))
+            offset = next_block_offset
+        return blocks
+
+    def _document_blocks(self, offset):
+        """
+        Возвращает цепочку блоков документа: список пар (смещение блока, размер блока)
+        """
+        blocks = []
+        visited = set()
+        while offset not in END_MARKERS and offset not in visited:
+            visited.add(offset)
+            _, block_size, next_block_offset = read_block_header(self.file, offset, self.format)
+            blocks.append((offset, block_size))
+            offset = next_block_offset
+        return blocks
+
+    def _allocate(self, size):
+        """
+        Выделяет блок для данных указанного размера: наименьший подходящий свободный блок
+        или новый блок в конце файла. Новый блок, как и при записи контейнера, не меньше default_block_size.
+        От свободного блока отделяется остаток, если в нем помещается заголовок блока и не менее
+        default_block_size байт данных.
+
+        :param size: размер данных (байт)
+        :type size: int
+        :return: смещение блока, размер блока
+        :rtype: tuple
+        """
+        block_size = max(self.default_block_size, size)
+        suitable = [x for x in self.free_blocks if x[1] >= size]
+        if suitable:
+            block = min(suitable, key=lambda x: x[1])
+            self.free_blocks.remove(block)
+            rest = block[1] - block_size - self.format.block_header_size
+            if rest < self.default_block_size:
+                return block
+            self.free_blocks.append((block[0] + self.format.block_header_size + block_size, rest))
+            return block[0], block_size
+        block = (self._end, block_size)
+        self._end += self.format.block_header_size + block_size
+        return block
+
+    def _write_chain(self, blocks, data, size):
+        """
+        Записывает данные документа в цепочку блоков. Блоки, оставшиеся без данных, освобождаются.
+
+        :param data: file-like объект данных документа
+        :param size: размер данных (байт)
+        :type size: int
+        """
+        position = 0
+        used = []
+        for block in blocks:
+            if used and position >= size:
+                self.free_blocks.append(block)
+                continue
+            used.append(block)
+            position += block[1]
+
+        position = 0
+        for i, (offset, block_size) in enumerate(used):
+            next_block_offset = used[i + 1][0] if i + 1 < len(used) else self.format.end_marker
+            self.file.seek(offset)
+            self.file.write(block_header(size if i == 0 else 0, block_size, next_block_offset, self.format))
+            block_data_size = min(block_size, size - position)
+            written = 0
+            while written < block_data_size:
+                chunk = data.read(min(block_data_size - written, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError('Document data is shorter than {} bytes'.format(size))
+                self.file.write(chunk)
+                written += len(chunk)
+            if offset + self.format.block_header_size + block_size >= get_size(self.file):
+                # Новый блок в конце файла дополняется до полного размера
+                self.file.write(b'\x00' * (block_size - written))
+            position += written
+
+    def write_document(self, data, offset=None, size=None):
+        """
+        Записывает документ. Существующий документ перезаписывается на месте: используются его блоки,
+        недостающее место выделяется дополнительным блоком, лишние блоки освобождаются.
+
+        :param data: данные документа или file-like объект данных (в этом случае необходим размер)
+        :type data: bytes
+        :param offset: смещение существующего документа (байт). None - новый документ
+        :type offset: int
+        :param size: размер данных file-like объекта (байт)
+        :type size: int
+        :return: смещение документа (байт)
+        :rtype: int
+        """
+        if isinstance(data, bytes):
+            data, size = io.BytesIO(data), len(data)
+        blocks = [] if offset is None else self._document_blocks(offset)
+        capacity = sum(x[1] for x in blocks)
+        if not blocks or capacity < size:
+            blocks.append(self._allocate(size - capacity))
+        self._write_chain(blocks, data, size)
+        return blocks[0][0]
+
+    def free_document(self, offset):
+        """
+        Освобождает блоки документа
+
+        :param offset: смещение документа (байт)
+        :type offset: int
+        """
+        self.free_blocks.extend(self._document_blocks(offset))
+
+    def add_data(self, name, data, creation_time, modify_time):
+        """
+        Добавляет в контейнер файл с подготовленными (при необходимости уже сжатыми) данными.
+        Существующий файл с таким же именем заменяется. Данные, переданные итератором, не собираются в памяти
+        целиком: до SPOOL_MAX_SIZE байт они накапливаются в памяти, остальное - во временном файле.
+
+        :param name: Имя файла в контейнере
+        :type name: string
+        :param data: данные файла или итератор блоков данных
+        :type data: bytes
+        :param creation_time: время создания во внутреннем формате
+        :type creation_time: int
+        :param modify_time: время изменения во внутреннем формате
+        :type modify_time: int
+        """
+        if isinstance(data, bytes):
+            data = [data]
+        attributes = b''.join([pack('QQi', creation_time, modify_time, 0), name.encode('utf-16-le'), b'\x00' * 4])
+        attr_offset, data_offset = self.toc.get(name, (None, None))
+        spooled, size = spool_chunks(data)
+        with spooled:
+            if data_offset is not None and size > sum(x[1] for x in self._document_blocks(data_offset)):
+                # Данные не помещаются в прежние блоки: освобождаем их, чтобы выбрать подходящий блок целиком
+                self.free_document(data_offset)
+                data_offset = None
+            new_data_offset = self.write_document(spooled, data_offset, size)
+        new_attr_offset = self.write_document(attributes, attr_offset)
+        if (new_attr_offset, new_data_offset) != (attr_offset, data_offset):
+            self.toc[name] = (new_attr_offset, new_data_offset)
+            self._toc_changed = True
+
+    def add_file(self, fd, name, inflate=False):
+        """
+        Добавляет файл в контейнер. Существующий файл с таким же именем заменяется.
+
+        :param fd: file-like объект файла
+        :type fd: BufferedReader
+        :param name: Имя файла в контейнере
+        :type name: string
+        :param inflate: флаг сжатия
+        :type inflate: bool
+        """
+        creation_time, modify_time = file_times(fd)
+        self.add_data(name, read_chunks(fd, inflate), creation_time, modify_time)
+
+    def delete(self, name):
+        """
+        Удаляет файл из контейнера
+
+        :param name: Имя файла в контейнере
+        :type name: string
+        """
+        attr_offset, data_offset = self.toc.pop(name)
+        self.free_document(attr_offset)
+        self.free_document(data_offset)
+        self._toc_changed = True
+
+    def write_free_blocks(self):
+        """
+        Записывает список свободных блоков: заголовки свободных блоков и смещение первого из них в заголовке
+        контейнера
+        """
+        self.free_blocks.sort()
+        for i, (offset, block_size) in enumerate(self.free_blocks):
+            next_block_offset = self.free_blocks[i + 1][0] if i + 1 < len(self.free_blocks) \
+                else self.format.end_marker
+            self.file.seek(offset)
+            self.file.write(block_header(0, block_size, next_block_offset, self.format))
+
+        self._header[0] = self.free_blocks[0][0] if self.free_blocks else self.format.end_marker
+        self.file.seek(0)
+        self.file.write(pack(self.format.header_format, *self._header))
+
+    def write_toc(self):
+        """
+        Записывает оглавление контейнера на место прежнего
+        """
+        if len(self.toc) == 0:
+            raise IOError('Container is empty')
+        record_format = '<3' + self.format.offset_format
+        data = b''.join([pack(record_format, attr_offset, data_offset, self.format.end_marker)
+                         for attr_offset, data_offset in self.toc.values()])
+        self.write_document(data, self.format.header_size)
+
+    def flush(self):
+        """
+        Записывает оглавление (если оно изменилось) и список свободных блоков
+        """
+        if self._toc_changed:
+            self.write_toc()
+            self._toc_changed = False
+        self.write_free_blocks()
+        self.file.flush()
+
+    def __enter__(self):
+        """
+        Вход в блок. Позволяет применять оператор with.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Выход из блока. Позволяет применять оператор with.
+        """
+        if exc_type is None:
+            self.flush()
+
+
+def update(filename, folder, names=None):
+    """
+    Обновляет файлы контейнера файлами и каталогами (вложенными контейнерами) из каталога.
+    Сахар для ContainerUpdater.
+
+    :param filename: имя файла контейнера
+    :type filename: string
+    :param folder: каталог с данными контейнера
+    :type folder: string
+    :param names: список обновляемых файлов. Файлы, отсутствующие в каталоге, удаляются из контейнера.
+        None - все файлы каталога, при этом из контейнера удаляются все файлы, отсутствующие в каталоге
+    :type names: list
+    """
+    with open(filename, 'r+b') as f, ContainerUpdater(f) as container:
+        if names is None:
+            names = sorted(os.listdir(folder))
+            for name in [x for x in container.toc if x not in names]:
+                container.delete(name)
+        for name in names:
+            entry_path = os.path.join(folder, name)
+            if os.path.exists(entry_path):
+                container.add_data(name, entry_chunks(entry_path), *entry_times(entry_path))
+            elif name in container.toc:
+                container.delete(name)
@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+import collections
 import datetime
+import hashlib
 import os
 import io
+import posixpath
+import tarfile
+import time
 import tempfile
 import zlib
-from struct import pack, calcsize
+from struct import pack
+from onec_dtools.container_reader import FORMAT_32
 
 # INT32_MAX
 END_MARKER = 2147483647
 DEFAULT_BLOCK_SIZE = 512
 # Размер буффера передачи данных из потока в поток
 BUFFER_CHUNK_SIZE = 512
+# Размер буффера передачи данных в потоковом режиме записи
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Длина заголовка блока
+BLOCK_HEADER_SIZE = 31
+# Параметры сжатия и размещения данных, влияющие на содержимое кэша упаковки
+CACHE_SETTINGS = 'deflate:wbits=-15:level={}:block={}'.format(zlib.Z_DEFAULT_COMPRESSION, DEFAULT_BLOCK_SIZE)
 
 
 def epoch2int(epoch_time):
@@ -29,16 +42,18 @@ def epoch2int(epoch_time):
         microseconds=100)
 
 
-def int2hex(value):
+def int2hex(value, digits=8):
     """
     Получает строковое представление целого числа в шестнадцатиричном формате длиной не менее 4 байт
 
     :param value: конвертируемое число
     :type value: int
+    :param digits: минимальное количество цифр
+    :type digits: int
     :return: предоставление числа
     :type: string
     """
-    return '{:02x}'.format(value).rjust(8, '0')
+    return '{:02x}'.format(value).rjust(digits, '0')
 
 
 def get_size(file):
@@ -57,23 +72,94 @@ def get_size(file):
     return size
 
 
+def file_times(fd):
+    """
+    Возвращает время создания и изменения файла во внутреннем формате
+
+    :param fd: объект файла
+    :type fd: BufferedReader
+    :return: время создания, время изменения
+    :rtype: tuple
+    """
+    file_stat = os.stat(fd.fileno())
+    # В *nix это не время создания файла.
+    return epoch2int(file_stat.st_ctime), epoch2int(file_stat.st_mtime)
+
+
+def block_header(size, block_size, next_block_offset, fmt=FORMAT_32):
+    """
+    Формирует заголовок блока данных
+
+    :param size: размер документа (байт)
+    :type size: int
+    :param block_size: размер блока (байт)
+    :type block_size: int
+    :param next_block_offset: смещение следующего блока документа
+    :type next_block_offset: int
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    :return: заголовок блока
+    :rtype: bytes
+    """
+    values = [int2hex(x, fmt.digits) for x in (size, block_size, next_block_offset)]
+    if max(len(x) for x in values) > fmt.digits:
+        raise ValueError('Container is too large for 32-bit format')
+    header_data = ('\r\n', values[0], ' ', values[1], ' ', values[2], ' \r\n')
+    return pack('2s{0}ss{0}ss{0}s3s'.format(fmt.digits), *[x.encode() for x in header_data])
+
+
+def read_chunks(fd, compress=False, rewind=True):
+    """
+    Создает генератор чтения данных файла большими блоками с необязательным сжатием
+
+    :param fd: file-like объект файла
+    :type fd: BufferedReader
+    :param compress: сжимать данные
+    :type compress: bool
+    :param rewind: читать данные с начала файла. False - с текущей позиции (для потоков без позиционирования)
+    :type rewind: bool
+    :return: генератор данных
+    """
+    compressor = zlib.compressobj(wbits=-15) if compress else None
+    if rewind:
+        fd.seek(0)
+    while True:
+        chunk = fd.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield compressor.compress(chunk) if compress else chunk
+    if compress:
+        yield compressor.flush()
+
+
 class ContainerWriter(object):
     """
     Класс для записи контейнеров
 
     :param file: объект файла контейнера
     :type file: BufferedReader
+    :param streaming: потоковый режим записи. Данные файлов (в том числе сжатые) записываются в контейнер сразу
+        большими блоками, а размер документа вписывается в заголовок блока после записи данных. Смещение конца
+        данных отслеживается без обращения к размеру файла.
+    :type streaming: bool
+    :param fmt: формат контейнера. FORMAT_64 - формат с 64-разрядными смещениями для контейнеров больше 2 ГБ
+    :type fmt: ContainerFormat
     """
-    def __init__(self, file):
+    def __init__(self, file, streaming=False, fmt=FORMAT_32):
         self.file = file
         self.toc = []
+        self.streaming = streaming
+        self.format = fmt
+        # Смещение конца записанных данных (используется в потоковом режиме)
+        self._offset = 0
 
     def write_header(self):
         """
         Записывает заголовок контейнера
 
         """
-        self.file.write(pack('4i', END_MARKER, DEFAULT_BLOCK_SIZE, 0, 0))
+        self.file.write(pack(self.format.header_format, self.format.end_marker, DEFAULT_BLOCK_SIZE, 0, 0))
+        self._offset = self.format.header_size
 
     def write_block(self, data, **kwargs):
         """
@@ -85,31 +171,99 @@ class ContainerWriter(object):
         :rtype: int
         """
         # размер данных блока
-        size = kwargs.pop('size', get_size(data))
-        offset = kwargs.pop('offset', get_size(self.file))
+        size = kwargs.pop('size', None)
+        if size is None:
+            size = get_size(data)
+        offset = kwargs.pop('offset', None)
+        if offset is None:
+            offset = self._offset if self.streaming else get_size(self.file)
         self.file.seek(offset)
 
         block_size = kwargs.pop('block_size', max(DEFAULT_BLOCK_SIZE, size))
-        next_block_offset = kwargs.pop('next_block_offset', END_MARKER)
+        next_block_offset = kwargs.pop('next_block_offset', self.format.end_marker)
 
         if len(kwargs) > 0:
             raise ValueError('Unsupported arguments: {}'.format(','.join(kwargs.keys())))
 
-        header_data = ('\r\n', int2hex(size), ' ', int2hex(block_size), ' ', int2hex(next_block_offset), ' \r\n')
-        header = pack('2s8ss8ss8s3s', *[x.encode() for x in header_data])
-
-        self.file.write(header)
+        self.file.write(block_header(size, block_size, next_block_offset, self.format))
         data.seek(0)
+        chunk_size = STREAM_CHUNK_SIZE if self.streaming else BUFFER_CHUNK_SIZE
         while True:
-            buffer = data.read(BUFFER_CHUNK_SIZE)
+            buffer = data.read(chunk_size)
             if not buffer:
                 break
             self.file.write(buffer)
 
         self.file.write(b'\x00' * (block_size - data.tell()))
+        self._offset = max(self._offset, offset + self.format.block_header_size + block_size)
+
+        return offset
+
+    def write_stream(self, chunks):
+        """
+        Записывает документ из одного блока в конец контейнера по мере поступления данных.
+        Заголовок блока записывается после данных.
+
+        :param chunks: итератор данных документа
+        :return: смещение записанных данных (байт)
+        :rtype: int
+        """
+        offset = self._offset
+        self.file.seek(offset + self.format.block_header_size)
+        size = 0
+        for chunk in chunks:
+            self.file.write(chunk)
+            size += len(chunk)
+
+        block_size = max(DEFAULT_BLOCK_SIZE, size)
+        self.file.write(b'\x00' * (block_size - size))
+        self._offset = offset + self.format.block_header_size + block_size
+
+        self.file.seek(offset)
+        self.file.write(block_header(size, block_size, self.format.end_marker, self.format))
+        self.file.seek(self._offset)
 
         return offset
 
+    def write_attributes(self, name, creation_time, modify_time):
+        """
+        Записывает документ описания файла
+
+        :param name: Имя файла в контейнере
+        :type name: string
+        :param creation_time: время создания во внутреннем формате
+        :type creation_time: int
+        :param modify_time: время изменения во внутреннем формате
+        :type modify_time: int
+        :return: смещение записанных данных (байт)
+        :rtype: int
+        """
+        buffer = b''.join([pack('QQi', creation_time, modify_time, 0), name.encode('utf-16-le'), b'\x00' * 4])
+        return self.write_block(io.BytesIO(buffer), size=len(buffer), block_size=len(buffer))
+
+    def add_data(self, name, data, creation_time, modify_time):
+        """
+        Добавляет в контейнер файл с подготовленными (при необходимости уже сжатыми) данными
+
+        :param name: Имя файла в контейнере
+        :type name: string
+        :param data: данные файла или итератор блоков данных
+        :type data: bytes
+        :param creation_time: время создания во внутреннем формате
+        :type creation_time: int
+        :param modify_time: время изменения во внутреннем формате
+        :type modify_time: int
+        """
+        if isinstance(data, bytes):
+            data = [data]
+        attribute_doc_offset = self.write_attributes(name, creation_time, modify_time)
+        if self.streaming:
+            data_doc_offset = self.write_stream(data)
+        else:
+            data = b''.join(data)
+            data_doc_offset = self.write_block(io.BytesIO(data), size=len(data))
+        self.toc.append((attribute_doc_offset, data_doc_offset))
+
     def add_file(self, fd, name, inflate=False):
         """
         Добавляет файл в контейнер
@@ -121,14 +275,12 @@ class ContainerWriter(object):
         :param inflate: флаг сжатия
         :type inflate: bool
         """
-        modify_time = epoch2int(os.stat(fd.fileno()).st_mtime)
-        # В *nix это не время создания файла.
-        creation_time = epoch2int(os.stat(fd.fileno()).st_ctime)
-
-        buffer = b''.join([pack('QQi', creation_time, modify_time, 0), name.encode('utf-16-le'), b'\x00' * 4])
-        attribute_doc_offset = self.write_block(io.BytesIO(buffer), block_size=len(buffer))
+        creation_time, modify_time = file_times(fd)
+        attribute_doc_offset = self.write_attributes(name, creation_time, modify_time)
 
-        if inflate:
+        if self.streaming:
+            data_doc_offset = self.write_stream(read_chunks(fd, inflate))
+        elif inflate:
             with tempfile.TemporaryFile() as f:
                 compressor = zlib.compressobj(wbits=-15)
                 fd.seek(0)
@@ -144,29 +296,31 @@ class ContainerWriter(object):
 
         self.toc.append((attribute_doc_offset, data_doc_offset))
 
-    def write_toc(self):
+    def write_toc(self, allow_empty=False):
         """
         Записывает оглавление контейнера
+
+        :param allow_empty: разрешить пустое оглавление (вложенный контейнер пустого каталога)
+        :type allow_empty: bool
         """
-        if len(self.toc) == 0:
+        if len(self.toc) == 0 and not allow_empty:
             raise IOError('Container is empty')
         with tempfile.TemporaryFile() as f:
             for attr_offset, data_offset in self.toc:
-                f.write(b''.join([pack('3i', attr_offset, data_offset, END_MARKER)]))
+                f.write(pack('<3' + self.format.offset_format, attr_offset, data_offset, self.format.end_marker))
 
             size = get_size(f)
             total_blocks = size // DEFAULT_BLOCK_SIZE + 1
 
             if total_blocks == 1:
-                self.write_block(f, size=size, offset=calcsize('4i'))
+                self.write_block(f, size=size, offset=self.format.header_size)
             else:
                 f.seek(0)
-                next_block_offset = get_size(self.file)
-                self.write_block(io.BytesIO(f.read(DEFAULT_BLOCK_SIZE)), size=size, offset=calcsize('4i'),
+                next_block_offset = self._offset if self.streaming else get_size(self.file)
+                self.write_block(io.BytesIO(f.read(DEFAULT_BLOCK_SIZE)), size=size, offset=self.format.header_size,
                                  next_block_offset=next_block_offset, block_size=DEFAULT_BLOCK_SIZE)
                 for i in range(1, total_blocks):
-                    # 31 - длина заголовка блока
-                    next_block_offset += DEFAULT_BLOCK_SIZE + 31
+                    next_block_offset += DEFAULT_BLOCK_SIZE + self.format.block_header_size
                     self.write_block(io.BytesIO(f.read(DEFAULT_BLOCK_SIZE)), size=0,
                                      next_block_offset=next_block_offset)
                 self.write_block(io.BytesIO(f.read(DEFAULT_BLOCK_SIZE)), size=0)
@@ -176,17 +330,165 @@ class ContainerWriter(object):
         Вход в блок. Позволяет применять оператор with.
         """
         self.write_header()
-        self.file.write(b'\x00' * (DEFAULT_BLOCK_SIZE + 31))
+        self.file.write(b'\x00' * (DEFAULT_BLOCK_SIZE + self.format.block_header_size))
+        self._offset += DEFAULT_BLOCK_SIZE + self.format.block_header_size
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
         Выход из блока. Позволяет применять оператор with.
         """
-        self.write_toc()
+        if exc_type is None:
+            self.write_toc()
+
 
+class BuildCache(object):
+    """
+    Кэш упаковки: сжатые данные файлов и вложенных контейнеров, адресуемые хэшем содержимого
 
-def add_entries(container, folder, nested=False):
+    :param path: каталог кэша
+    :type path: string
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def entry_path(self, key):
+        """
+        :param key: ключ записи кэша
+        :type key: string
+        :return: имя файла записи кэша
+        :rtype: string
+        """
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """
+        Возвращает данные записи кэша
+
+        :param key: ключ записи кэша
+        :type key: string
+        :return: данные или None, если записи нет
+        :rtype: bytes
+        """
+        try:
+            with open(self.entry_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, chunks):
+        """
+        Сохраняет запись кэша. Запись выполняется через временный файл, поэтому прерванная запись не попадает в кэш.
+
+        :param key: ключ записи кэша
+        :type key: string
+        :param chunks: итератор блоков данных
+        :return: имя файла записи кэша
+        :rtype: string
+        """
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_name = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_name, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_name, path)
+        return path
+
+
+def entry_times(entry_path):
+    """
+    Возвращает время создания и изменения файла во внутреннем формате.
+    Для каталога (вложенного контейнера) возвращается текущее время.
+
+    :param entry_path: путь к файлу или каталогу
+    :type entry_path: string
+    :return: время создания, время изменения
+    :rtype: tuple
+    """
+    if os.path.isdir(entry_path):
+        now = epoch2int(time.time())
+        return now, now
+    file_stat = os.stat(entry_path)
+    return epoch2int(file_stat.st_ctime), epoch2int(file_stat.st_mtime)
+
+
+def update_entry_hash(entry_hash, entry_path):
+    """
+    Добавляет в хэш все, что определяет данные файла или вложенного контейнера в контейнере: содержимое файлов,
+    а для каталогов - так же имена и время создания/изменения вложенных файлов
+
+    :param entry_hash: объект хэша
+    :param entry_path: путь к файлу или каталогу
+    :type entry_path: string
+    """
+    if os.path.isdir(entry_path):
+        entries = sorted(os.listdir(entry_path))
+        entry_hash.update(pack('<Q', len(entries)))
+        for entry in entries:
+            child_path = os.path.join(entry_path, entry)
+            name = entry.encode('utf-8')
+            entry_hash.update(pack('<Q', len(name)) + name)
+            if not os.path.isdir(child_path):
+                entry_hash.update(pack('<QQ', *entry_times(child_path)))
+            update_entry_hash(entry_hash, child_path)
+    else:
+        entry_hash.update(pack('<Q', os.path.getsize(entry_path)))
+        with open(entry_path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                entry_hash.update(chunk)
+
+
+def entry_key(entry_path, compress=True, fmt=FORMAT_32):
+    """
+    Вычисляет ключ кэша упаковки для файла или каталога
+
+    :param entry_path: путь к файлу или каталогу
+    :type entry_path: string
+    :param compress: данные сжимаются
+    :type compress: bool
+    :param fmt: формат вложенных контейнеров
+    :type fmt: ContainerFormat
+    :return: ключ кэша
+    :rtype: string
+    """
+    entry_hash = hashlib.sha256()
+    entry_hash.update((CACHE_SETTINGS if compress else 'raw').encode())
+    entry_hash.update(pack('<B', fmt.digits))
+    entry_hash.update(b'D' if os.path.isdir(entry_path) else b'F')
+    update_entry_hash(entry_hash, entry_path)
+    return entry_hash.hexdigest()
+
+
+def entry_chunks(entry_path, compress=True, fmt=FORMAT_32):
+    """
+    Создает генератор данных файла или каталога (в виде вложенного контейнера) для добавления в контейнер
+
+    :param entry_path: путь к файлу или каталогу
+    :type entry_path: string
+    :param compress: сжимать данные
+    :type compress: bool
+    :param fmt: формат вложенного контейнера
+    :type fmt: ContainerFormat
+    :return: генератор данных
+    """
+    if os.path.isdir(entry_path):
+        with tempfile.TemporaryFile() as tmp:
+            with ContainerWriter(tmp, streaming=True, fmt=fmt) as nested_container:
+                add_entries(nested_container, entry_path, nested=True)
+            for chunk in read_chunks(tmp, compress):
+                yield chunk
+    else:
+        with open(entry_path, 'rb') as entry_file:
+            for chunk in read_chunks(entry_file, compress):
+                yield chunk
+
+
+def add_entries(container, folder, nested=False, cache=None):
     """
     Рекурсивно добавляет файлы из директории в контейнер
 
@@ -196,13 +498,22 @@ def add_entries(container, folder, nested=False):
     :type folder: string
     :param nested: обрабатывать вложенные каталоги
     :type nested: bool
+    :param cache: кэш упаковки сжатых данных
+    :type cache: BuildCache
     """
     entries = sorted(os.listdir(folder))
     for entry in entries:
         entry_path = os.path.join(folder, entry)
-        if os.path.isdir(entry_path):
+        if cache is not None and not nested:
+            key = entry_key(entry_path, fmt=container.format)
+            cached_path = cache.entry_path(key)
+            if not os.path.exists(cached_path):
+                cached_path = cache.store(key, entry_chunks(entry_path, fmt=container.format))
+            with open(cached_path, 'rb') as cached:
+                container.add_data(entry, read_chunks(cached), *entry_times(entry_path))
+        elif os.path.isdir(entry_path):
             with tempfile.TemporaryFile() as tmp:
-                with ContainerWriter(tmp) as nested_container:
+                with ContainerWriter(tmp, container.streaming, container.format) as nested_container:
                     add_entries(nested_container, entry_path, nested=True)
                 container.add_file(tmp, entry, inflate=not nested)
         else:
@@ -210,7 +521,68 @@ def add_entries(container, folder, nested=False):
                 container.add_file(entry_file, entry, inflate=not nested)
 
 
-def build(folder, filename):
+def pack_entry(entry_path, compress=True, cache_dir=None, fmt=FORMAT_32):
+    """
+    Подготавливает данные файла или каталога (в виде вложенного контейнера) для добавления в контейнер.
+    Используется при параллельной упаковке.
+
+    :param entry_path: путь к файлу или каталогу
+    :type entry_path: string
+    :param compress: сжимать данные
+    :type compress: bool
+    :param cache_dir: каталог кэша упаковки
+    :type cache_dir: string
+    :param fmt: формат вложенного контейнера
+    :type fmt: ContainerFormat
+    :return: время создания, время изменения, данные
+    :rtype: tuple
+    """
+    creation_time, modify_time = entry_times(entry_path)
+    if cache_dir is None:
+        return creation_time, modify_time, b''.join(entry_chunks(entry_path, compress, fmt))
+
+    cache = BuildCache(cache_dir)
+    key = entry_key(entry_path, compress, fmt)
+    data = cache.get(key)
+    if data is None:
+        data = b''.join(entry_chunks(entry_path, compress, fmt))
+        cache.store(key, [data])
+    return creation_time, modify_time, data
+
+
+def add_entries_parallel(container, folder, workers, cache_dir=None):
+    """
+    Добавляет файлы из директории в контейнер, подготавливая их данные (сжатие, сборку вложенных контейнеров)
+    в пуле процессов. Файлы записываются в порядке сортировки имен, одновременно в обработке находится
+    не более 2 * workers файлов.
+
+    :param container: объет файла контейнера
+    :type container: ContainerWriter
+    :param folder: каталог файлов, которые надо поместить в контейнер
+    :type folder: string
+    :param workers: количество процессов
+    :type workers: int
+    :param cache_dir: каталог кэша упаковки
+    :type cache_dir: string
+    """
+    def write_next():
+        name, future = pending.popleft()
+        creation_time, modify_time, data = future.result()
+        container.add_data(name, data, creation_time, modify_time)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for entry in sorted(os.listdir(folder)):
+            if len(pending) >= 2 * workers:
+                write_next()
+            pending.append((entry, executor.submit(pack_entry, os.path.join(folder, entry), True, cache_dir,
+                                                   container.format)))
+
+        while pending:
+            write_next()
+
+
+def build(folder, filename, workers=None, cache_dir=None, fmt=FORMAT_32):
     """
     Запакоывает каталог в контейнер включая вложенные каталоги.
     Сахар для ContainerWriter.
@@ -219,7 +591,81 @@ def build(folder, filename):
     :type folder: string
     :param filename: имя файла контейнера
     :type filename: string
+    :param workers: количество процессов для параллельной упаковки. None - упаковка в текущем процессе
+    :type workers: int
+    :param cache_dir: каталог кэша упаковки. Сжатые данные неизменившихся файлов и вложенных контейнеров берутся
+        из кэша без повторного сжатия
+    :type cache_dir: string
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    """
+    with open(filename, 'w+b') as f, ContainerWriter(f, streaming=True, fmt=fmt) as container:
+        if workers is None:
+            add_entries(container, folder, cache=None if cache_dir is None else BuildCache(cache_dir))
+        else:
+            add_entries_parallel(container, folder, workers, cache_dir)
+
+
+def add_entries_from_tar(container, tar):
+    """
+    Добавляет в контейнер файлы из tar-архива. Архив читается последовательно, поэтому может быть потоком.
+    Каталоги архива (в том числе пустые) становятся вложенными контейнерами; они собираются во временных файлах
+    и добавляются в контейнер после чтения всего архива.
+
+    :param container: объект контейнера
+    :type container: ContainerWriter
+    :param tar: tar-архив
+    :type tar: TarFile
+    """
+    # Собираемые вложенные контейнеры: {путь каталога: (объект контейнера, временный файл)}
+    nested = {}
+    directory_times = {}
+
+    def writer_for(path):
+        if path == '':
+            return container
+        if path not in nested:
+            writer_for(posixpath.dirname(path))
+            tmp = tempfile.TemporaryFile()
+            writer = ContainerWriter(tmp, container.streaming, container.format)
+            writer.__enter__()
+            nested[path] = (writer, tmp)
+        return nested[path][0]
+
+    for member in tar:
+        name = posixpath.normpath(member.name).lstrip('/')
+        if name in ('.', ''):
+            continue
+        if member.isdir():
+            directory_times[name] = epoch2int(member.mtime)
+            writer_for(name)
+        elif member.isfile():
+            folder, entry = posixpath.split(name)
+            modify_time = epoch2int(member.mtime)
+            writer_for(folder).add_data(entry, read_chunks(tar.extractfile(member), folder == '', rewind=False),
+                                        modify_time, modify_time)
+
+    # Вложенные контейнеры добавляются в родительские начиная с самых глубоких
+    for path in sorted(nested, key=lambda x: x.count('/'), reverse=True):
+        writer, tmp = nested.pop(path)
+        with tmp:
+            writer.write_toc(allow_empty=True)
+            folder, entry = posixpath.split(path)
+            modify_time = directory_times.get(path, epoch2int(time.time()))
+            writer_for(folder).add_data(entry, read_chunks(tmp, folder == ''), modify_time, modify_time)
+
+
+def build_from_tar(fileobj, filename, fmt=FORMAT_32):
     """
-    with open(filename, 'w+b') as f, ContainerWriter(f) as container:
-        add_entries(container, folder)
+    Запаковывает содержимое tar-архива (в том числе сжатого) в контейнер. Каталоги архива становятся вложенными
+    контейнерами. Сахар для ContainerWriter.
 
+    :param fileobj: file-like объект tar-архива. Может не поддерживать позиционирование
+    :param filename: имя файла контейнера
+    :type filename: string
+    :param fmt: формат контейнера
+    :type fmt: ContainerFormat
+    """
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar, open(filename, 'w+b') as f, \
+            ContainerWriter(f, streaming=True, fmt=fmt) as container:
+        add_entries_from_tar(container, tar)
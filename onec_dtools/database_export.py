@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+import binascii
+import collections
+import csv
+import datetime as dt
+import hashlib
+import json
+import os
+import sqlite3
+from onec_dtools.database_reader import DatabaseReader
+
+# Количество строк, передаваемых в executemany / writerows за один вызов
+BATCH_SIZE = 10000
+
+# Соответствие типов полей 1С типам SQLite
+SQLITE_TYPES = {
+    'B': 'BLOB',
+    'L': 'INTEGER',
+    'N': 'NUMERIC',
+    'NC': 'TEXT',
+    'NVC': 'TEXT',
+    'RV': 'TEXT',
+    'NT': 'TEXT',
+    'I': 'BLOB',
+    'DT': 'TEXT',
+}
+
+
+def quote_identifier(name):
+    """
+    Экранирует имя таблицы, поля или индекса для использования в SQL
+
+    :param name: имя
+    :type name: string
+    :return: экранированное имя
+    :rtype: string
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def to_text(value):
+    """
+    Преобразует значение поля в представление, пригодное для текстовых форматов (CSV, JSON)
+
+    :param value: значение поля
+    :return: текстовое представление значения
+    """
+    if isinstance(value, bytes):
+        return binascii.hexlify(value).decode('ascii')
+    elif isinstance(value, dt.datetime):
+        return value.isoformat()
+    return value
+
+
+def to_sqlite(value):
+    """
+    Преобразует значение поля в тип, поддерживаемый SQLite
+
+    :param value: значение поля
+    :return: значение для SQLite
+    """
+    if isinstance(value, dt.datetime):
+        return value.isoformat(' ')
+    return value
+
+
+class Checkpoint(object):
+    """
+    Контрольная точка выгрузки. Для каждой таблицы хранит сигнатуру, индекс следующей строки, смещение в выходных
+    данных и признак завершения выгрузки. Сохраняется в JSON файл.
+
+    :param filename: имя файла контрольной точки
+    :type filename: string
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.tables = {}
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                self.tables = json.load(f)['tables']
+
+    def resume_point(self, table_name, signature):
+        """
+        Возвращает точку продолжения выгрузки таблицы
+
+        :param table_name: имя таблицы
+        :type table_name: string
+        :param signature: сигнатура таблицы
+        :type signature: string
+        :return: индекс строки и смещение в выходных данных. (0, 0) - если таблица изменилась или ранее не выгружалась,
+            None - если таблица уже выгружена полностью
+        :rtype: tuple
+        """
+        state = self.tables.get(table_name)
+        if state is None or state['signature'] != signature:
+            return 0, 0
+        if state['done']:
+            return None
+        return state['row'], state['offset']
+
+    def save(self, table_name, signature, row, offset, done=False):
+        """
+        Сохраняет состояние выгрузки таблицы
+
+        :param table_name: имя таблицы
+        :type table_name: string
+        :param signature: сигнатура таблицы
+        :type signature: string
+        :param row: индекс следующей выгружаемой строки
+        :type row: int
+        :param offset: смещение в выходных данных
+        :type offset: int
+        :param done: признак завершения выгрузки таблицы
+        :type done: bool
+        """
+        self.tables[table_name] = {'signature': signature, 'row': row, 'offset': offset, 'done': done}
+        # Запись через временный файл, чтобы прерывание не оставило поврежденную контрольную точку
+        temp_name = self.filename + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8') as f:
+            json.dump({'tables': self.tables}, f)
+        os.replace(temp_name, self.filename)
+
+
+class DatabaseExporter(object):
+    """
+    Класс для выгрузки таблиц файловой БД в SQLite, CSV или JSON Lines
+
+    :param db: файловая БД
+    :type db: DatabaseReader
+    :param tables: имена выгружаемых таблиц. None - все таблицы БД
+    :type tables: list
+    :param columns: словарь выгружаемых полей (ключ - имя таблицы, значение - список имен полей). Для таблиц,
+        отсутствующих в словаре, выгружаются все поля
+    :type columns: dict
+    :param blobs: способ выгрузки полей неограниченной длины: 'inline' - значением поля, 'files' - в отдельные
+        файлы каталога blob_dir (значением поля становится относительный путь к файлу), None - не выгружать
+    :type blobs: string
+    :param blob_dir: каталог для выгрузки полей неограниченной длины в режиме 'files'
+    :type blob_dir: string
+    :param batch_size: количество строк, записываемых за одну операцию
+    :type batch_size: int
+    :param checkpoint: имя файла контрольной точки. Если задано, состояние выгрузки сохраняется после каждого пакета
+        строк, а повторный запуск продолжает выгрузку с сохраненной строки и пропускает неизменившиеся выгруженные
+        таблицы
+    :type checkpoint: string
+    """
+    def __init__(self, db, tables=None, columns=None, blobs='inline', blob_dir=None, batch_size=BATCH_SIZE,
+                 checkpoint=None):
+        if blobs not in ('inline', 'files', None):
+            raise ValueError('Unsupported blobs mode: {}'.format(blobs))
+        if blobs == 'files' and blob_dir is None:
+            raise ValueError('blob_dir is required for blobs mode "files"')
+
+        self.db = db
+        self.tables = list(db.tables.keys()) if tables is None else list(tables)
+        self.columns = {} if columns is None else columns
+        self.blobs = blobs
+        self.blob_dir = blob_dir
+        self.batch_size = batch_size
+        self.checkpoint = None if checkpoint is None else Checkpoint(checkpoint)
+
+        for table_name in self.tables:
+            if table_name not in db.tables:
+                raise KeyError('Table {} not found'.format(table_name))
+
+    def table_columns(self, table):
+        """
+        Возвращает описания выгружаемых полей таблицы
+
+        :param table: таблица БД
+        :type table: Table
+        :return: словарь описаний полей
+        :rtype: OrderedDict
+        """
+        names = self.columns.get(table.name)
+        if names is None:
+            names = table.fields.keys()
+
+        result = collections.OrderedDict()
+        for name in names:
+            if name not in table.fields:
+                raise KeyError('Field {} not found in table {}'.format(name, table.name))
+            field = table.fields[name]
+            if self.blobs is None and field.type in ['NT', 'I']:
+                continue
+            result[name] = field
+        return result
+
+    def _blob_value(self, table, row_index, name, blob):
+        """
+        Получает выгружаемое значение поля неограниченной длины
+        """
+        if self.blobs == 'inline':
+            return blob.value
+
+        rel_path = os.path.join(table.name, '{}_{}'.format(row_index, name))
+        path = os.path.join(self.blob_dir, rel_path)
+        with open(path, 'wb') as f:
+            for chunk in blob:
+                f.write(chunk)
+        return rel_path
+
+    def signature(self, table, fmt):
+        """
+        Вычисляет сигнатуру выгрузки таблицы. Сигнатура меняется при изменении описания или размера данных таблицы,
+        а так же при изменении параметров выгрузки.
+
+        :param table: таблица БД
+        :type table: Table
+        :param fmt: формат выгрузки
+        :type fmt: string
+        :return: сигнатура
+        :rtype: string
+        """
+        data = '\n'.join([table.description, str(len(table)), fmt, str(self.blobs)] + list(self.table_columns(table)))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def resume_point(self, table, fmt):
+        """
+        Возвращает точку продолжения выгрузки таблицы
+
+        :param table: таблица БД
+        :type table: Table
+        :param fmt: формат выгрузки
+        :type fmt: string
+        :return: индекс строки и смещение в выходных данных или None, если таблица уже выгружена
+        :rtype: tuple
+        """
+        if self.checkpoint is None:
+            return 0, 0
+        return self.checkpoint.resume_point(table.name, self.signature(table, fmt))
+
+    def save_point(self, table, fmt, row, offset, done=False):
+        """
+        Сохраняет состояние выгрузки таблицы в контрольной точке (если она задана)
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.save(table.name, self.signature(table, fmt), row, offset, done)
+
+    def rows(self, table, start=0):
+        """
+        Создает генератор выгружаемых строк таблицы. Пустые строки пропускаются.
+
+        :param table: таблица БД
+        :type table: Table
+        :param start: индекс строки, с которой начинается чтение
+        :type start: int
+        :return: генератор кортежей (индекс строки, список значений полей)
+        """
+        columns = self.table_columns(table)
+        blob_columns = set(name for name, field in columns.items() if field.type in ['NT', 'I'])
+
+        if self.blobs == 'files' and blob_columns:
+            os.makedirs(os.path.join(self.blob_dir, table.name), exist_ok=True)
+
+        for row_index, row in enumerate(table.iter_rows(start), start):
+            if row.is_empty:
+                continue
+            values = []
+            for name in columns:
+                value = row[name]
+                if name in blob_columns and value is not None:
+                    value = self._blob_value(table, row_index, name, value)
+                values.append(value)
+            yield row_index, values
+
+    def batches(self, table, start=0):
+        """
+        Создает генератор пакетов выгружаемых строк таблицы
+
+        :param table: таблица БД
+        :type table: Table
+        :param start: индекс строки, с которой начинается чтение
+        :type start: int
+        :return: генератор кортежей (индекс строки, следующей за пакетом, список строк пакета).
+            Последний пакет может быть пустым
+        """
+        batch = []
+        for row_index, values in self.rows(table, start):
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                yield row_index + 1, batch
+                batch = []
+        yield len(table), batch
+
+    def create_sqlite_table(self, connection, table):
+        """
+        Создает в SQLite таблицу для выгрузки таблицы БД
+
+        :param connection: соединение с БД SQLite
+        :type connection: sqlite3.Connection
+        :param table: таблица БД
+        :type table: Table
+        """
+        columns = self.table_columns(table)
+        definitions = []
+        for name, field in columns.items():
+            sql_type = SQLITE_TYPES[field.type]
+            if field.type in ['NT', 'I'] and self.blobs == 'files':
+                sql_type = 'TEXT'
+            definitions.append('{} {}'.format(quote_identifier(name), sql_type))
+        connection.execute('DROP TABLE IF EXISTS {}'.format(quote_identifier(table.name)))
+        connection.execute('CREATE TABLE {} ({})'.format(quote_identifier(table.name), ', '.join(definitions)))
+
+    def create_sqlite_indexes(self, connection, table):
+        """
+        Создает в SQLite индексы по описаниям индексов таблицы БД.
+        Индексы, содержащие невыгружаемые поля, пропускаются.
+
+        :param connection: соединение с БД SQLite
+        :type connection: sqlite3.Connection
+        :param table: таблица БД
+        :type table: Table
+        """
+        columns = self.table_columns(table)
+        for index_name, index in table.indexes.items():
+            index_fields = [name for name, _ in index.fields]
+            if not index_fields or any(name not in columns for name in index_fields):
+                continue
+            connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                quote_identifier('{}_{}'.format(table.name, index_name)),
+                quote_identifier(table.name),
+                ', '.join(quote_identifier(name) for name in index_fields)))
+
+    def export_sqlite(self, filename, create_indexes=True):
+        """
+        Выгружает таблицы в БД SQLite. Каждая таблица выгружается в отдельной транзакции, а при заданной контрольной
+        точке - в транзакции на каждый пакет строк.
+
+        :param filename: имя файла БД SQLite
+        :type filename: string
+        :param create_indexes: создавать индексы после выгрузки данных
+        :type create_indexes: bool
+        """
+        connection = sqlite3.connect(filename)
+        try:
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('PRAGMA journal_mode = MEMORY')
+            for table_name in self.tables:
+                table = self.db.tables[table_name]
+                columns = self.table_columns(table)
+                if not columns:
+                    continue
+                resume_point = self.resume_point(table, 'sqlite')
+                if resume_point is None:
+                    continue
+                start, inserted = resume_point
+
+                if start == 0:
+                    self.create_sqlite_table(connection, table)
+                else:
+                    # Строки, добавленные после сохранения контрольной точки, будут выгружены повторно
+                    connection.execute('DELETE FROM {} WHERE rowid > ?'.format(quote_identifier(table.name)),
+                                       (inserted,))
+
+                sql = 'INSERT INTO {} VALUES ({})'.format(quote_identifier(table.name),
+                                                          ', '.join('?' * len(columns)))
+                for next_row, batch in self.batches(table, start):
+                    connection.executemany(sql, [[to_sqlite(value) for value in values] for values in batch])
+                    inserted += len(batch)
+                    if self.checkpoint is not None:
+                        connection.commit()
+                        self.save_point(table, 'sqlite', next_row, inserted)
+                connection.commit()
+                self.save_point(table, 'sqlite', len(table), inserted, done=True)
+
+            if create_indexes:
+                for table_name in self.tables:
+                    table = self.db.tables[table_name]
+                    if self.table_columns(table):
+                        self.create_sqlite_indexes(connection, table)
+                connection.commit()
+        finally:
+            connection.close()
+
+    def _export_text(self, folder, fmt, write_header, write_batch):
+        """
+        Выгружает таблицы в текстовые файлы (по файлу на таблицу) с поддержкой продолжения выгрузки.
+        При продолжении файл усекается до сохраненного смещения и дописывается.
+        """
+        os.makedirs(folder, exist_ok=True)
+        for table_name in self.tables:
+            table = self.db.tables[table_name]
+            resume_point = self.resume_point(table, fmt)
+            if resume_point is None:
+                continue
+            start, offset = resume_point
+
+            path = os.path.join(folder, '.'.join([table.name, fmt]))
+            if start == 0:
+                mode = 'w'
+            else:
+                mode = 'a'
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+
+            with open(path, mode, encoding='utf-8', newline='') as f:
+                if start == 0:
+                    write_header(f, table)
+                for next_row, batch in self.batches(table, start):
+                    write_batch(f, table, batch)
+                    if self.checkpoint is not None:
+                        f.flush()
+                        self.save_point(table, fmt, next_row, f.tell())
+                offset = f.tell()
+            self.save_point(table, fmt, len(table), offset, done=True)
+
+    def export_csv(self, folder):
+        """
+        Выгружает таблицы в CSV файлы (по файлу на таблицу). Двоичные данные выгружаются в шестнадцатиричном виде.
+
+        :param folder: каталог выгрузки
+        :type folder: string
+        """
+        def write_header(f, table):
+            csv.writer(f).writerow(self.table_columns(table).keys())
+
+        def write_batch(f, table, batch):
+            csv.writer(f).writerows([[to_text(value) for value in values] for values in batch])
+
+        self._export_text(folder, 'csv', write_header, write_batch)
+
+    def export_jsonl(self, folder):
+        """
+        Выгружает таблицы в файлы формата JSON Lines (по файлу на таблицу, по объекту на строку).
+        Двоичные данные выгружаются в шестнадцатиричном виде.
+
+        :param folder: каталог выгрузки
+        :type folder: string
+        """
+        def write_header(f, table):
+            pass
+
+        def write_batch(f, table, batch):
+            names = list(self.table_columns(table).keys())
+            f.write(''.join(
+                json.dumps(collections.OrderedDict(zip(names, [to_text(value) for value in values])),
+                           ensure_ascii=False) + '\n'
+                for values in batch))
+
+        self._export_text(folder, 'jsonl', write_header, write_batch)
+
+    def export(self, path, fmt='sqlite'):
+        """
+        Выгружает таблицы в указанном формате
+
+        :param path: имя файла БД SQLite или каталог выгрузки CSV/JSON Lines
+        :type path: string
+        :param fmt: формат выгрузки: 'sqlite', 'csv' или 'jsonl'
+        :type fmt: string
+        """
+        if fmt == 'sqlite':
+            self.export_sqlite(path)
+        elif fmt == 'csv':
+            self.export_csv(path)
+        elif fmt == 'jsonl':
+            self.export_jsonl(path)
+        else:
+            raise ValueError('Unsupported export format: {}'.format(fmt))
+
+
+def export(filename, path, fmt='sqlite', **kwargs):
+    """
+    Выгрузка всех таблиц файловой БД. Сахар для DatabaseExporter
+
+    :param filename: полное имя файла БД (1CD)
+    :type filename: string
+    :param path: имя файла БД SQLite или каталог выгрузки CSV/JSON Lines
+    :type path: string
+    :param fmt: формат выгрузки: 'sqlite', 'csv' или 'jsonl'
+    :type fmt: string
+    :param kwargs: параметры DatabaseExporter
+    """
+    with open(filename, 'rb') as f:
+        DatabaseExporter(DatabaseReader(f), **kwargs).export(path, fmt)
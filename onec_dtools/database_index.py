@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from struct import pack, unpack, calcsize
+import mmap
+import os
+
+SIDECAR_SIGNATURE = b'1CDIDXV1'
+# Сигнатура, длина ключа, число записей, число проиндексированных строк, длина данных таблицы,
+# хэш описания таблицы, хэш корневой страницы объекта данных таблицы
+SIDECAR_HEADER_FORMAT = '<8sIIIQ20s20s'
+SIDECAR_HEADER_SIZE = calcsize(SIDECAR_HEADER_FORMAT)
+# Индекс строки внутри записи
+SIDECAR_ROW_FORMAT = '<I'
+
+
+def write_sidecar(filename, key_length, rows_count, data_length, description_hash, root_hash, records):
+    """
+    Записывает файл индекса. Запись выполняется через временный файл, поэтому прерывание не портит прежний индекс.
+
+    :param filename: имя файла индекса
+    :type filename: string
+    :param key_length: длина ключа (байт)
+    :type key_length: int
+    :param rows_count: количество проиндексированных строк таблицы
+    :type rows_count: int
+    :param data_length: длина объекта данных таблицы (байт)
+    :type data_length: int
+    :param description_hash: SHA1 описания таблицы
+    :type description_hash: bytes
+    :param root_hash: SHA1 корневой страницы объекта данных таблицы
+    :type root_hash: bytes
+    :param records: упорядоченные по возрастанию пары (ключ, индекс строки)
+    :return: количество записанных ключей
+    :rtype: int
+    """
+    temp_name = filename + '.tmp'
+    count = 0
+    with open(temp_name, 'wb') as f:
+        f.write(b'\x00' * SIDECAR_HEADER_SIZE)
+        buffer = []
+        for key, row_index in records:
+            buffer.append(key)
+            buffer.append(pack(SIDECAR_ROW_FORMAT, row_index))
+            count += 1
+            if len(buffer) >= 2 * 65536:
+                f.write(b''.join(buffer))
+                buffer = []
+        f.write(b''.join(buffer))
+        f.seek(0)
+        f.write(pack(SIDECAR_HEADER_FORMAT, SIDECAR_SIGNATURE, key_length, count, rows_count, data_length,
+                     description_hash, root_hash))
+    os.replace(temp_name, filename)
+    return count
+
+
+class SidecarIndex(object):
+    """
+    Файл индекса колонки таблицы: упорядоченный массив записей (ключ, индекс строки), отображаемый в память.
+    Поиск ключа выполняется двоичным поиском.
+
+    :param filename: имя файла индекса
+    :type filename: string
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        header = unpack(SIDECAR_HEADER_FORMAT, self._file.read(SIDECAR_HEADER_SIZE))
+        if header[0] != SIDECAR_SIGNATURE:
+            self._file.close()
+            raise ValueError('Index file signature unknown')
+
+        self.key_length, self.count, self.rows_count, self.data_length, self.description_hash, self.root_hash = \
+            header[1:]
+        self._record_size = self.key_length + calcsize(SIDECAR_ROW_FORMAT)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def is_valid(self, data_length, description_hash, root_hash):
+        """
+        Проверяет соответствие индекса текущему состоянию таблицы
+
+        :return: индекс актуален
+        :rtype: bool
+        """
+        return (self.data_length, self.description_hash, self.root_hash) == \
+               (data_length, description_hash, root_hash)
+
+    def _key(self, i):
+        offset = SIDECAR_HEADER_SIZE + i * self._record_size
+        return self._mmap[offset:offset + self.key_length]
+
+    def find(self, key):
+        """
+        Ищет ключ в индексе
+
+        :param key: значение поля во внутреннем формате 1С
+        :type key: bytes
+        :return: индекс первой строки с указанным значением или None
+        :rtype: int
+        """
+        key = bytes(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count or self._key(lo) != key:
+            return None
+        offset = SIDECAR_HEADER_SIZE + lo * self._record_size + self.key_length
+        return unpack(SIDECAR_ROW_FORMAT, self._mmap[offset:offset + calcsize(SIDECAR_ROW_FORMAT)])[0]
+
+    def records(self):
+        """
+        Создает генератор записей индекса в порядке возрастания ключей
+
+        :return: генератор пар (ключ, индекс строки)
+        """
+        for i in range(self.count):
+            offset = SIDECAR_HEADER_SIZE + i * self._record_size
+            record = self._mmap[offset:offset + self._record_size]
+            yield record[:self.key_length], unpack(SIDECAR_ROW_FORMAT, record[self.key_length:])[0]
+
+    def close(self):
+        """
+        Закрывает файл индекса
+        """
+        self._mmap.close()
+        self._file.close()
+
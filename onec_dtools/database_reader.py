@@ -3,10 +3,20 @@ from struct import unpack, calcsize
 import collections
 import re
 import datetime as dt
+import hashlib
+import heapq
 import math
+import os
+import time
+from onec_dtools import stats
+from onec_dtools.database_index import SidecarIndex, write_sidecar
 
 ROOT_OBJECT_OFFSET = 2
 BLOB_CHUNK_SIZE = 256
+# Количество строк, считываемых за одно обращение к объекту БД при построении индексов
+INDEX_READ_ROWS = 1024
+# Количество хэш-индексов, одновременно хранимых в кэше Resolver
+RESOLVER_CACHE_SIZE = 16
 
 
 class FieldDescription(collections.namedtuple('FieldDescription', 'type, null_exists, length, precision,'
@@ -36,10 +46,26 @@ class FieldDescription(collections.namedtuple('FieldDescription', 'type, null_ex
 
     """
 
+
+class IndexDescription(collections.namedtuple('IndexDescription', 'is_primary, fields')):
+    """
+    Описание индекса таблицы
+
+    .. py:attribute:: is_primary
+
+    .. py:attribute:: fields
+
+        Список полей индекса в виде кортежей (имя поля, длина)
+
+    """
+
+
 table_description_pattern_text = '\{"(\S+)".*\n\{"Fields",\n([\s\S]*)\n\},\n\{"Indexes"(?:,|)([\s\S]*)\},' \
                                  '\n\{"Recordlock","(\d)+"\},\n\{"Files",(\S+)\}\n\}'
 table_description_pattern = re.compile(table_description_pattern_text)
 field_description_pattern = re.compile('\{"(\w+)","(\w+)",(\d+),(\d+),(\d+),"(\w+)"\}(?:,|)')
+index_description_pattern = re.compile('\{"(\w+)","(\d)",\s*((?:\{"\w+","?\d+"?\}(?:,|)\s*)+)\}')
+index_field_pattern = re.compile('\{"(\w+)","?(\d+)"?\}')
 
 
 def database_header(db_file):
@@ -328,6 +354,11 @@ class DBObject(object):
             bytes_left -= max_read
             buffer.append(self._db_file.read(max_read))
 
+        if stats.collector is not None:
+            # Каждая страница данных - одна пара seek + read
+            stats.collector.add('db_object', calls=1, seeks=len(buffer), reads=len(buffer), pages=len(buffer),
+                                bytes=sum(len(x) for x in buffer))
+
         return b''.join(buffer)
 
     def seek(self, pos):
@@ -345,6 +376,15 @@ class DBObject(object):
         # смещение внутри страницы данных
         self._pos_on_page = pos % self._page_size
 
+    def tell(self):
+        """
+        Возвращает текущую позицию относительно начала данных объекта
+
+        :return: Байт от начала данных объекта
+        :rtype: int
+        """
+        return self._current_data_page * self._page_size + self._pos_on_page
+
     def __len__(self):
         """
         Реализует интерфейс получения размера объета
@@ -369,19 +409,25 @@ class Table(object):
         self._version = version
         self._page_size = page_size
         self._db_object = None
+        self._sidecars = {}
 
         result = table_description_pattern.match(description)
         if result is None:
             raise ValueError("RAW table description doesn't match required format")
 
+        #: Описание таблицы во внутреннем формате 1С
+        self.description = description
         #: Имя таблицы
         self.name = result.group(1)
         self.record_lock = result.group(4) == '1'
         self.data_offset, self.blob_offset, self.index_offset = [int(x) for x in result.group(5).split(",")]
         #: Словарь описаний полей таблицы
         self.fields = collections.OrderedDict()
-        # информация об индексах таблицы пока не имеет практического применения, поэтому ее не разбираем
-        # текстовое описание индексов в result.group(3)
+        #: Словарь описаний индексов таблицы
+        self.indexes = collections.OrderedDict()
+        for res in index_description_pattern.finditer(result.group(3)):
+            index_fields = [(name, int(length)) for name, length in index_field_pattern.findall(res.group(3))]
+            self.indexes[res.group(1)] = IndexDescription(res.group(2) == '1', index_fields)
 
         offset = 17 if '"RV"' in result.group(2) else 1
         for field_str in result.group(2).splitlines():
@@ -432,6 +478,17 @@ class Table(object):
 
         :return: Итератор строк таблицы
         """
+        return self.iter_rows()
+
+    def iter_rows(self, start=0):
+        """
+        Создает генератор строк таблицы, начиная с указанной
+
+        :param start: индекс первой строки
+        :type start: int
+        :return: Итератор строк таблицы
+        """
+        self._data_object.seek(self._row_length * start)
         while True:
             row_bytes = self._data_object.read(self._row_length)
             if not row_bytes:
@@ -450,12 +507,167 @@ class Table(object):
         if isinstance(key, int):
             if key >= len(self):
                 raise IndexError('Index outside of table length')
-            self._db_object.seek(self._row_length * key)
-            row_bytes = self._db_object.read(self._row_length)
+            # Сохраняем позицию, чтобы не нарушить идущий перебор строк таблицы
+            position = self._data_object.tell()
+            self._data_object.seek(self._row_length * key)
+            row_bytes = self._data_object.read(self._row_length)
+            self._data_object.seek(position)
             return Row(self._db_file, self._version, self._page_size, row_bytes, self)
         else:
             raise TypeError('Index must be int')
 
+    def index_records(self, column, start=0):
+        """
+        Создает генератор значений поля таблицы для построения индексов.
+        Данные таблицы считываются большими блоками без создания объектов строк.
+        Пустые строки и значения NULL пропускаются.
+
+        :param column: Имя колонки
+        :type column: string
+        :param start: индекс строки, с которой начинается чтение
+        :type start: int
+        :return: генератор пар (значение поля во внутреннем формате 1С, индекс строки)
+        """
+        field = self.fields[column]
+        key_start = field.data_offset + (1 if field.null_exists else 0)
+        key_end = field.data_offset + field.data_length
+
+        position = self._data_object.tell()
+        next_position = self._row_length * start
+        row_index = start
+        while True:
+            # Позиция восстанавливается перед каждым чтением, т.к. между чтениями объект могут использовать другие
+            self._data_object.seek(next_position)
+            buffer = self._data_object.read(self._row_length * INDEX_READ_ROWS)
+            next_position = self._data_object.tell()
+            self._data_object.seek(position)
+            if not buffer:
+                break
+            for row_offset in range(0, len(buffer), self._row_length):
+                if buffer[row_offset] == 1 or (field.null_exists and buffer[row_offset + field.data_offset] == 0):
+                    # Пустая строка или NULL
+                    row_index += 1
+                    continue
+                yield buffer[row_offset + key_start:row_offset + key_end], row_index
+                row_index += 1
+
+    def build_hash_index(self, column):
+        """
+        Строит хэш-индекс по значениям поля таблицы за один проход по данным таблицы.
+        Пустые строки и значения NULL в индекс не попадают. При повторяющихся значениях в индекс попадает первая строка.
+
+        :param column: Имя колонки
+        :type column: string
+        :return: словарь: значение поля во внутреннем формате 1С -> индекс строки
+        :rtype: dict
+        """
+        index = {}
+        for key, row_index in self.index_records(column):
+            if key not in index:
+                index[key] = row_index
+        return index
+
+    def sidecar_path(self, column):
+        """
+        Возвращает имя файла индекса колонки по умолчанию: рядом с файлом БД
+
+        :param column: Имя колонки
+        :type column: string
+        :return: имя файла индекса
+        :rtype: string
+        """
+        return '.'.join([self._db_file.name, self.name, column, 'idx'])
+
+    def _sidecar_state(self):
+        """
+        Возвращает состояние таблицы для проверки актуальности файлов индексов
+
+        :return: длина объекта данных, SHA1 описания таблицы, SHA1 корневой страницы объекта данных
+        :rtype: tuple
+        """
+        self._db_file.seek(self._page_size * self.data_offset)
+        root_hash = hashlib.sha1(self._db_file.read(self._page_size)).digest()
+        description_hash = hashlib.sha1(self.description.encode('utf-8')).digest()
+        return len(self._data_object), description_hash, root_hash
+
+    def build_sidecar(self, column, path=None, incremental=False):
+        """
+        Строит файл индекса колонки таблицы (упорядоченный массив "значение поля -> индекс строки").
+        Актуальный индекс переиспользуется. При incremental=True и увеличении размера таблицы в индекс добавляются
+        только новые строки: предполагается, что существующие строки не изменялись.
+
+        :param column: Имя колонки
+        :type column: string
+        :param path: имя файла индекса. По умолчанию - рядом с файлом БД
+        :type path: string
+        :param incremental: разрешить дополнение существующего индекса
+        :type incremental: bool
+        :return: имя файла индекса
+        :rtype: string
+        """
+        if path is None:
+            path = self.sidecar_path(column)
+
+        field = self.fields[column]
+        key_length = field.data_length - (1 if field.null_exists else 0)
+        data_length, description_hash, root_hash = self._sidecar_state()
+
+        if (column, path) in self._sidecars:
+            self._sidecars.pop((column, path)).close()
+
+        old_index = None
+        if os.path.exists(path):
+            old_index = SidecarIndex(path)
+            if old_index.is_valid(data_length, description_hash, root_hash):
+                old_index.close()
+                return path
+
+        try:
+            if incremental and old_index is not None and old_index.key_length == key_length and \
+                    old_index.description_hash == description_hash and old_index.data_length <= data_length:
+                new_records = sorted(self.index_records(column, old_index.rows_count))
+                records = heapq.merge(old_index.records(), new_records)
+            else:
+                records = sorted(self.index_records(column))
+            write_sidecar(path, key_length, len(self), data_length, description_hash, root_hash, records)
+        finally:
+            if old_index is not None:
+                old_index.close()
+        return path
+
+    def lookup_sidecar(self, column, key, path=None):
+        """
+        Находит строку таблицы по значению колонки при помощи файла индекса.
+        Неактуальный или отсутствующий индекс строится заново. Открытый индекс проверяется при каждом поиске:
+        если таблица изменилась, то ее объект данных считывается заново, а индекс перестраивается.
+
+        :param column: Имя колонки
+        :type column: string
+        :param key: Значение поля во внутреннем формате 1С
+        :type key: bytes
+        :param path: имя файла индекса. По умолчанию - рядом с файлом БД
+        :type path: string
+        :return: Строка таблицы или None, если строка не найдена
+        :rtype: Row
+        """
+        if path is None:
+            path = self.sidecar_path(column)
+
+        index = self._sidecars.get((column, path))
+        if index is not None and not index.is_valid(*self._sidecar_state()):
+            self._sidecars.pop((column, path)).close()
+            # Размещение объекта данных могло измениться
+            self._db_object = None
+            index = None
+        if index is None:
+            self.build_sidecar(column, path)
+            index = SidecarIndex(path)
+            self._sidecars[(column, path)] = index
+        row_index = index.find(key)
+        if row_index is None:
+            return None
+        return self[row_index]
+
 
 class Row(object):
     """
@@ -529,11 +741,19 @@ class Row(object):
             return None
 
         if key in self._fields_values:
+            if stats.collector is not None:
+                stats.collector.add('row', cache_hits=1)
             return self._fields_values[key]
         else:
             field = self._fields[key]
             field_bytes = self._row_bytes[field.data_offset:field.data_offset + field.data_length]
-            result = self._convert(field_bytes, field)
+            if stats.collector is None:
+                result = self._convert(field_bytes, field)
+            else:
+                start_time = time.perf_counter()
+                result = self._convert(field_bytes, field)
+                stats.collector.add_time('convert.' + field.type, time.perf_counter() - start_time)
+                stats.collector.add('row', cache_misses=1)
             self._fields_values[key] = result
             return result
 
@@ -629,7 +849,7 @@ class Blob(object):
         if self._size == 0:
             # Пустой BLOB. И такое бывает.
             yield b''
-            raise StopIteration
+            return
 
         self._db_object.seek(BLOB_CHUNK_SIZE * self._blob_chunk_offset)
         while True:
@@ -637,6 +857,9 @@ class Blob(object):
             buffer = self._db_object.read(BLOB_CHUNK_SIZE)
             next_block, size, data = unpack('Ih250s', bytes(buffer))
 
+            if stats.collector is not None:
+                stats.collector.add('blob', chunks=1, bytes=size)
+
             yield data[:size]
 
             if next_block == 0:
@@ -677,3 +900,104 @@ class DatabaseReader(object):
         for description in tables_descriptions:
             table = Table(self._db_file, self.version, self.page_size, description)
             self.tables[table.name] = table
+
+        self._resolver = None
+
+    def resolver(self):
+        """
+        Возвращает объект разыменования ссылок между таблицами БД.
+        Объект общий для всех вызовов, поэтому построенные им индексы переиспользуются.
+
+        :return: объект разыменования ссылок
+        :rtype: Resolver
+        """
+        if self._resolver is None:
+            self._resolver = Resolver(self.tables)
+        return self._resolver
+
+
+class Resolver(object):
+    """
+    Разыменование ссылок (например, значений полей _IDRREF) между таблицами БД при помощи хэш-индексов.
+    Индекс строится при первом обращении к колонке таблицы и хранится в кэше.
+    При переполнении кэша вытесняется индекс, к которому дольше всего не обращались.
+
+    :param tables: Словарь таблиц БД
+    :type tables: OrderedDict
+    :param cache_size: Максимальное количество хранимых индексов
+    :type cache_size: int
+    """
+    def __init__(self, tables, cache_size=RESOLVER_CACHE_SIZE):
+        self._tables = tables
+        self._cache_size = cache_size
+        self._indexes = collections.OrderedDict()
+
+    def index(self, table_name, column='_IDRREF'):
+        """
+        Возвращает хэш-индекс колонки таблицы, при необходимости строя его
+
+        :param table_name: Имя таблицы
+        :type table_name: string
+        :param column: Имя колонки
+        :type column: string
+        :return: словарь: значение поля во внутреннем формате 1С -> индекс строки
+        :rtype: dict
+        """
+        key = (table_name, column)
+        if key in self._indexes:
+            if stats.collector is not None:
+                stats.collector.add('resolver', cache_hits=1)
+            self._indexes.move_to_end(key)
+            return self._indexes[key]
+
+        if stats.collector is not None:
+            stats.collector.add('resolver', cache_misses=1)
+
+        index = self._tables[table_name].build_hash_index(column)
+        self._indexes[key] = index
+        if len(self._indexes) > self._cache_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    def get(self, table_name, value, column='_IDRREF'):
+        """
+        Находит строку таблицы по значению колонки
+
+        :param table_name: Имя таблицы
+        :type table_name: string
+        :param value: Значение поля во внутреннем формате 1С
+        :type value: bytes
+        :param column: Имя колонки
+        :type column: string
+        :return: Строка таблицы или None, если строка не найдена
+        :rtype: Row
+        """
+        if value is None:
+            return None
+        row_index = self.index(table_name, column).get(bytes(value))
+        if row_index is None:
+            return None
+        return self._tables[table_name][row_index]
+
+    def deref(self, row, field, table_name, column='_IDRREF'):
+        """
+        Разыменовывает ссылку, хранящуюся в поле строки
+
+        :param row: Строка, содержащая ссылку
+        :type row: Row
+        :param field: Имя поля ссылки
+        :type field: string
+        :param table_name: Имя таблицы, на которую указывает ссылка
+        :type table_name: string
+        :param column: Имя колонки целевой таблицы, по которой выполняется поиск
+        :type column: string
+        :return: Строка целевой таблицы или None
+        :rtype: Row
+        """
+        return self.get(table_name, row[field], column)
+
+    def clear(self):
+        """
+        Очищает кэш индексов
+        """
+        self._indexes.clear()
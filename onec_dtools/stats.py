@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import collections
+
+# Сбор статистики операций чтения.
+# По умолчанию сбор выключен: инструментированный код проверяет только, что collector равен None.
+
+#: Активный сборщик статистики. None - сбор статистики выключен
+collector = None
+
+
+class ReadStats(object):
+    """
+    Счетчики операций чтения
+
+    :param hook: функция, вызываемая при каждом событии с параметрами (имя события, словарь значений)
+    :type hook: callable
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.counters = collections.Counter()
+        self.timings = collections.Counter()
+
+    def add(self, event, **values):
+        """
+        Регистрирует событие. Значения добавляются к счетчикам с именами вида "событие.значение"
+
+        :param event: имя события
+        :type event: string
+        :param values: значения счетчиков события
+        """
+        for name, value in values.items():
+            self.counters['.'.join([event, name])] += value
+        if self.hook is not None:
+            self.hook(event, values)
+
+    def add_time(self, category, seconds):
+        """
+        Добавляет время, затраченное на операцию
+
+        :param category: категория операции (например, тип поля)
+        :type category: string
+        :param seconds: затраченное время (секунд)
+        :type seconds: float
+        """
+        self.timings[category] += seconds
+        if self.hook is not None:
+            self.hook('time', {category: seconds})
+
+    def as_dict(self):
+        """
+        Возвращает статистику в виде словаря
+
+        :return: словарь {'counters': {...}, 'timings': {...}}
+        :rtype: dict
+        """
+        return {'counters': dict(self.counters), 'timings': dict(self.timings)}
+
+
+def enable(hook=None):
+    """
+    Включает сбор статистики. Ранее собранная статистика сбрасывается.
+
+    :param hook: функция, вызываемая при каждом событии с параметрами (имя события, словарь значений)
+    :type hook: callable
+    :return: сборщик статистики
+    :rtype: ReadStats
+    """
+    global collector
+    collector = ReadStats(hook)
+    return collector
+
+
+def disable():
+    """
+    Выключает сбор статистики
+    """
+    global collector
+    collector = None
+
+
+def get_stats():
+    """
+    Возвращает собранную статистику
+
+    :return: словарь {'counters': {...}, 'timings': {...}}. Пустой словарь, если сбор статистики выключен
+    :rtype: dict
+    """
+    if collector is None:
+        return {}
+    return collector.as_dict()
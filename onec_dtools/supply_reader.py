@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from struct import unpack, calcsize
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+import fnmatch
 import zlib
-import tempfile
 import os
+from onec_dtools.container_reader import ContainerReader, is_container, CONTAINER_SIGNATURE_64
+
+# Суффикс имени каталога распаковки вложенного контейнера
+EXTRACTED_SUFFIX = '.extracted'
 
 
 def read_string(file):
@@ -67,6 +72,125 @@ def read_included_file_info(file):
     return filename, timestamp, file_size
 
 
+def extract_container(path):
+    """
+    Рекурсивно распаковывает файл контейнера из поставки в каталог рядом с ним (имя файла + EXTRACTED_SUFFIX).
+    Используется при распаковке поставки с распаковкой вложенных контейнеров.
+
+    :param path: путь файла контейнера
+    :type path: string
+    :return: False, если файл не является контейнером
+    :rtype: bool
+    """
+    with open(path, 'rb') as f:
+        if not is_container(f.read(len(CONTAINER_SIGNATURE_64))):
+            return False
+        ContainerReader(f).extract(path + EXTRACTED_SUFFIX, deflate=True, recursive=True)
+    return True
+
+
+class InflatingStream(object):
+    """
+    Поток разархивированных данных EFD файла для последовательного чтения.
+    Данные разархивируются по мере чтения во вращающийся буфер, размер которого ограничен размером блока.
+
+    :param file: файл поставки (EFD)
+    :type file: BufferedReader
+    :param chunk_size: размер блока чтения и разархивирования данных (байт)
+    :type chunk_size: int
+    """
+    def __init__(self, file, chunk_size):
+        self._file = file
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(-15)
+        self._buffer = bytearray()
+        self._offset = 0
+        self._eof = False
+
+    def _inflate(self):
+        """
+        Разархивирует следующую порцию данных в буфер
+        """
+        if self._offset:
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+        data = self._decompressor.unconsumed_tail
+        if not data:
+            data = self._file.read(self.chunk_size)
+            if not data:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+                return
+        self._buffer += self._decompressor.decompress(data, self.chunk_size)
+
+    def _available(self):
+        return len(self._buffer) - self._offset
+
+    def read(self, size):
+        """
+        Считывает данные
+
+        :param size: размер данных (байт)
+        :type size: int
+        :return: данные. Меньше указанного размера только в конце потока
+        :rtype: bytes
+        """
+        while self._available() < size and not self._eof:
+            self._inflate()
+        data = bytes(self._buffer[self._offset:self._offset + size])
+        self._offset += len(data)
+        return data
+
+    def _chunks(self, size):
+        """
+        Создает генератор фрагментов данных указанного размера по мере разархивирования
+        """
+        left = size
+        while left > 0:
+            if not self._available():
+                if self._eof:
+                    break
+                self._inflate()
+                continue
+            length = min(left, self._available())
+            with memoryview(self._buffer) as view:
+                chunk = view[self._offset:self._offset + length]
+                yield chunk
+                # Буфер не может быть изменен, пока на него есть ссылки
+                chunk.release()
+            self._offset += length
+            left -= length
+
+    def copy_to(self, out_file, size):
+        """
+        Записывает данные в файл по мере разархивирования
+
+        :param out_file: файл назначения
+        :type out_file: BufferedWriter
+        :param size: размер данных (байт)
+        :type size: int
+        :return: количество записанных байт
+        :rtype: int
+        """
+        written = 0
+        for chunk in self._chunks(size):
+            out_file.write(chunk)
+            written += len(chunk)
+        return written
+
+    def skip(self, size):
+        """
+        Пропускает данные. Данные разархивируются и отбрасываются без накопления в памяти.
+
+        :param size: размер данных (байт)
+        :type size: int
+        :return: количество пропущенных байт
+        :rtype: int
+        """
+        return sum(len(chunk) for chunk in self._chunks(size))
+
+
 class SupplyReader(object):
     """
     Класс для чтения файлов поставок
@@ -83,37 +207,85 @@ class SupplyReader(object):
         self.description = {}
         self.included_files = []
 
-    def unpack(self, output_dir):
+    def _open_stream(self):
         """
-        Распаковка файла поставки
+        Открывает поток разархивированных данных с начала файла и считывает заголовки
+        """
+        self.file.seek(0)
+        stream = InflatingStream(self.file, self.CHUNK_SIZE)
+        self.read_headers(stream)
+        return stream
 
-        :param output_dir: Каталог распаковки
-        :type output_dir: string
+    def read_headers(self, stream):
         """
-        with tempfile.TemporaryFile() as f:
-            decompressor = zlib.decompressobj(-15)
-            while True:
-                chunk = self.file.read(self.CHUNK_SIZE)
-                if not chunk:
-                    break
-                f.write(decompressor.decompress(chunk))
-            f.seek(0)
+        Считывает описание поставки и список вложенных файлов
+
+        :param stream: поток разархивированных данных
+        :type stream: InflatingStream
+        """
+        header, supply_info_count = unpack('II', stream.read(8))
+        # Во всех исследованных файлах поставок заголовок был равен 1.
+        # Возможно это версия формата?
+        assert header == 1
+
+        self.description = {}
+        for i in range(supply_info_count):
+            lang, supply_name, provider_name, description_path = read_supply_info(stream)
+            self.description[lang] = supply_name, provider_name, description_path
+
+        self.included_files = []
+        included_files_count = unpack('I', stream.read(4))[0]
+        for i in range(included_files_count):
+            self.included_files.append(read_included_file_info(stream))
+
+    def list(self):
+        """
+        Считывает описание поставки и список вложенных файлов.
+        Разархивируется только начало файла до конца списка вложенных файлов.
+
+        :return: список описаний вложенных файлов: (имя файла, время создания, размер файла (байт))
+        :rtype: list
+        """
+        self._open_stream()
+        return list(self.included_files)
 
-            header, supply_info_count = unpack('II', f.read(8))
-            # Во всех исследованных файлах поставок заголовок был равен 1.
-            # Возможно это версия формата?
-            assert header == 1
+    def extract(self, patterns, output_dir, extract_containers=False, workers=None):
+        """
+        Распаковка вложенных файлов, имена которых соответствуют шаблонам.
+        Данные остальных файлов разархивируются и отбрасываются, разархивирование прекращается
+        после последнего подходящего файла.
 
-            for i in range(supply_info_count):
-                lang, supply_name, provider_name, description_path = read_supply_info(f)
-                self.description[lang] = supply_name, provider_name, description_path
+        :param patterns: шаблоны имен файлов (fnmatch) с разделителем каталогов "/", например "*.cf".
+            None - все файлы
+        :type patterns: list
+        :param output_dir: Каталог распаковки
+        :type output_dir: string
+        :param extract_containers: рекурсивно распаковывать файлы контейнеров (конфигурации, обновления и т.п.)
+            в каталоги рядом с ними (имя файла + EXTRACTED_SUFFIX)
+        :type extract_containers: bool
+        :param workers: количество процессов для распаковки контейнеров. Контейнеры распаковываются в пуле
+            процессов по мере записи, одновременно с разархивированием поставки.
+            None - распаковка в текущем процессе
+        :type workers: int
+        :return: список имен распакованных файлов
+        :rtype: list
+        """
+        stream = self._open_stream()
+        executor = None if not extract_containers or workers is None else ProcessPoolExecutor(max_workers=workers)
+        futures = []
 
-            included_files_count = unpack('I', f.read(4))[0]
-            for i in range(included_files_count):
-                self.included_files.append(read_included_file_info(f))
+        def selected(name):
+            return patterns is None or \
+                any(fnmatch.fnmatchcase(name.replace('\\', '/'), pattern) for pattern in patterns)
 
-            for included_file in self.included_files:
+        extracted = []
+        try:
+            last = max([i for i, x in enumerate(self.included_files) if selected(x[0])], default=-1)
+            for included_file in self.included_files[:last + 1]:
                 src_path, mtime, size = included_file
+                if not selected(src_path):
+                    stream.skip(size)
+                    continue
 
                 # Путь все время указан с \ слэшем (Windows style)
                 path = os.path.join(
@@ -126,9 +298,36 @@ class SupplyReader(object):
                     os.makedirs(dir_name)
 
                 with open(path, 'wb') as out_file:
-                    for i in range(size // self.CHUNK_SIZE):
-                        out_file.write(f.read(self.CHUNK_SIZE))
-                    out_file.write(f.read(size % self.CHUNK_SIZE))
+                    stream.copy_to(out_file, size)
 
                 timestamp = mtime.timestamp()
-                os.utime(path, (timestamp, timestamp))
\ No newline at end of file
+                os.utime(path, (timestamp, timestamp))
+                extracted.append(src_path)
+
+                if extract_containers:
+                    if executor is None:
+                        extract_container(path)
+                    else:
+                        futures.append(executor.submit(extract_container, path))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        for future in futures:
+            # Исключения, возникшие при распаковке контейнеров
+            future.result()
+        return extracted
+
+    def unpack(self, output_dir, extract_containers=False, workers=None):
+        """
+        Распаковка файла поставки.
+        Выполняется за один проход: данные вложенных файлов записываются по мере разархивирования.
+
+        :param output_dir: Каталог распаковки
+        :type output_dir: string
+        :param extract_containers: рекурсивно распаковывать файлы контейнеров в каталоги рядом с ними
+        :type extract_containers: bool
+        :param workers: количество процессов для распаковки контейнеров. None - распаковка в текущем процессе
+        :type workers: int
+        """
+        self.extract(None, output_dir, extract_containers, workers)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+from struct import pack
+import datetime
+import os
+import queue
+import threading
+import zlib
+
+# Начало отсчета FILETIME
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1)
+
+
+def write_string(value):
+    """
+    Формирует строковое значение для записи в EFD файл
+
+    :param value: строковое значение
+    :type value: string
+    :return: длина строки в символах UTF-16 и данные строки
+    :rtype: bytes
+    """
+    data = value.encode('utf-16-le')
+    return pack('I', len(data) // 2) + data
+
+
+def supply_info(lang, supply_name, provider_name, description_path):
+    """
+    Формирует информацию о комплекте поставки
+
+    :param lang: язык
+    :type lang: string
+    :param supply_name: наименование комплекта
+    :type supply_name: string
+    :param provider_name: наименование поставщика
+    :type provider_name: string
+    :param description_path: путь к файлу описания
+    :type description_path: string
+    :return: данные информации о комплекте поставки
+    :rtype: bytes
+    """
+    # Назначение первых 4 байт неизвестно
+    return b''.join([b'\x00' * 4, write_string(lang), write_string(supply_name), write_string(provider_name),
+                     write_string(description_path)])
+
+
+def included_file_info(filename, timestamp, file_size):
+    """
+    Формирует описание вложенного файла
+
+    :param filename: имя файла (с разделителем каталогов \\)
+    :type filename: string
+    :param timestamp: время создания
+    :type timestamp: datetime.datetime
+    :param file_size: размер файла (байт)
+    :type file_size: int
+    :return: данные описания вложенного файла
+    :rtype: bytes
+    """
+    # FILETIME - 64-битовое значение, представляющее число интервалов по 100 наносекунд с 1 января 1601
+    filetime = (timestamp - FILETIME_EPOCH) // datetime.timedelta(microseconds=1) * 10
+    # Назначение 4 байт перед именем и перед размером неизвестно
+    return b''.join([b'\x00' * 4, write_string(filename), pack('Q', filetime), b'\x00' * 4, pack('I', file_size)])
+
+
+def read_chunks_ahead(fd, chunk_size, depth):
+    """
+    Создает генератор блоков данных файла. Файл читается в отдельном потоке с опережением не более чем на depth
+    блоков, что позволяет совместить чтение со сжатием.
+
+    :param fd: объект файла
+    :type fd: BufferedReader
+    :param chunk_size: размер блока (байт)
+    :type chunk_size: int
+    :param depth: количество блоков, прочитанных с опережением
+    :type depth: int
+    :return: генератор блоков данных
+    """
+    chunks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                chunk = fd.read(chunk_size)
+                chunks.put(chunk)
+                if not chunk:
+                    break
+        except Exception as exc:
+            chunks.put(exc)
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        stop.set()
+        # Освобождаем место в очереди, если поток чтения ожидает его
+        while thread.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+class SupplyWriter(object):
+    """
+    Класс для записи файлов поставок.
+    Весь файл поставки - единый поток сжатых данных: заголовок, описание поставки, список вложенных файлов
+    и данные вложенных файлов записываются за один проход.
+
+    :param file: файл поставки (EFD)
+    :type file: BufferedWriter
+    :param level: уровень сжатия
+    :type level: int
+    """
+
+    # Размер блока чтения данных, байт
+    CHUNK_SIZE = 10*1024*1024
+    # Количество блоков, прочитанных с опережением
+    READ_AHEAD = 2
+
+    def __init__(self, file, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.file = file
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._included_files = []
+
+    def write(self, data):
+        """
+        Сжимает и записывает данные
+
+        :param data: данные
+        :type data: bytes
+        """
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self.file.write(compressed)
+
+    def write_headers(self, description, included_files):
+        """
+        Записывает заголовок, описание поставки и список вложенных файлов
+
+        :param description: описание поставки: словарь {язык: (наименование комплекта, наименование поставщика,
+            путь к файлу описания)}, аналогично SupplyReader.description
+        :type description: dict
+        :param included_files: список описаний вложенных файлов: (имя файла, время создания, размер файла (байт)),
+            аналогично SupplyReader.included_files
+        :type included_files: list
+        """
+        data = [pack('II', 1, len(description))]
+        for lang, (supply_name, provider_name, description_path) in description.items():
+            data.append(supply_info(lang, supply_name, provider_name, description_path))
+        data.append(pack('I', len(included_files)))
+        for filename, timestamp, file_size in included_files:
+            data.append(included_file_info(filename, timestamp, file_size))
+        self.write(b''.join(data))
+        self._included_files = list(included_files)
+
+    def write_file(self, fd, size):
+        """
+        Записывает данные вложенного файла. Файлы записываются в порядке списка вложенных файлов.
+
+        :param fd: объект файла
+        :type fd: BufferedReader
+        :param size: размер файла из списка вложенных файлов (байт)
+        :type size: int
+        """
+        written = 0
+        for chunk in read_chunks_ahead(fd, self.CHUNK_SIZE, self.READ_AHEAD):
+            written += len(chunk)
+            if written > size:
+                break
+            self.write(chunk)
+        if written != size:
+            raise ValueError('File size changed: expected {}, got {}'.format(size, written))
+
+    def write_folder(self, description, folder):
+        """
+        Записывает поставку из каталога. Вложенные каталоги сохраняются в именах файлов.
+
+        :param description: описание поставки
+        :type description: dict
+        :param folder: каталог с файлами поставки
+        :type folder: string
+        """
+        paths = []
+        for dir_path, dir_names, file_names in os.walk(folder):
+            dir_names.sort()
+            paths.extend(os.path.join(dir_path, x) for x in sorted(file_names))
+
+        included_files = []
+        for path in paths:
+            file_stat = os.stat(path)
+            # Путь все время указан с \ слэшем (Windows style)
+            filename = '\\'.join(os.path.relpath(path, folder).split(os.sep))
+            included_files.append((filename, datetime.datetime.fromtimestamp(file_stat.st_mtime), file_stat.st_size))
+
+        self.write_headers(description, included_files)
+        for path, (_, _, file_size) in zip(paths, included_files):
+            with open(path, 'rb') as fd:
+                self.write_file(fd, file_size)
+
+    def close(self):
+        """
+        Завершает сжатый поток данных
+        """
+        self.file.write(self._compressor.flush())
+
+    def __enter__(self):
+        """
+        Вход в блок. Позволяет применять оператор with.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Выход из блока. Позволяет применять оператор with.
+        """
+        if exc_type is None:
+            self.close()
+
+
+def build_supply(folder, filename, description):
+    """
+    Запаковывает каталог в файл поставки.
+    Сахар для SupplyWriter.
+
+    :param folder: каталог с файлами поставки
+    :type folder: string
+    :param filename: имя файла поставки
+    :type filename: string
+    :param description: описание поставки: словарь {язык: (наименование комплекта, наименование поставщика,
+        путь к файлу описания)}
+    :type description: dict
+    """
+    with open(filename, 'wb') as f, SupplyWriter(f) as supply:
+        supply.write_folder(description, folder)
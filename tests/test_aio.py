@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import sys
+import zlib
+import pytest
+import onec_dtools
+from onec_dtools.aio import AsyncContainerReader, AsyncSupplyReader, AsyncDatabaseReader
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def container_file(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('data.txt').write_binary(os.urandom(300000))
+    src.mkdir('nested').join('inner.txt').write_binary(b'inner')
+    file_path = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(str(src), file_path)
+    return file_path
+
+
+def test_async_container(container_file, tmpdir):
+    async def read_entry(reader, name, inflate):
+        chunks = []
+        async for chunk in reader.read(name, inflate, chunk_size=4096):
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def main():
+        async with AsyncContainerReader(container_file, queue_size=2) as reader:
+            assert list(await reader.entries()) == ['data.txt', 'nested']
+            # Одновременные запросы к одному файлу. Файлы вложенных контейнеров не сжимаются
+            data, inner = await asyncio.gather(read_entry(reader, 'data.txt', True),
+                                               read_entry(reader, 'nested/inner.txt', False))
+            await reader.extract(str(tmpdir.join('extract')), deflate=True, recursive=True)
+        return data, inner
+
+    data, inner = run(main())
+    assert data == tmpdir.join('src', 'data.txt').read_binary()
+    assert inner == b'inner'
+    assert tmpdir.join('extract', 'nested', 'inner.txt').read_binary() == b'inner'
+
+
+def test_async_supply(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('1cv8.mft').write_binary(b'mft')
+    supply_path = str(tmpdir.join('1cv8.efd'))
+    onec_dtools.build_supply(str(src), supply_path, {'ru': ('Поставка', 'Поставщик', '1cv8.mft')})
+
+    async def main():
+        reader = AsyncSupplyReader(supply_path)
+        included_files = await reader.list()
+        extracted = await reader.extract(['*.mft'], str(tmpdir.join('unpack')))
+        return included_files, extracted
+
+    included_files, extracted = run(main())
+    assert [x[0] for x in included_files] == extracted == ['1cv8.mft']
+    assert tmpdir.join('unpack', '1cv8.mft').read_binary() == b'mft'
+
+
+@pytest.fixture(params=['Platform8Demo/8-3-8_4K.1CD'])
+def db_path(request):
+    return os.path.join(sys.path[0], 'fixtures', request.param)
+
+
+def test_async_database(db_path):
+    async def main():
+        async with AsyncDatabaseReader(db_path) as db:
+            table = db.table('CONFIG')
+            count = 0
+            async for row in table:
+                if not row.is_empty:
+                    chunks = []
+                    async for chunk in db.blob(row['BINARYDATA']):
+                        chunks.append(chunk)
+                    assert b''.join(chunks) == await db.read_blob(row['BINARYDATA'])
+                count += 1
+            assert count == await table.len()
+
+    run(main())
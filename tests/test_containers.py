@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import tarfile
 import shutil
+import struct
+import zipfile
+import zlib
 import pytest
 import onec_dtools
 
@@ -26,9 +30,415 @@ def packed_file(tmpdir_factory):
     os.unlink(path)
 
 
+@pytest.fixture
+def source_dir(tmpdir):
+    """
+    Синтетический каталог для упаковки: файлы и вложенные каталоги (вложенные контейнеры) в два уровня
+    """
+    src = tmpdir.mkdir('source')
+    for i in range(3):
+        folder = src.mkdir('f{:02}'.format(i))
+        folder.join('text').write_binary('text {}\n'.format(i).encode() * 1000)
+        folder.mkdir('sub').join('leaf').write_binary(os.urandom(1000))
+    src.join('big').write_binary(os.urandom(100000) + b'\x00' * 100000)
+    src.join('version').write_binary(b'version')
+    return str(src)
+
+
+def read_tree(path):
+    """
+    Считывает содержимое каталога: словарь {относительный путь: данные}
+    """
+    tree = {}
+    for dir_path, _, filenames in os.walk(path):
+        for name in filenames:
+            with open(os.path.join(dir_path, name), 'rb') as f:
+                tree[os.path.relpath(os.path.join(dir_path, name), path)] = f.read()
+    return tree
+
+
+def extract_tree(filename, path):
+    with open(filename, 'rb') as f:
+        onec_dtools.ContainerReader(f).extract(path, deflate=True, recursive=True)
+    return read_tree(path)
+
+
 def test_extract(conf_file, extract_dir):
     onec_dtools.extract(conf_file, extract_dir)
 
 
 def test_build(extract_dir, packed_file):
-    onec_dtools.build(extract_dir, packed_file)
\ No newline at end of file
+    onec_dtools.build(extract_dir, packed_file)
+
+
+def test_extract_parallel(conf_file, tmpdir):
+    onec_dtools.extract(conf_file, str(tmpdir.join('extract')), workers=2)
+
+
+def test_extract_parallel_tree(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    onec_dtools.extract(packed, str(tmpdir.join('extract')), workers=2)
+    assert read_tree(str(tmpdir.join('extract'))) == read_tree(source_dir)
+
+
+def test_extract_mmap(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    onec_dtools.extract(packed, str(tmpdir.join('extract')), use_mmap=True)
+    assert read_tree(str(tmpdir.join('extract'))) == read_tree(source_dir)
+
+
+def test_empty_container_mmap(tmpdir):
+    empty = tmpdir.join('empty.cf')
+    empty.write_binary(struct.pack('4i', onec_dtools.container_reader.END_MARKER, 0, 0, 0))
+    for use_mmap in (False, True):
+        with open(str(empty), 'rb') as f, pytest.raises(BufferError, match='Container is empty'):
+            onec_dtools.ContainerReader(f, use_mmap=use_mmap)
+
+
+def test_open_entry(conf_file):
+    with open(conf_file, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f)
+        with reader.open('version', inflate=True) as entry:
+            data = entry.read()
+            entry.seek(0)
+            assert entry.read() == data
+
+
+def test_entries_lookup_during_iteration(tmpdir):
+    src = tmpdir.mkdir('src')
+    names = ['file{:02}'.format(i) for i in range(45)]
+    for name in names:
+        src.join(name).write_binary(name.encode())
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(str(src), packed)
+    with open(packed, 'rb') as f:
+        entries = onec_dtools.ContainerReader(f).entries
+        iterated = []
+        for name in entries:
+            iterated.append(name)
+            # Обращение по имени считывает описания следующих файлов
+            entries['file30']
+        assert iterated == names
+
+
+def test_open_nested_entry(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    index_path = str(tmpdir.join('packed.idx'))
+    with open(packed, 'rb') as f:
+        onec_dtools.ContainerReader(f).save_index(index_path)
+    with open(os.path.join(source_dir, 'f00', 'sub', 'leaf'), 'rb') as f:
+        leaf = f.read()
+    for path in (None, index_path):
+        with open(packed, 'rb') as f:
+            with onec_dtools.ContainerReader(f, index_path=path).open('f00/sub/leaf') as entry:
+                assert entry.read() == leaf
+
+
+def test_container_index(conf_file, tmpdir):
+    index_path = str(tmpdir.join('conf.idx'))
+    with open(conf_file, 'rb') as f:
+        onec_dtools.ContainerReader(f).save_index(index_path)
+    with open(conf_file, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f, index_path=index_path)
+        assert isinstance(reader.entries, onec_dtools.container_reader.IndexedEntries)
+        with reader.open('root', inflate=True) as entry:
+            entry.read()
+
+
+def test_build_parallel(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed, workers=2)
+    assert extract_tree(packed, str(tmpdir.join('extracted'))) == read_tree(source_dir)
+
+
+def test_build_cache(source_dir, tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    first = str(tmpdir.join('first.cf'))
+    second = str(tmpdir.join('second.cf'))
+    onec_dtools.build(source_dir, first, cache_dir=cache_dir)
+    cached = sorted(os.listdir(cache_dir))
+    assert cached
+    # Повторная упаковка берет все данные из кэша и не добавляет в него новых записей
+    onec_dtools.build(source_dir, second, cache_dir=cache_dir, workers=2)
+    assert sorted(os.listdir(cache_dir)) == cached
+    assert extract_tree(second, str(tmpdir.join('second'))) == read_tree(source_dir)
+
+
+def test_update(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    size = os.path.getsize(packed)
+    with open(packed, 'r+b') as f, onec_dtools.ContainerUpdater(f) as container:
+        compressor = zlib.compressobj(wbits=-15)
+        container.add_data('version', compressor.compress(b'patched') + compressor.flush(), 0, 0)
+    assert os.path.getsize(packed) == size
+    with open(packed, 'rb') as f:
+        with onec_dtools.ContainerReader(f).open('version', inflate=True) as entry:
+            assert entry.read() == b'patched'
+
+    # Изменения каталога переносятся в контейнер
+    changed = str(tmpdir.join('changed'))
+    shutil.copytree(source_dir, changed)
+    with open(os.path.join(changed, 'f01', 'text'), 'ab') as f:
+        f.write(b'changed')
+    os.remove(os.path.join(changed, 'f02', 'text'))
+    with open(os.path.join(changed, 'added'), 'wb') as f:
+        f.write(b'added')
+    onec_dtools.update(packed, changed)
+    assert extract_tree(packed, str(tmpdir.join('updated'))) == read_tree(changed)
+
+
+def test_update_free_blocks(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    with open(packed, 'r+b') as f, onec_dtools.ContainerUpdater(f) as container:
+        container.delete('big')
+    size = os.path.getsize(packed)
+
+    # Мелкие файлы занимают части освободившегося блока, файл контейнера не растет
+    compressor = zlib.compressobj(wbits=-15)
+    data = compressor.compress(b'x' * 100) + compressor.flush()
+    with open(packed, 'r+b') as f, onec_dtools.ContainerUpdater(f) as container:
+        assert len(container.free_blocks) == 2
+        for i in range(60):
+            container.add_data('new{:02}'.format(i), data, 0, 0)
+        assert container.free_blocks
+    assert os.path.getsize(packed) == size
+
+    with open(packed, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f, validate=True)
+        assert list(reader.entries)[-60:] == ['new{:02}'.format(i) for i in range(60)]
+        for name in reader.entries:
+            with reader.open(name, inflate=True) as entry:
+                assert entry.read() == b'x' * 100 or not name.startswith('new')
+    os.remove(os.path.join(source_dir, 'big'))
+    extracted = extract_tree(packed, str(tmpdir.join('extracted')))
+    assert {k: v for k, v in extracted.items() if not k.startswith('new')} == read_tree(source_dir)
+
+
+def test_diff_containers(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    assert onec_dtools.diff_containers(packed, packed) == []
+
+    changed = str(tmpdir.join('changed'))
+    shutil.copytree(source_dir, changed)
+    with open(os.path.join(changed, 'f01', 'text'), 'ab') as f:
+        f.write(b'changed')
+    with open(os.path.join(changed, 'version'), 'wb') as f:
+        f.write(b'version\nchanged')
+    os.remove(os.path.join(changed, 'big'))
+    with open(os.path.join(changed, 'added'), 'wb') as f:
+        f.write(b'added')
+    onec_dtools.build(changed, str(tmpdir.join('changed.cf')))
+
+    Change = onec_dtools.container_diff.Change
+    changes = onec_dtools.diff_containers(packed, str(tmpdir.join('changed.cf')))
+    assert sorted(changes) == sorted([Change('big', 'removed', None), Change('added', 'added', None),
+                                      Change('f01', 'modified', None), Change('f01/text', 'modified', None),
+                                      Change('version', 'modified', None)])
+    changes = onec_dtools.diff_containers(packed, str(tmpdir.join('changed.cf')), content=True)
+    diffs = {x.name: x.diff for x in changes if x.diff}
+    assert sorted(diffs) == ['f01/text', 'version']
+    assert diffs['version'][2:] == ['@@ -1 +1,2 @@\n', '-version', '+version\n', '+changed']
+    assert diffs['f01/text'][-1] == '+changed'
+
+
+def test_build_64(source_dir, tmpdir):
+    container_reader = onec_dtools.container_reader
+    fmt = container_reader.FORMAT_64
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed, fmt=fmt)
+    with open(packed, 'rb') as f:
+        header = f.read(fmt.header_size)
+        assert header.startswith(container_reader.CONTAINER_SIGNATURE_64)
+        assert struct.unpack(fmt.header_format, header)[1] == 512
+        # Заголовок блока оглавления: 16 шестнадцатиричных цифр в каждом поле
+        block_header = f.read(fmt.block_header_size)
+        assert block_header.startswith(b'\r\n') and block_header.endswith(b' \r\n')
+        assert [len(x) for x in block_header.split()] == [16, 16, 16]
+
+        reader = onec_dtools.ContainerReader(f)
+        assert reader.format is fmt
+        # Вложенные контейнеры записываются в том же формате
+        with reader.open('f00', inflate=True) as entry:
+            nested = onec_dtools.ContainerReader(entry)
+            assert nested.format is fmt
+            assert list(nested.entries) == ['sub', 'text']
+    assert extract_tree(packed, str(tmpdir.join('extracted'))) == read_tree(source_dir)
+
+
+def test_build_parallel_64(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed, workers=2, fmt=onec_dtools.container_reader.FORMAT_64)
+    assert extract_tree(packed, str(tmpdir.join('extracted'))) == read_tree(source_dir)
+
+
+def synced_tree(folder):
+    tree = read_tree(folder)
+    del tree[onec_dtools.container_reader.SYNC_STATE]
+    return tree
+
+
+def test_sync(source_dir, tmpdir, monkeypatch):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    folder = str(tmpdir.join('synced'))
+    # 2 файла верхнего уровня и по 2 файла в каждом из 3 вложенных контейнеров
+    assert onec_dtools.sync(packed, folder)['written'] == 8
+    assert synced_tree(folder) == read_tree(source_dir)
+    with open(os.path.join(folder, 'extra'), 'wb') as f:
+        f.write(b'extra')
+
+    # Без изменений данные файлов не считываются, вложенные контейнеры не просматриваются
+    with monkeypatch.context() as m:
+        m.setattr(onec_dtools.container_reader, 'read_entry_data', None)
+        counter = onec_dtools.sync(packed, folder)
+    assert counter == {'unchanged': 5, 'deleted': 1}
+
+    counter = onec_dtools.sync(packed, folder, compare='hash')
+    assert counter['written'] == 0
+    assert counter['unchanged'] == 8
+    assert synced_tree(folder) == read_tree(source_dir)
+
+
+def test_sync_local_edits(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    folder = str(tmpdir.join('synced'))
+    onec_dtools.sync(packed, folder)
+
+    # Локальные изменения с сохранением времени изменения: в сжатом файле верхнего уровня
+    # и в файле вложенного контейнера
+    for path in (os.path.join(folder, 'version'), os.path.join(folder, 'f00', 'text')):
+        mtime = os.stat(path).st_mtime
+        with open(path, 'ab') as f:
+            f.write(b'local edit')
+        os.utime(path, (mtime, mtime))
+
+    # Каталог вложенного контейнера с прежним временем изменения не просматривается
+    assert onec_dtools.sync(packed, folder)['written'] == 1
+    assert onec_dtools.sync(packed, folder, compare='hash')['written'] == 1
+    assert synced_tree(folder) == read_tree(source_dir)
+
+
+def read_archive(path):
+    """
+    Считывает файлы архива: словарь {путь: данные}
+    """
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return {os.path.normpath(x.filename): archive.read(x) for x in archive.infolist() if not x.is_dir()}
+    with tarfile.open(path) as archive:
+        return {os.path.normpath(x.name): archive.extractfile(x).read() for x in archive.getmembers() if x.isfile()}
+
+
+def test_archive(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    archive = str(tmpdir.join('packed.tar'))
+    onec_dtools.extract_to_archive(packed, archive)
+    assert read_archive(archive) == read_tree(source_dir)
+    onec_dtools.extract_to_archive(packed, str(tmpdir.join('packed.zip')), 'zip')
+    assert read_archive(str(tmpdir.join('packed.zip'))) == read_tree(source_dir)
+
+    # Пустой каталог архива становится пустым вложенным контейнером
+    with tarfile.open(archive, 'a') as tar:
+        info = tarfile.TarInfo('f00/empty')
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+    with open(archive, 'rb') as f:
+        onec_dtools.build_from_tar(f, str(tmpdir.join('rebuilt.cf')))
+    onec_dtools.extract_to_archive(str(tmpdir.join('rebuilt.cf')), str(tmpdir.join('rebuilt.tar')))
+    with tarfile.open(archive) as tar, tarfile.open(str(tmpdir.join('rebuilt.tar'))) as rebuilt_tar:
+        assert sorted(tar.getnames()) == sorted(rebuilt_tar.getnames())
+    assert read_archive(str(tmpdir.join('rebuilt.tar'))) == read_tree(source_dir)
+    extract_tree(str(tmpdir.join('rebuilt.cf')), str(tmpdir.join('rebuilt')))
+    assert tmpdir.join('rebuilt', 'f00', 'empty').listdir() == []
+
+
+def test_container_fs(source_dir, tmpdir):
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    tree = read_tree(source_dir)
+    with open(packed, 'rb') as f, onec_dtools.ContainerFS(f, cache_size=2) as fs:
+        assert fs.listdir() == ['big', 'f00', 'f01', 'f02', 'version']
+        assert fs.listdir('f01/sub') == ['leaf']
+        assert fs.isdir('f02/sub') and not fs.isdir('f02/text')
+        assert fs.stat('f00/sub/leaf').size == 1000
+        assert fs.stat('f00/sub').is_dir
+
+        walked = {}
+        for dirpath, dirnames, filenames in fs.walk():
+            for name in filenames:
+                path = '/'.join([dirpath, name]) if dirpath else name
+                assert not fs.stat(path).is_dir
+                with fs.open(path) as entry:
+                    walked[os.path.normpath(path)] = entry.read()
+        assert walked == tree
+        # Повторное чтение после вытеснения вложенных контейнеров из кэша
+        with fs.open('f00/sub/leaf') as entry:
+            assert entry.read() == tree[os.path.join('f00', 'sub', 'leaf')]
+        with pytest.raises(KeyError):
+            fs.open('f00/missing')
+        with pytest.raises(IsADirectoryError):
+            fs.open('f00/sub')
+        assert fs.listdir() == list(onec_dtools.ContainerReader(f).entries)
+
+
+def test_validate_chains(source_dir, tmpdir):
+    container_reader = onec_dtools.container_reader
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(source_dir, packed)
+    with open(packed, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f, validate=True)
+        for name in reader.entries:
+            b''.join(reader.entries[name].data)
+        data_offset = reader.entries.data_offset('version')
+
+    def make_cycle(path, offset):
+        # Размер документа больше блока, следующий блок - он сам
+        with open(path, 'r+b') as f:
+            size, block_size, _ = container_reader.read_block_header(f, offset)
+            f.seek(offset)
+            f.write(onec_dtools.container_writer.block_header(size + block_size, block_size, offset))
+
+    broken_toc = str(tmpdir.join('broken_toc.cf'))
+    shutil.copy(packed, broken_toc)
+    make_cycle(broken_toc, container_reader.FORMAT_32.header_size)
+    with open(broken_toc, 'rb') as f, pytest.raises(BufferError):
+        onec_dtools.ContainerReader(f, validate=True)
+
+    broken_data = str(tmpdir.join('broken_data.cf'))
+    shutil.copy(packed, broken_data)
+    make_cycle(broken_data, data_offset)
+    with open(broken_data, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f, validate=True)
+        with pytest.raises(BufferError):
+            b''.join(reader.entries['version'].data)
+        with pytest.raises(BufferError):
+            with reader.open('version') as entry:
+                entry.read()
+
+
+def test_validate_truncated_document(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('big').write_binary(os.urandom(100000))
+    packed = str(tmpdir.join('packed.cf'))
+    onec_dtools.build(str(src), packed)
+    with open(packed, 'r+b') as f:
+        f.truncate(os.path.getsize(packed) - 31)
+
+    with open(packed, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f)
+        with reader.open('big') as entry:
+            # Без проверки данные молча обрываются
+            assert len(entry.read()) < reader.entries['big'].size
+    with open(packed, 'rb') as f:
+        reader = onec_dtools.ContainerReader(f, validate=True)
+        for inflate in (False, True):
+            with reader.open('big', inflate=inflate) as entry, pytest.raises(BufferError):
+                entry.read()
@@ -1,17 +1,183 @@
 # -*- coding: utf-8 -*-
+from struct import pack
+import csv
+import datetime
+import json
 import os
+import sqlite3
 import sys
 import pytest
 import onec_dtools
 
+PAGE_SIZE = 4096
+ROOT_PAGE = onec_dtools.database_reader.ROOT_OBJECT_OFFSET
+# Таблицы синтетической БД: имя, поля (имя, тип, NULL, длина, точность), индексы (имя, поля)
+SYNTHETIC_TABLES = [
+    ('V8USERS', [('ID', 'B', 0, 16, 0), ('NAME', 'NVC', 0, 64, 0), ('SHOW', 'L', 0, 0, 0), ('DATA', 'I', 1, 0, 0)],
+     [('PK', ['ID'])]),
+    ('_REFERENCE1', [('_IDRREF', 'B', 0, 16, 0), ('_DESCRIPTION', 'NVC', 1, 25, 0), ('_CODE', 'N', 0, 5, 0),
+                     ('_PRICE', 'N', 0, 9, 2), ('_DATE', 'DT', 0, 0, 0)],
+     [('BYID', ['_IDRREF'])]),
+    ('_DOCUMENT2', [('_IDRREF', 'B', 0, 16, 0), ('_FLD1RREF', 'B', 1, 16, 0), ('_CONTENT', 'NT', 0, 0, 0)], []),
+]
+
+
+def reference_id(i):
+    return pack('>QQ', 0, i)
+
+
+def synthetic_rows():
+    """
+    Строки синтетической БД: {имя таблицы: список строк}. None - пустая (удаленная) строка
+    """
+    users = [[reference_id(i), 'Пользователь {}'.format(i), i % 2 == 0,
+              bytes((i * k) % 256 for k in range(300 * i)) if i else None] for i in range(4)]
+    users.insert(2, None)
+    references = [[reference_id(100 + i), None if i == 3 else 'Элемент {}'.format(i), i, 1000 + i + 0.25,
+                   datetime.datetime(2017, 1, 1, 12, 30) + datetime.timedelta(days=i, seconds=i)] for i in range(40)]
+    references[5] = None
+    documents = [[reference_id(200 + i), None if i == 2 else reference_id(100 + i * 7), 'Текст ' * (60 * i)]
+                 for i in range(5)]
+    return {'V8USERS': users, '_REFERENCE1': references, '_DOCUMENT2': documents}
+
+
+def encode_value(value, field_type, length, precision):
+    """
+    Преобразует значение поля во внутренний формат 1С
+    """
+    if field_type == 'B':
+        return value
+    elif field_type == 'L':
+        return pack('?', value)
+    elif field_type == 'N':
+        digits = '{:0{}d}'.format(int(round(value * 10 ** precision)), length)
+        return bytes.fromhex(('1' + digits).ljust((length // 2 + 1) * 2, '0'))
+    elif field_type == 'NVC':
+        data = value.encode('utf-16-le')
+        return pack('H', len(data) // 2) + data.ljust(length * 2, b'\x00')
+    elif field_type == 'DT':
+        return bytes.fromhex(value.strftime('%Y%m%d%H%M%S'))
+    raise ValueError(field_type)
+
+
+class SyntheticDatabase(object):
+    """
+    Построитель файла БД формата 8.2.14: страницы по 4096 байт, объекты БД с одной страницей размещения
+    """
+    def __init__(self):
+        # Страницы 0 - 2: заголовок файла, объект свободных страниц, корневой объект
+        self.pages = [b'', b'', b'']
+
+    def add_object(self, data, page=None):
+        """
+        Размещает объект БД и возвращает номер его первой страницы
+        """
+        if page is None:
+            page = len(self.pages)
+            self.pages.append(b'')
+        data_pages = []
+        for i in range(0, len(data), PAGE_SIZE):
+            data_pages.append(len(self.pages))
+            self.pages.append(data[i:i + PAGE_SIZE])
+        index_pages = []
+        if data_pages:
+            index_pages.append(len(self.pages))
+            self.pages.append(pack('i{}I'.format(len(data_pages)), len(data_pages), *data_pages))
+        self.pages[page] = pack('8s3iI{}I'.format(len(index_pages)), b'1CDBOBV8', len(data), 0, 0, 0, *index_pages)
+        return page
+
+    def add_blobs(self, values):
+        """
+        Размещает объект BLOB: блоки по 256 байт, нулевой блок не используется
+
+        :return: номер страницы объекта и список пар (номер первого блока, размер) для значений
+        """
+        chunks = [b'\x00' * 256]
+        references = []
+        for value in values:
+            parts = [value[i:i + 250] for i in range(0, len(value), 250)]
+            references.append((len(chunks), len(value)))
+            for i, part in enumerate(parts):
+                next_block = len(chunks) + 1 if i + 1 < len(parts) else 0
+                chunks.append(pack('Ih250s', next_block, len(part), part))
+        return self.add_object(b''.join(chunks)), references
+
+    def add_table(self, name, fields, indexes, rows):
+        """
+        Размещает объекты данных и BLOB таблицы и возвращает описание таблицы во внутреннем формате 1С
+        """
+        blob_values = []
+        for row in rows:
+            for (_, field_type, _, _, _), value in zip(fields, row or []):
+                if field_type in ('I', 'NT') and value is not None:
+                    blob_values.append(value.encode('utf-16-le') if field_type == 'NT' else value)
+        blob_offset, blob_references = self.add_blobs(blob_values) if blob_values else (0, [])
+        blob_references = iter(blob_references)
+
+        row_length = 1 + sum(null + onec_dtools.database_reader.calc_field_size(field_type, length)
+                             for _, field_type, null, length, _ in fields)
+        data = []
+        for row in rows:
+            if row is None:
+                data.append(b'\x01'.ljust(row_length, b'\x00'))
+                continue
+            values = [b'\x00']
+            for (_, field_type, null, length, precision), value in zip(fields, row):
+                size = onec_dtools.database_reader.calc_field_size(field_type, length)
+                if value is None:
+                    values.append(b'\x00' * (1 + size))
+                    continue
+                if null:
+                    values.append(b'\x01')
+                if field_type in ('I', 'NT'):
+                    values.append(pack('2I', *next(blob_references)))
+                else:
+                    values.append(encode_value(value, field_type, length, precision))
+            data.append(b''.join(values))
+        data_offset = self.add_object(b''.join(data))
+
+        field_lines = ',\n'.join('{{"{}","{}",{},{},{},"CS"}}'.format(*field) for field in fields)
+        index_lines = ''.join(',\n{{"{}","{}",\n{}\n}}'.format(
+            index_name, int(i == 0), ',\n'.join('{{"{}","0"}}'.format(x) for x in index_fields))
+            for i, (index_name, index_fields) in enumerate(indexes))
+        return '{{"{}",0,\n{{"Fields",\n{}\n}},\n{{"Indexes"{}\n}},\n{{"Recordlock","0"}},\n' \
+               '{{"Files",{},{},0}}\n}}'.format(name, field_lines, index_lines, data_offset, blob_offset)
+
+    def write(self, path, tables):
+        descriptions = [self.add_table(name, fields, indexes, rows) for name, fields, indexes, rows in tables]
+        description_offsets = [self.add_object(x.encode('utf-16')) for x in descriptions]
+        self.add_object(pack('32si{}i'.format(len(tables)), b'ru_RU', len(tables), *description_offsets),
+                        ROOT_PAGE)
+        self.add_object(b'', 1)
+        self.pages[0] = pack('8s4bIi', b'1CDBMSV8', 8, 2, 14, 0, len(self.pages), 0)
+        with open(path, 'wb') as f:
+            for page in self.pages:
+                f.write(page.ljust(PAGE_SIZE, b'\x00'))
+
+
+@pytest.fixture
+def synthetic_db(tmpdir):
+    """
+    Синтетический файл БД формата 8.2.14: таблицы со ссылками, пустыми строками, NULL и полями неограниченной длины
+    """
+    path = str(tmpdir.join('synthetic.1CD'))
+    rows = synthetic_rows()
+    SyntheticDatabase().write(path, [(name, fields, indexes, rows[name])
+                                     for name, fields, indexes in SYNTHETIC_TABLES])
+    return path
+
 
 @pytest.yield_fixture(params=[
     'Platform8Demo/8-2-14.1CD',
     'Platform8Demo/8-3-8_4K.1CD',
-    'Platform8Demo/8-3-8_8K.1CD'
+    'Platform8Demo/8-3-8_8K.1CD',
+    'synthetic',
 ])
 def db_file(request):
-    file_path = os.path.join(sys.path[0], 'fixtures', request.param)
+    if request.param == 'synthetic':
+        file_path = request.getfixturevalue('synthetic_db')
+    else:
+        file_path = os.path.join(sys.path[0], 'fixtures', request.param)
     with open(file_path, 'rb') as f:
         yield f
 
@@ -28,3 +194,273 @@ def test_parse_whole_db(db_file):
                 # Чтение полей неограниченной длины
                 if hasattr(field_value, 'value'):
                     _ = field_value.value
+
+
+def test_export_sqlite(db_file, tmpdir):
+    """
+    Дымовой тест выгрузки всех таблиц БД в SQLite
+    """
+    db = onec_dtools.DatabaseReader(db_file)
+    onec_dtools.DatabaseExporter(db).export(str(tmpdir.join('export.sqlite')))
+
+
+def test_export_checkpoint(db_file, tmpdir):
+    """
+    Повторная выгрузка с контрольной точкой пропускает выгруженные таблицы
+    """
+    db = onec_dtools.DatabaseReader(db_file)
+    checkpoint = str(tmpdir.join('export.checkpoint'))
+    for _ in range(2):
+        onec_dtools.DatabaseExporter(db, checkpoint=checkpoint).export(str(tmpdir.join('csv')), 'csv')
+
+
+def test_hash_index(db_file):
+    """
+    Поиск строк таблицы по хэш-индексу
+    """
+    db = onec_dtools.DatabaseReader(db_file)
+    resolver = db.resolver()
+    for table_name, table in db.tables.items():
+        if '_IDRREF' not in table.fields:
+            continue
+        for row in table:
+            if row.is_empty:
+                continue
+            assert resolver.get(table_name, row['_IDRREF'])['_IDRREF'] == row['_IDRREF']
+
+
+def test_sidecar_index(db_file, tmpdir):
+    """
+    Поиск строк таблицы по файлу индекса
+    """
+    db = onec_dtools.DatabaseReader(db_file)
+    table = db.tables['V8USERS']
+    path = str(tmpdir.join('V8USERS.ID.idx'))
+    table.build_sidecar('ID', path)
+    for row in table:
+        if row.is_empty:
+            continue
+        assert table.lookup_sidecar('ID', row['ID'], path)['ID'] == row['ID']
+
+
+def test_read_stats(db_file):
+    """
+    Сбор статистики чтения
+    """
+    events = []
+    onec_dtools.stats.enable(lambda event, values: events.append(event))
+    try:
+        db = onec_dtools.DatabaseReader(db_file)
+        for row in db.tables['V8USERS']:
+            row.as_dict(read_blobs=True)
+        assert onec_dtools.stats.get_stats()['counters']['db_object.calls'] > 0
+        assert events
+    finally:
+        onec_dtools.stats.disable()
+
+
+def expected_rows(table_name):
+    return [x for x in synthetic_rows()[table_name] if x is not None]
+
+
+def test_export_synthetic(synthetic_db, tmpdir):
+    """
+    Выгрузка синтетической БД в SQLite, CSV и JSON Lines
+    """
+    with open(synthetic_db, 'rb') as f:
+        db = onec_dtools.DatabaseReader(f)
+        onec_dtools.DatabaseExporter(db).export(str(tmpdir.join('export.sqlite')))
+        onec_dtools.DatabaseExporter(db).export(str(tmpdir.join('csv')), 'csv')
+        onec_dtools.DatabaseExporter(db, tables=['_REFERENCE1'], columns={'_REFERENCE1': ['_CODE', '_DATE']}) \
+            .export(str(tmpdir.join('jsonl')), 'jsonl')
+        onec_dtools.DatabaseExporter(db, tables=['V8USERS'], blobs='files', blob_dir=str(tmpdir.join('blobs'))) \
+            .export(str(tmpdir.join('files.sqlite')))
+
+    connection = sqlite3.connect(str(tmpdir.join('export.sqlite')))
+    try:
+        for table_name in ('V8USERS', '_REFERENCE1', '_DOCUMENT2'):
+            rows = connection.execute('SELECT * FROM "{}" ORDER BY rowid'.format(table_name)).fetchall()
+            expected = [[onec_dtools.database_export.to_sqlite(value) for value in row]
+                        for row in expected_rows(table_name)]
+            assert [list(row) for row in rows] == expected
+        indexes = [x[0] for x in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert sorted(indexes) == ['V8USERS_PK', '_REFERENCE1_BYID']
+    finally:
+        connection.close()
+
+    with open(str(tmpdir.join('csv', '_REFERENCE1.csv')), encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['_IDRREF', '_DESCRIPTION', '_CODE', '_PRICE', '_DATE']
+    assert rows[1] == ['00000000000000000000000000000064', 'Элемент 0', '0', '1000.25', '2017-01-01T12:30:00']
+    assert len(rows) == 1 + len(expected_rows('_REFERENCE1'))
+
+    with open(str(tmpdir.join('jsonl', '_REFERENCE1.jsonl')), encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[1] == {'_CODE': 1, '_DATE': '2017-01-02T12:30:01'}
+
+    connection = sqlite3.connect(str(tmpdir.join('files.sqlite')))
+    try:
+        paths = [x[0] for x in connection.execute('SELECT DATA FROM V8USERS ORDER BY rowid')]
+    finally:
+        connection.close()
+    assert paths[0] is None
+    for path, row in zip(paths[1:], expected_rows('V8USERS')[1:]):
+        with open(str(tmpdir.join('blobs', path)), 'rb') as f:
+            assert f.read() == row[3]
+
+
+class InterruptedExporter(onec_dtools.DatabaseExporter):
+    """
+    Выгрузка, прерываемая на заданной строке таблицы
+    """
+    def __init__(self, db, table_name, row_count, **kwargs):
+        super().__init__(db, **kwargs)
+        self.table_name = table_name
+        self.row_count = row_count
+
+    def rows(self, table, start=0):
+        for i, item in enumerate(super().rows(table, start)):
+            if table.name == self.table_name and i == self.row_count:
+                raise RuntimeError('Export interrupted')
+            yield item
+
+
+def read_export(path, fmt):
+    if fmt != 'sqlite':
+        return read_tree(path)
+    connection = sqlite3.connect(path)
+    try:
+        return {name: connection.execute('SELECT * FROM "{}" ORDER BY rowid'.format(name)).fetchall()
+                for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        connection.close()
+
+
+def read_tree(path):
+    tree = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+            tree[name] = f.read()
+    return tree
+
+
+@pytest.mark.parametrize('fmt', ['sqlite', 'csv', 'jsonl'])
+def test_export_resume(synthetic_db, tmpdir, fmt):
+    """
+    Прерванная выгрузка продолжается с контрольной точки и дает тот же результат, что и выгрузка без прерывания
+    """
+    checkpoint = str(tmpdir.join('export.checkpoint'))
+    with open(synthetic_db, 'rb') as f:
+        db = onec_dtools.DatabaseReader(f)
+        onec_dtools.DatabaseExporter(db).export(str(tmpdir.join('full')), fmt)
+
+        exporter = InterruptedExporter(db, '_REFERENCE1', 25, batch_size=10, checkpoint=checkpoint)
+        with pytest.raises(RuntimeError):
+            exporter.export(str(tmpdir.join('resumed')), fmt)
+        state = onec_dtools.database_export.Checkpoint(checkpoint).tables
+        assert state['V8USERS']['done']
+        # Сохранены 2 полных пакета по 10 строк. Строка 5 пустая, поэтому продолжение начинается со строки 21
+        assert (state['_REFERENCE1']['row'], state['_REFERENCE1']['done']) == (21, False)
+
+        onec_dtools.DatabaseExporter(db, batch_size=10, checkpoint=checkpoint).export(str(tmpdir.join('resumed')), fmt)
+        assert all(x['done'] for x in onec_dtools.database_export.Checkpoint(checkpoint).tables.values())
+        assert read_export(str(tmpdir.join('resumed')), fmt) == read_export(str(tmpdir.join('full')), fmt)
+
+        # Выгруженные таблицы пропускаются
+        InterruptedExporter(db, 'V8USERS', 0, checkpoint=checkpoint).export(str(tmpdir.join('resumed')), fmt)
+        assert read_export(str(tmpdir.join('resumed')), fmt) == read_export(str(tmpdir.join('full')), fmt)
+
+
+def test_resolver_synthetic(synthetic_db):
+    """
+    Перебор строк с заданной строки, хэш-индексы и разыменование ссылок
+    """
+    rows = synthetic_rows()
+    with open(synthetic_db, 'rb') as f:
+        db = onec_dtools.DatabaseReader(f)
+        references = db.tables['_REFERENCE1']
+        assert [row['_CODE'] for row in references.iter_rows(37)] == [37, 38, 39]
+
+        index = references.build_hash_index('_IDRREF')
+        assert index == {row[0]: i for i, row in enumerate(rows['_REFERENCE1']) if row is not None}
+        # NULL в индекс не попадает
+        assert len(db.tables['_DOCUMENT2'].build_hash_index('_FLD1RREF')) == 4
+
+        resolver = onec_dtools.database_reader.Resolver(db.tables, cache_size=1)
+        for document, expected in zip(db.tables['_DOCUMENT2'], rows['_DOCUMENT2']):
+            reference = resolver.deref(document, '_FLD1RREF', '_REFERENCE1')
+            if expected[1] is None:
+                assert reference is None
+            else:
+                assert reference['_IDRREF'] == expected[1]
+                assert reference['_DESCRIPTION'] == 'Элемент {}'.format(int.from_bytes(expected[1], 'big') - 100)
+        assert resolver.get('_REFERENCE1', reference_id(105)) is None
+        assert resolver.get('V8USERS', reference_id(3), 'ID')['NAME'] == 'Пользователь 3'
+        # Индекс вытеснен из кэша размером 1
+        assert list(resolver._indexes) == [('V8USERS', 'ID')]
+        assert db.resolver() is db.resolver()
+
+
+def test_sidecar_synthetic(synthetic_db, tmpdir):
+    """
+    Построение файлов индекса, поиск по ним и перестроение после изменения таблицы
+    """
+    first = str(tmpdir.join('first.idx'))
+    second = str(tmpdir.join('second.idx'))
+    with open(synthetic_db, 'rb') as f:
+        table = onec_dtools.DatabaseReader(f).tables['V8USERS']
+        assert table.build_sidecar('ID', first) == first
+        for i in range(4):
+            assert table.lookup_sidecar('ID', reference_id(i), first)['NAME'] == 'Пользователь {}'.format(i)
+        assert table.lookup_sidecar('ID', reference_id(10), first) is None
+        # Индекс по другому пути строится отдельно
+        assert table.lookup_sidecar('ID', reference_id(3), second)['NAME'] == 'Пользователь 3'
+        assert os.path.exists(second)
+
+        # Файл БД изменился: строки таблицы сдвинулись
+        rows = synthetic_rows()
+        rows['V8USERS'].insert(0, [reference_id(10), 'Пользователь 10', True, None])
+        SyntheticDatabase().write(synthetic_db, [(name, fields, indexes, rows[name])
+                                                 for name, fields, indexes in SYNTHETIC_TABLES])
+        assert table.lookup_sidecar('ID', reference_id(3), first)['NAME'] == 'Пользователь 3'
+        assert table.lookup_sidecar('ID', reference_id(10), first)['NAME'] == 'Пользователь 10'
+
+
+def test_stats_synthetic(synthetic_db):
+    """
+    Счетчики статистики чтения
+    """
+    events = []
+    onec_dtools.stats.enable(lambda event, values: events.append(event))
+    try:
+        with open(synthetic_db, 'rb') as f:
+            db = onec_dtools.DatabaseReader(f)
+            rows = [row for row in db.tables['V8USERS'] if not row.is_empty]
+            assert [row.as_dict(read_blobs=True)['DATA'] for row in rows] == [x[3] for x in expected_rows('V8USERS')]
+            counters = onec_dtools.stats.get_stats()['counters']
+            # BLOB по 250 байт данных в блоке: 300, 600 и 900 байт
+            assert counters['blob.chunks'] == 2 + 3 + 4
+            assert counters['blob.bytes'] == 300 + 600 + 900
+            assert counters['row.cache_misses'] == 4 * 4
+            # Поле BLOB читается as_dict дважды: проверка на NULL и значение
+            assert counters['row.cache_hits'] == 4
+            assert counters['db_object.calls'] > 0
+            assert counters['db_object.bytes'] >= counters['blob.chunks'] * 256
+
+            # Повторное чтение полей той же строки берется из кэша строки
+            for row in rows:
+                row.as_dict()
+            assert onec_dtools.stats.get_stats()['counters']['row.cache_hits'] == 4 + 4 * 4
+
+            resolver = db.resolver()
+            for i in range(3):
+                assert resolver.get('V8USERS', reference_id(i), 'ID')['NAME'] == 'Пользователь {}'.format(i)
+            counters = onec_dtools.stats.get_stats()['counters']
+            assert (counters['resolver.cache_misses'], counters['resolver.cache_hits']) == (1, 2)
+
+        timings = onec_dtools.stats.get_stats()['timings']
+        assert sorted(timings) == ['convert.B', 'convert.I', 'convert.L', 'convert.NVC']
+        assert set(events) == {'db_object', 'blob', 'row', 'resolver', 'time'}
+    finally:
+        onec_dtools.stats.disable()
+    assert onec_dtools.stats.get_stats() == {}
@@ -2,8 +2,11 @@
 import os
 import sys
 import shutil
+import io
+import zlib
 import pytest
 import onec_dtools
+from onec_dtools.supply_reader import InflatingStream, EXTRACTED_SUFFIX
 
 
 @pytest.fixture(params=['Platform8Demo/1cv8.efd'])
@@ -23,3 +26,50 @@ def test_unpack(supply_file, unpack_dir):
     with open(supply_file, 'rb') as f:
         onec_dtools.SupplyReader(f).unpack(unpack_dir)
 
+
+def test_inflating_stream():
+    data = os.urandom(100000) + b'\x00' * 100000
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    stream = InflatingStream(io.BytesIO(compressor.compress(data) + compressor.flush()), 1024)
+    out_file = io.BytesIO()
+    assert stream.read(10) == data[:10]
+    assert stream.copy_to(out_file, 150000) == 150000
+    assert out_file.getvalue() == data[10:150010]
+    assert stream.read(100000) == data[150010:]
+    assert stream.read(1) == b''
+
+
+def test_extract(supply_file, tmpdir):
+    with open(supply_file, 'rb') as f:
+        supply_reader = onec_dtools.SupplyReader(f)
+        included_files = supply_reader.list()
+        assert included_files
+        names = [x[0] for x in included_files if x[0].endswith('.mft')]
+        assert supply_reader.extract(['*.mft'], str(tmpdir)) == names
+    for name in names:
+        assert tmpdir.join(*name.split('\\')).check(file=1)
+
+
+def test_unpack_extract_containers(supply_file, tmpdir):
+    with open(supply_file, 'rb') as f:
+        onec_dtools.SupplyReader(f).unpack(str(tmpdir), extract_containers=True, workers=2)
+    extracted = [x for x in tmpdir.visit() if x.basename.endswith(EXTRACTED_SUFFIX)]
+    assert extracted
+    assert all(x.check(dir=1) for x in extracted)
+
+
+def test_build_supply(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('1cv8.mft').write_binary(b'mft')
+    src.mkdir('sub').join('data.bin').write_binary(os.urandom(100000))
+    description = {'ru': ('Поставка', 'Поставщик', '1cv8.mft')}
+    supply_path = str(tmpdir.join('1cv8.efd'))
+    onec_dtools.build_supply(str(src), supply_path, description)
+
+    with open(supply_path, 'rb') as f:
+        supply_reader = onec_dtools.SupplyReader(f)
+        supply_reader.unpack(str(tmpdir.join('unpack')))
+    assert supply_reader.description == description
+    assert [x[0] for x in supply_reader.included_files] == ['1cv8.mft', 'sub\\data.bin']
+    for path in ('1cv8.mft', 'sub/data.bin'):
+        assert tmpdir.join('unpack', path).read_binary() == src.join(path).read_binary()